@@ -0,0 +1,49 @@
+"""
+Throughput of the backfill parse stage as the number of process workers grows.
+Run from the repo root: python -m benchmarks.parse_scaling [num_pages]
+"""
+import os
+import sys
+import time
+
+from benchmarks.sample_pages import build_match_pages, build_match
+from src.match_ingest import parse_match_pages
+from src.scrape_engine import build_parse_executor
+
+
+def get_worker_counts() -> list[int]:
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= os.cpu_count():
+        worker_counts.append(worker_counts[-1] * 2)
+    if worker_counts[-1] != os.cpu_count():
+        worker_counts.append(os.cpu_count())
+    return worker_counts
+
+
+def run_parse_benchmark(num_pages: int, parse_workers: int, parse_executor: str = "process") -> float:
+    matches = [build_match(i) for i in range(num_pages)]
+    pages = [build_match_pages(i) for i in range(num_pages)]
+    with build_parse_executor({"parse_executor": parse_executor, "parse_workers": parse_workers}) as executor:
+        # Start the workers before timing so only the parsing is measured
+        list(executor.map(parse_match_pages, pages[:parse_workers], matches[:parse_workers]))
+        start = time.perf_counter()
+        records = list(executor.map(parse_match_pages, pages, matches, chunksize=4))
+        elapsed = time.perf_counter() - start
+    assert len(records) == num_pages
+    return num_pages / elapsed
+
+
+def main(num_pages: int = 200):
+    print(f"Parsing {num_pages} matches (team stats and player stats pages)")
+    print(f"{'executor':>8} {'workers':>7} {'matches/s':>10} {'speedup':>8}")
+    baseline = None
+    for parse_executor in ("thread", "process"):
+        for parse_workers in get_worker_counts():
+            throughput = run_parse_benchmark(num_pages, parse_workers, parse_executor)
+            if baseline is None:
+                baseline = throughput
+            print(f"{parse_executor:>8} {parse_workers:>7} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+End-to-end benchmark of the refresh_db and update_recent_data flows. Pages are replayed from a generated corpus
+and written to a SQLite DB in place of MySQL so it runs on a laptop without the network or a DB server.
+Run from the repo root: python -m benchmarks.pipeline [num_seasons] [matches_per_season] [latency_ms]
+"""
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+from benchmarks.sample_pages import build_pipeline_corpus
+from settings.settings import page_cache_settings, metrics_settings, recovery_settings
+from src import main
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.metrics import metrics
+from src.web_scraping.fetcher import fetch_stats
+from src.web_scraping.replay import replay_corpus
+
+
+def run_flow(flow, quiet: bool = True) -> dict:
+    fetch_stats.reset()
+    metrics.reset()
+    start = time.perf_counter()
+    # The flows print every match they write
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        flow()
+    elapsed = time.perf_counter() - start
+    stage_secs = {"fetch": metrics.get_total("eihl_fetch_seconds"),
+                  "parse": metrics.get_total("eihl_scrape_stage_seconds", stage="parse"),
+                  "write": metrics.get_total("eihl_scrape_stage_seconds", stage="write")}
+    stage_secs.update({function: metrics.get_total("eihl_db_seconds", function=function)
+                       for function in ("fetch_all_data", "get_dup_records", "insert_data", "update_data",
+                                        "upsert_data")})
+    stage_secs["commit"] = metrics.get_total("eihl_db_commit_seconds")
+    return {"elapsed": elapsed,
+            "pages": fetch_stats.summary()["requests"],
+            "rows": int(metrics.get_total("eihl_db_rows_written_total")),
+            "stage_secs": stage_secs}
+
+
+def print_flow_result(name: str, result: dict):
+    elapsed = result["elapsed"]
+    print(f"\n{name}: {elapsed:.2f}s, {result['pages']} pages ({result['pages'] / elapsed:.1f} pages/s), "
+          f"{result['rows']} rows written ({result['rows'] / elapsed:.1f} rows/s)")
+    # Fetching, parsing and writing overlap in the scrape engine so the stages add up to more than the total
+    for stage, secs in result["stage_secs"].items():
+        print(f"  {stage:>15} {secs:>8.2f}s")
+
+
+def run_pipeline_benchmark(num_seasons: int = 3, matches_per_season: int = 100, latency_ms: float = 0,
+                           work_dir: str or Path = None) -> dict[str, dict]:
+    with tempfile.TemporaryDirectory() if work_dir is None else contextlib.nullcontext(work_dir) as work_dir:
+        work_dir = Path(work_dir)
+        num_pages = build_pipeline_corpus(work_dir / "corpus", num_seasons, matches_per_season)
+        print(f"Replaying {num_pages} pages of {num_seasons} seasons with {latency_ms}ms latency per page")
+        db_path = work_dir / "eihlstats.sqlite3"
+        db_path.unlink(missing_ok=True)
+        prev_handler_func, prev_cache_enabled = main.db_handler_func, page_cache_settings.get("enabled", False)
+        prev_metrics_dir = metrics_settings.get("export_dir", None)
+        prev_recovery_settings = dict(recovery_settings)
+        main.db_handler_func = partial(EIHLSqliteHandler, str(db_path))
+        # Every page is parsed rather than answered from the page cache
+        page_cache_settings["enabled"] = False
+        metrics_settings["export_dir"] = work_dir / "metrics"
+        recovery_settings.update({"dead_letter_dir": work_dir / "dead_letters",
+                                  "checkpoint_dir": work_dir / "checkpoints"})
+        try:
+            with replay_corpus(work_dir / "corpus", latency_ms / 1000):
+                results = {"refresh_db": run_flow(main.refresh_db),
+                           "update_recent_data": run_flow(main.update_recent_data)}
+        finally:
+            main.db_handler_func = prev_handler_func
+            page_cache_settings["enabled"] = prev_cache_enabled
+            metrics_settings["export_dir"] = prev_metrics_dir
+            recovery_settings.update(prev_recovery_settings)
+    for name, result in results.items():
+        print_flow_result(name, result)
+    return results
+
+
+if __name__ == "__main__":
+    run_pipeline_benchmark(*map(int, sys.argv[1:3]), *map(float, sys.argv[3:4]))
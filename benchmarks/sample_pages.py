@@ -0,0 +1,129 @@
+"""Generated EIHL pages with the same layout as the live site for benchmarking the parsers offline"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from settings.settings import eihl_schedule_url
+
+team_stats_rows = [("Shots", "31", "61"), ("Shots on goal", "25", "39"), ("Shots efficiency", "12.00%", "5.13%"),
+                   ("Power plays", "3", "3"), ("Power play efficiency", "66.67%", "33.33%"),
+                   ("Penalty minutes", "8", "8"), ("Penalty kill efficiency", "66.67%", "33.33%"),
+                   ("Saves", "37", "22"), ("Save percentage", "94.87%", "88.00%"), ("Faceoffs won", "40", "33")]
+player_cols = ["Jersey", "Player name", "Position", "G", "A", "PTS", "PIM", "PPG", "SHG", "+/-", "SOG", "S",
+               "FOW", "FOL"]
+goalie_cols = ["Jersey", "Player name", "W", "L", "SO", "SA", "GA", "MIN", "SVS%"]
+# Navigation, adverts and footers that the extractors throw away
+page_padding = "".join(f'<div class="nav-item"><a href="/news/{i}">News story {i}</a><p>{"Lorem ipsum " * 20}</p>'
+                       f'</div>' for i in range(150))
+
+
+def build_team_stats_page(match_num: int = 0) -> bytes:
+    stats = "".join(f"<div><span>{name}</span><span>{home}</span><span>{away}</span></div>"
+                    for name, home, away in team_stats_rows)
+    return (f"<html><head><title>Game {match_num}</title></head><body><header>{page_padding}</header>"
+            f'<main><div class="wrapper"><article><div><div>25 Jan 2023, 19:00</div>'
+            f'<div><div><img src="home.png"/><a><span>Fife</span><span>Flyers</span></a></div>'
+            f'<div><div>end</div><div class="match-score">3:{match_num % 5}</div></div>'
+            f'<div><a><span>Sheffield</span><span>Steelers</span></a></div></div></div></article>'
+            f'<div class="container"><div><h2>Team Stats</h2>{stats}</div></div></div></main>'
+            f"<footer>{page_padding}</footer></body></html>").encode()
+
+
+def build_table(cols: list[str], num_rows: int, match_num: int, first_row: int = 0) -> str:
+    header = "".join(f"<th>{col}</th>" for col in cols)
+    rows = []
+    for row_num in range(first_row, first_row + num_rows):
+        cells = [str(row_num + 1), f"Player {match_num}-{row_num}"] + \
+                [str((row_num + i + match_num) % 4) for i in range(len(cols) - 2)]
+        rows.append("<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>")
+    return f"<div><table><thead><tr>{header}</tr></thead><tbody>{''.join(rows)}</tbody></table></div>"
+
+
+def build_player_stats_page(match_num: int = 0) -> bytes:
+    tables = "".join(f"<h2>{team} - players</h2>{build_table(player_cols, 22, match_num)}"
+                     f"<h2>{team} - goalies</h2>{build_table(goalie_cols, 2, match_num, 22)}"
+                     for team in ("Fife Flyers", "Sheffield Steelers"))
+    return (f"<html><body><header>{page_padding}</header><main><div class=\"container\">{tables}</div></main>"
+            f"<footer>{page_padding}</footer></body></html>").encode()
+
+
+def build_match(match_num: int = 0) -> dict:
+    return {"match_id": match_num, "eihl_web_match_id": f"{match_num}-fif-she", "home_team": "Fife Flyers",
+            "away_team": "Sheffield Steelers", "home_score": 3, "away_score": match_num % 5}
+
+
+def build_match_pages(match_num: int = 0) -> dict[str, bytes]:
+    return {"team_stats": build_team_stats_page(match_num), "player_stats": build_player_stats_page(match_num)}
+
+
+def build_schedule_page(season_id: int, season_ids: list[int], matches: list[dict]) -> bytes:
+    season_options = "".join(f'<option value="/schedule?id_season={option_id}">Season {option_id}</option>'
+                             for option_id in season_ids)
+    rows = []
+    match_day = None
+    for match in matches:
+        if match["match_date"].date() != match_day:
+            match_day = match["match_date"].date()
+            rows.append(f"<h2>{match['match_date'].strftime('%A %d.%m.%Y')}</h2>")
+        score = f"{match['home_score']}:{match['away_score']}" if match["home_score"] is not None else "-:-"
+        rows.append(f"<div><span>{match['match_date'].strftime('%H:%M')}</span><span>{match['home_team']}   "
+                    f"{score}   {match['away_team']}</span><a href=\"/game/{match['eihl_web_match_id']}\">details</a>"
+                    f"</div>")
+    return (f"<html><body><header>{page_padding}</header><main><div class=\"wrapper\"><div>"
+            f"<select id=\"id_season\">{season_options}</select></div>"
+            f"<div class=\"container-fluid text-center text-md-left\">{''.join(rows)}</div></div></main>"
+            f"<footer>{page_padding}</footer></body></html>").encode()
+
+
+def build_season_matches(season_id: int, first_match_date: datetime, num_matches: int) -> list[dict]:
+    teams = ["Belfast Giants", "Cardiff Devils", "Coventry Blaze", "Dundee Stars", "Fife Flyers", "Glasgow Clan",
+             "Guildford Flames", "Manchester Storm", "Nottingham Panthers", "Sheffield Steelers"]
+    matches = []
+    for match_num in range(num_matches):
+        match_date = first_match_date + timedelta(days=match_num // 2, hours=19 - first_match_date.hour)
+        played = match_date < datetime.now()
+        home_team = teams[match_num % len(teams)]
+        away_team = teams[(match_num + 1 + match_num // len(teams)) % len(teams)]
+        matches.append({"eihl_web_match_id": f"{season_id}{match_num:04d}-{home_team[:3]}-{away_team[:3]}".lower(),
+                        "match_date": match_date, "home_team": home_team, "away_team": away_team,
+                        "home_score": 3 if played else None, "away_score": match_num % 5 if played else None})
+    return matches
+
+
+def build_pipeline_corpus(corpus_dir: str or Path, num_seasons: int = 3, matches_per_season: int = 100) -> int:
+    """
+    Write a replay corpus of the schedule, gamecentre, team stats and stats pages of num_seasons seasons.
+    The last season is in progress so some of its matches haven't been played.
+    Returns: number of pages in the corpus
+    """
+    from src.web_scraping.eihl_website_scraping import get_gamecentre_url, get_eihl_match_url
+    from src.player_stats import build_match_stats_url
+    from src.web_scraping.replay import get_corpus_key, get_corpus_file_name, save_corpus_index
+
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    corpus_index = {}
+
+    def save_page(url: str, content: bytes):
+        file_name = get_corpus_file_name(url)
+        (corpus_dir / file_name).write_bytes(content)
+        corpus_index[get_corpus_key(url)] = file_name
+
+    season_ids = list(range(100, 100 + num_seasons))
+    now = datetime.now()
+    for season_id in season_ids:
+        if season_id == season_ids[-1]:
+            first_match_date = now - timedelta(days=matches_per_season // 4)
+        else:
+            first_match_date = datetime(now.year - num_seasons + season_id - 100, 9, 1)
+        matches = build_season_matches(season_id, first_match_date, matches_per_season)
+        schedule_page = build_schedule_page(season_id, season_ids, matches)
+        save_page(get_gamecentre_url(season_id), schedule_page)
+        if season_id == season_ids[-1]:
+            save_page(eihl_schedule_url, schedule_page)
+        for match_num, match in enumerate(matches):
+            if match["home_score"] is None:
+                continue
+            save_page(get_eihl_match_url(match["eihl_web_match_id"]), build_team_stats_page(match_num))
+            save_page(build_match_stats_url(match["eihl_web_match_id"]), build_player_stats_page(match_num))
+    save_corpus_index(corpus_dir, corpus_index)
+    return len(corpus_index)
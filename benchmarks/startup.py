@@ -0,0 +1,54 @@
+"""
+Cold start time of the CLI. Each command is started in a new interpreter, the way a cron job or a container
+health check starts it, and timed against an interpreter that imports nothing.
+Run from the repo root: python -m benchmarks.startup [runs]
+"""
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from settings.settings import startup_settings
+
+repo_dir = Path(__file__).resolve().parents[1]
+# Dependencies that only the commands that scrape, write or export need
+heavy_modules = ("bs4", "lxml", "requests", "httpx", "mysql.connector", "psycopg2", "pyarrow", "numpy", "pandas")
+startup_commands = {
+    "import src.main": ["-c", "import src.main"],
+    "cli --help": ["-m", "src.cli", "--help"],
+    "cli sync --help": ["-m", "src.cli", "sync", "--help"]
+}
+
+
+def time_command(args: list[str], runs: int) -> float:
+    """Returns: milliseconds of the fastest of the runs of python with the args"""
+    run_times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=repo_dir, check=True, stdout=subprocess.DEVNULL)
+        run_times.append((time.perf_counter() - start) * 1000)
+    return min(run_times)
+
+
+def get_loaded_heavy_modules(code: str) -> list[str]:
+    """Returns: the heavy modules that running the code in a new interpreter imports"""
+    check_code = f"{code}\nimport sys\nprint(' '.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check_code], cwd=repo_dir, check=True, capture_output=True,
+                            text=True)
+    return result.stdout.split()
+
+
+def run_startup_benchmark(runs: int = None) -> dict[str, float]:
+    """Returns: milliseconds each command takes to start on top of a bare interpreter"""
+    if runs is None:
+        runs = startup_settings.get("runs", 5)
+    bare_ms = time_command(["-c", "pass"], runs)
+    results = {name: max(0.0, time_command(args, runs) - bare_ms) for name, args in startup_commands.items()}
+    print(f"Bare interpreter: {bare_ms:.0f}ms. Budget: {startup_settings.get('max_startup_ms', None)}ms")
+    for name, startup_ms in results.items():
+        print(f"  {name:>16} +{startup_ms:.0f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    run_startup_benchmark(*map(int, sys.argv[1:2]))
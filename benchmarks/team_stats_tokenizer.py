@@ -0,0 +1,42 @@
+"""
+Cost of reading the team stats of a match page: pairing the stat tokens alone and the whole extractor.
+Run from the repo root: python -m benchmarks.team_stats_tokenizer [num_pages] [repeats]
+"""
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.sample_pages import build_team_stats_page
+from src.utils import parse_html
+from src.web_scraping.eihl_website_scraping import get_team_stats_from_list, get_team_match_stats_from_html, \
+    match_stats_strainer
+
+
+def get_stat_tokens(res_beaus) -> list[str]:
+    stats_html = res_beaus.find("div", attrs={"class": "container"}).find("div")
+    return stats_html.get_text("|", strip=True).split("|")[1:]
+
+
+def time_per_page(func, pages: list, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page in pages:
+            func(page)
+    return (time.perf_counter() - start) / (len(pages) * repeats)
+
+
+def main(num_pages: int = 50, repeats: int = 200):
+    pages = [parse_html(build_team_stats_page(i), match_stats_strainer) for i in range(num_pages)]
+    stat_token_lists = [get_stat_tokens(res_beaus) for res_beaus in pages]
+    tokenize_time = time_per_page(lambda stat_tokens: get_team_stats_from_list(defaultdict(), defaultdict(),
+                                                                               stat_tokens),
+                                  stat_token_lists, repeats)
+    extract_time = time_per_page(get_team_match_stats_from_html, pages, max(repeats // 10, 1))
+    print(f"Team stats of {num_pages} pages ({len(stat_token_lists[0])} tokens per page)")
+    print(f"{'stage':>10} {'us/page':>9} {'pages/s':>10}")
+    for stage, stage_time in (("tokenize", tokenize_time), ("extract", extract_time)):
+        print(f"{stage:>10} {stage_time * 1e6:>9.1f} {1 / stage_time:>10.0f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 postgres_db_config = {
     "un": "eihlstats",
     "pw": "20?6Lo5weLL",
@@ -12,11 +14,138 @@ mysql_db_config = {
     "host": "localhost",
     "port": "3306"}
 
+# Local SQLite DB used in place of MySQL by the benchmarks (see data_handlers/eihl_sqlite.py)
+sqlite_db_config = {
+    "database": str(Path(__file__).resolve().parents[1] / "eihlstats.sqlite3")
+}
+
+mysql_pool_settings = {
+    # Max connections open to the MySQL server. Connections are only opened when they're needed
+    "pool_size": 5,
+    # Seconds to wait for a free connection before giving up
+    "checkout_timeout": 30,
+    "reconnect_attempts": 3,
+    "reconnect_delay": 1
+}
+
 eihl_base_url = "https://www.eliteleague.co.uk/"
 eihl_team_url = f"{eihl_base_url}team/"
 eihl_schedule_url = f"{eihl_base_url}schedule/"
 eihl_match_url = f"{eihl_base_url}game/"
 
+http_settings = {
+    # (connect, read) timeouts in seconds
+    "timeout": (5, 30),
+    # number of host pools kept alive and the max connections to a single host
+    "pool_connections": 4,
+    "pool_maxsize": 10,
+    "user_agent": "eihl_stat_collector",
+    # print the timing of every request as it completes
+    "log_requests": False,
+    # Directory of recorded pages to answer every request from instead of the website (see web_scraping/replay.py)
+    "replay_corpus_dir": None,
+    # Seconds added to every replayed request to stand in for the round trip to the website
+    "replay_latency": 0
+}
+
+fetch_scheduler_settings = {
+    # Requests to the website are throttled, retried and paused by the fetch scheduler. Replayed pages never are.
+    "enabled": True,
+    # Token bucket of requests started per second and the burst allowed above that rate
+    "requests_per_sec": 10,
+    "burst": 5,
+    # Requests in flight. The limit is halved on a 429/5xx or a slow response and grows back by one per round trip
+    "min_concurrency": 1,
+    "max_concurrency": 20,
+    # A response this many times slower than the average response counts as the website slowing down
+    "slow_response_factor": 3,
+    # Retries of a request that failed to connect, timed out or got one of retry_statuses.
+    # The delay before retry n is a random time up to retry_backoff * 2 ** n seconds (max max_retry_backoff)
+    "max_retries": 3,
+    "retry_backoff": 0.5,
+    "max_retry_backoff": 30,
+    "retry_statuses": (429, 500, 502, 503, 504),
+    # Failed requests in a row that open the circuit breaker. Every request is paused while it's open and the
+    # pause doubles each time it opens again without a request getting through (max max_breaker_cooldown)
+    "breaker_threshold": 5,
+    "breaker_cooldown": 60,
+    "max_breaker_cooldown": 600
+}
+
+page_cache_settings = {
+    "enabled": True,
+    "cache_dir": Path(__file__).resolve().parents[1] / ".page_cache",
+    "max_size_bytes": 512 * 1024 * 1024,
+    # Only read pages from the cache and never go to the website
+    "offline": False,
+    # (URL regex, seconds until a page must be revalidated). First match wins and None never expires.
+    "ttl_rules": [
+        (r"/schedule", 60 * 60),
+        (r"/game/", None)
+    ],
+    "default_ttl": 24 * 60 * 60
+}
+
+html_parser_settings = {
+    # BeautifulSoup tree builder. "html.parser" is the original (slower) parser to compare results against
+    "parser": "lxml",
+    # Only build the part of the page tree that each extractor reads
+    "use_strainers": True
+}
+
+backfill_settings = {
+    # Parsing dominates a backfill so it is spread over a process per CPU
+    "parse_executor": "process",
+    "parse_workers": None,
+    "db_batch_size": 200
+}
+
+scrape_state_settings = {
+    # Matches that have failed this many times in a row are skipped until their state is reset
+    "max_failures": 5,
+    # Complete matches played in the last recheck_days days are checked again, and their cached pages revalidated,
+    # in case the stats were corrected
+    "recheck_days": 3,
+    # A championship's schedule is no longer checked once it was scraped this many days after it ended
+    "championship_grace_days": 7,
+    # Matches read per query when looking for the matches to sync (see src/work_discovery.py)
+    "discovery_page_size": 500
+}
+
+recovery_settings = {
+    # Matches that fail to scrape are kept here with the error and their raw pages so they can be replayed
+    "dead_letter_dir": Path(__file__).resolve().parents[1] / ".dead_letters",
+    # Long runs save their progress here so an interrupted run resumes where it stopped
+    "checkpoint_dir": Path(__file__).resolve().parents[1] / ".checkpoints",
+    # Seconds between saves of a run's checkpoint
+    "checkpoint_interval": 30,
+    # Checkpoints older than this many seconds are ignored and the run starts from the beginning
+    "checkpoint_max_age": 7 * 24 * 60 * 60
+}
+
+championship_settings = {
+    # Seconds the cached list of championships is used before the website is checked for new championships
+    "options_max_age": 24 * 60 * 60,
+    # Season schedules fetched and parsed at once when discovering championships and syncing their matches
+    "schedule_workers": 4,
+    # Matches of a schedule upserted at once while a backfill walks the schedule
+    "schedule_batch_size": 50
+}
+
+async_scrape_settings = {
+    # Matches fetched at once. None uses fetch_scheduler_settings["max_concurrency"], which with the request rate
+    # limits the requests in flight however many matches are fetched
+    "max_concurrency": None,
+    # "thread" or "process" workers that parse the HTML off the event loop
+    "parse_executor": "thread",
+    # Number of parse workers. None uses a worker per CPU
+    "parse_workers": 4,
+    # Records written to the DB in a single call of the writer
+    "db_batch_size": 50,
+    # Max matches waiting in front of each of the fetch, parse and write stages. Bounds the pages held in memory
+    "queue_size": 100
+}
+
 match_team_stats_cols = {
     "Shots": "shots",
     "Shots on goal": "shots_on_goal",
@@ -66,3 +195,22 @@ eihl_teams = [
     "Guildford Flames",
     "Nottingham Panthers"
 ]
+
+stats_export_settings = {
+    # Parquet files are written under export_dir/<table>/<championship_id>/<YYYY-MM>.parquet
+    "export_dir": Path(__file__).resolve().parents[1] / "exports",
+    "compression": "snappy"
+}
+
+metrics_settings = {
+    # Metrics of a run are written at the end of it as a "prometheus" text file, a "json" summary or not at all (None)
+    "export_format": "json",
+    "export_dir": Path(__file__).resolve().parents[1] / "metrics"
+}
+
+startup_settings = {
+    # Max milliseconds a CLI command may take to start on top of a bare Python interpreter (see benchmarks/startup.py)
+    "max_startup_ms": 100,
+    # Cold starts timed for each command. The fastest is compared with the budget
+    "runs": 5
+}
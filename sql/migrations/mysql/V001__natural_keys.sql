@@ -0,0 +1,12 @@
+-- Natural keys that the upserts match on. They also make every dedup lookup and
+-- "match_id IN (...)" query an index lookup rather than a table scan
+ALTER TABLE `championship` ADD UNIQUE KEY `championship_eihl_web_id_uq` (`eihl_web_id`);
+
+ALTER TABLE `match` ADD UNIQUE KEY `match_natural_key_uq` (`match_date`, `home_team`, `away_team`);
+ALTER TABLE `match` ADD KEY `match_championship_idx` (`championship_id`, `match_date`);
+ALTER TABLE `match` ADD KEY `match_eihl_web_match_id_idx` (`eihl_web_match_id`);
+
+ALTER TABLE `match_team_stats` ADD UNIQUE KEY `match_team_stats_natural_key_uq` (`match_id`, `team_name`);
+
+ALTER TABLE `match_player_stats`
+	ADD UNIQUE KEY `match_player_stats_natural_key_uq` (`match_id`, `team_name`, `player_name`);
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS `match_scrape_state` (
+	`match_id` int NOT NULL,
+	`last_fetched` DATETIME NOT NULL,
+	`content_hash` char(64),
+	`has_score` BOOLEAN NOT NULL DEFAULT FALSE,
+	`has_team_stats` BOOLEAN NOT NULL DEFAULT FALSE,
+	`has_player_stats` BOOLEAN NOT NULL DEFAULT FALSE,
+	`failure_count` int NOT NULL DEFAULT 0,
+	`last_error` varchar(500),
+	CONSTRAINT `match_scrape_state_pk` PRIMARY KEY (`match_id`),
+	CONSTRAINT `match_scrape_state_fk0` FOREIGN KEY (`match_id`) REFERENCES `match`(`match_id`)
+);
+
+CREATE TABLE IF NOT EXISTS `championship_scrape_state` (
+	`eihl_web_id` int NOT NULL,
+	`last_fetched` DATETIME NOT NULL,
+	`content_hash` char(64),
+	`failure_count` int NOT NULL DEFAULT 0,
+	`last_error` varchar(500),
+	CONSTRAINT `championship_scrape_state_pk` PRIMARY KEY (`eihl_web_id`)
+);
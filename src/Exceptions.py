@@ -1,3 +1,28 @@
 class DBNotAvailable(Exception):
     def __str__(self):
         return "ERROR! There is no database available."
+
+
+class DBReadFailed(Exception):
+    def __init__(self, table: str = None):
+        self.table = table
+
+    def __str__(self):
+        return f"ERROR! Unable to read {self.table} from the database."
+
+
+class PageNotCached(Exception):
+    def __init__(self, url: str = None):
+        self.url = url
+
+    def __str__(self):
+        return f"ERROR! {self.url} is not in the page cache and the fetcher is offline."
+
+
+class PageNotAvailable(Exception):
+    def __init__(self, url: str = None, status_code: int = None):
+        self.url = url
+        self.status_code = status_code
+
+    def __str__(self):
+        return f"ERROR! {self.url} is not available. Status code: {self.status_code}"
@@ -0,0 +1,86 @@
+"""
+Progress of long runs such as a backfill is saved to a checkpoint file every few seconds so a run that was
+interrupted resumes where it stopped rather than scraping every match again. A run deletes its checkpoint
+once it finishes.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Iterable
+
+from settings.settings import recovery_settings
+
+
+class Checkpoint:
+    def __init__(self, name: str, checkpoint_dir: str or Path = None, interval: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if checkpoint_dir is None:
+            checkpoint_dir = recovery_settings["checkpoint_dir"]
+        if interval is None:
+            interval = recovery_settings.get("checkpoint_interval", 30)
+        self.name = name
+        self.path = Path(checkpoint_dir) / f"{name}.json"
+        self.interval = interval
+        self.clock = clock
+        # Kind of work item (e.g. "match") to the keys of the items that are done
+        self.done: dict[str, set] = {}
+        self._last_save = clock()
+        self._lock = threading.Lock()
+
+    def is_done(self, kind: str, key) -> bool:
+        return key in self.done.get(kind, ())
+
+    def get_pending(self, kind: str, items: Iterable[dict], key_col: str) -> list[dict]:
+        return [item for item in items if not self.is_done(kind, item.get(key_col, None))]
+
+    def mark_done(self, kind: str, *keys):
+        """Keys are saved at most once every interval seconds"""
+        with self._lock:
+            self.done.setdefault(kind, set()).update(keys)
+        if self.clock() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            checkpoint = {"name": self.name, "saved_at": time.time(),
+                          "done": {kind: sorted(keys) for kind, keys in self.done.items()}}
+            self._last_save = self.clock()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(checkpoint))
+            # Replaced in one step so an interruption never leaves half a checkpoint
+            os.replace(tmp_path, self.path)
+        except OSError:
+            print(f"ERROR saving the checkpoint {self.path}")
+            traceback.print_exc()
+
+    def complete(self):
+        self.path.unlink(missing_ok=True)
+
+
+def load_checkpoint(name: str, checkpoint_dir: str or Path = None, max_age: int = None) -> Checkpoint:
+    """
+    Returns: the checkpoint of the last run with the name when it didn't finish. Otherwise an empty checkpoint.
+    """
+    if max_age is None:
+        max_age = recovery_settings.get("checkpoint_max_age", None)
+    checkpoint = Checkpoint(name, checkpoint_dir)
+    try:
+        saved_checkpoint = json.loads(checkpoint.path.read_text())
+    except FileNotFoundError:
+        return checkpoint
+    except (OSError, ValueError):
+        print(f"ERROR unable to read the checkpoint {checkpoint.path}. Starting from the beginning")
+        traceback.print_exc()
+        return checkpoint
+    if max_age is not None and time.time() - saved_checkpoint.get("saved_at", 0) > max_age:
+        print(f"Checkpoint {checkpoint.path} is too old to resume from. Starting from the beginning")
+        return checkpoint
+    checkpoint.done = {kind: set(keys) for kind, keys in saved_checkpoint.get("done", {}).items()}
+    print(f"Resuming {name} from its checkpoint: " +
+          ", ".join(f"{len(keys)} {kind}s done" for kind, keys in checkpoint.done.items()))
+    return checkpoint
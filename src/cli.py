@@ -0,0 +1,181 @@
+"""
+Non-interactive command line interface so the scraper can be run from cron or split over several machines, e.g.
+    python -m src.cli sync
+    python -m src.cli sync --full --season 36 --parse-workers 8
+    python -m src.cli backfill --season 10 --season 22 --parse-executor process --dry-run
+    python -m src.cli export --season 36
+    python -m src.cli bench --seasons 3 --matches-per-season 100
+Running it without a command starts the interactive prompt of src/main.py.
+The scraper modules are only imported and the DB handler only created once a command runs, so --help doesn't
+load them or connect to a DB.
+"""
+import argparse
+import sys
+from datetime import datetime, time
+from functools import partial
+from typing import Callable
+
+# Dates are accepted in ISO format or the DD/MM/YYYY format of the interactive prompt
+date_formats = ("%Y-%m-%d", "%d/%m/%Y")
+# The Postgres handler can't write the scraped data (see data_handlers/eihl_postgres.py) so it isn't a choice
+db_names = ("mysql", "sqlite")
+
+
+def parse_date(date_str: str) -> datetime:
+    for date_fmt in date_formats:
+        try:
+            return datetime.strptime(date_str, date_fmt)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"{date_str} isn't a date. Use YYYY-MM-DD or DD/MM/YYYY")
+
+
+def get_db_handler_func(db_name: str, db_path: str = None) -> Callable:
+    """Returns: function that creates a handler of the DB. The handler's module is only imported here"""
+    if db_name == "sqlite":
+        from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+        return partial(EIHLSqliteHandler, db_path)
+    from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+    return EIHLMysqlHandler
+
+
+def build_match_filter(args: argparse.Namespace):
+    from src.work_discovery import MatchFilter
+
+    # Matches on the end date are played after midnight
+    end_date = datetime.combine(args.end_date, time.max) if args.end_date is not None else None
+    return MatchFilter(args.season or [], args.team or [], args.start_date, end_date)
+
+
+def build_scrape_settings(args: argparse.Namespace) -> dict:
+    """Returns: the worker flags that were given as overrides of the scrape settings"""
+    scrape_settings = {"max_concurrency": args.max_concurrency, "parse_workers": args.parse_workers,
+                       "parse_executor": args.parse_executor, "db_batch_size": args.db_batch_size}
+    return {key: value for key, value in scrape_settings.items() if value is not None}
+
+
+def use_db(args: argparse.Namespace):
+    from src import main
+
+    main.db_handler_func = get_db_handler_func(args.db, args.db_path)
+    return main
+
+
+def run_sync(args: argparse.Namespace):
+    main = use_db(args)
+    sync = main.refresh_db if args.full else main.update_recent_data
+    sync(build_match_filter(args), build_scrape_settings(args), args.dry_run)
+
+
+def run_backfill(args: argparse.Namespace):
+    from src.match_ingest import backfill_matches
+
+    main = use_db(args)
+    backfill_matches(main.db_handler_func, build_match_filter(args), build_scrape_settings(args), args.dry_run)
+
+
+def run_export(args: argparse.Namespace):
+    from src.stats_export import export_stats
+
+    main = use_db(args)
+    export_stats(main.db_handler_func, args.export_dir, args.season or None)
+
+
+def run_replay(args: argparse.Namespace):
+    from src.match_ingest import replay_dead_letters
+
+    main = use_db(args)
+    replay_dead_letters(main.db_handler_func)
+
+
+def run_migrate(args: argparse.Namespace):
+    use_db(args).migrate_db()
+
+
+def run_bench(args: argparse.Namespace):
+    from benchmarks.pipeline import run_pipeline_benchmark
+
+    run_pipeline_benchmark(args.seasons, args.matches_per_season, args.latency_ms)
+
+
+def add_db_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--db", choices=db_names, default="mysql", help="DB to write to (default: %(default)s)")
+    parser.add_argument("--db-path", help="file of the SQLite DB. Defaults to sqlite_db_config")
+
+
+def add_filter_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--season", type=int, action="append",
+                        help="EIHL website ID of a championship to scrape. Can be given more than once")
+    parser.add_argument("--team", action="append",
+                        help="part of the name of a team whose matches are scraped e.g. fife. Can be given more "
+                             "than once")
+    parser.add_argument("--start-date", type=parse_date, help="only scrape matches played on or after this date")
+    parser.add_argument("--end-date", type=parse_date, help="only scrape matches played on or before this date")
+
+
+def add_worker_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--max-concurrency", type=int, help="max matches fetched at once")
+    parser.add_argument("--parse-workers", type=int, help="number of workers that parse the pages")
+    parser.add_argument("--parse-executor", choices=("thread", "process"), help="type of the parse workers")
+    parser.add_argument("--db-batch-size", type=int, help="records written to the DB in a single call")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the matches that would be scraped without scraping or writing them")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.cli",
+                                     description="Scrape match, team and player stats from the EIHL website")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+
+    sync_parser = subparsers.add_parser("sync", help="sync new championships, matches and stats")
+    sync_parser.add_argument("--full", action="store_true",
+                             help="scrape every played match rather than only new, incomplete and recent matches")
+    add_db_args(sync_parser)
+    add_filter_args(sync_parser)
+    add_worker_args(sync_parser)
+    sync_parser.set_defaults(func=run_sync)
+
+    backfill_parser = subparsers.add_parser("backfill",
+                                            help="re-scrape every played match with a process pool of parsers")
+    add_db_args(backfill_parser)
+    add_filter_args(backfill_parser)
+    add_worker_args(backfill_parser)
+    backfill_parser.set_defaults(func=run_backfill)
+
+    export_parser = subparsers.add_parser("export", help="export the stats to Parquet files partitioned by "
+                                                         "championship and month")
+    add_db_args(export_parser)
+    export_parser.add_argument("--season", type=int, action="append",
+                               help="EIHL website ID of a championship to export. Can be given more than once")
+    export_parser.add_argument("--export-dir", help="defaults to stats_export_settings")
+    export_parser.set_defaults(func=run_export)
+
+    bench_parser = subparsers.add_parser("bench", help="benchmark the sync against a generated replay corpus")
+    bench_parser.add_argument("--seasons", type=int, default=3)
+    bench_parser.add_argument("--matches-per-season", type=int, default=100)
+    bench_parser.add_argument("--latency-ms", type=float, default=0, help="round trip time of each page")
+    bench_parser.set_defaults(func=run_bench)
+
+    replay_parser = subparsers.add_parser("replay", help="scrape only the matches and schedules that were saved "
+                                                         "as dead letters")
+    add_db_args(replay_parser)
+    replay_parser.set_defaults(func=run_replay)
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply the schema migrations the DB doesn't have yet")
+    add_db_args(migrate_parser)
+    migrate_parser.set_defaults(func=run_migrate)
+    return parser
+
+
+def run_cli(argv: list[str] = None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command is None:
+        from src.main import main
+
+        main()
+        return
+    args.func(args)
+
+
+if __name__ == "__main__":
+    run_cli(sys.argv[1:])
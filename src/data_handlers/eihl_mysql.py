@@ -1,11 +1,146 @@
+import threading
+import time
 import traceback
-from typing import Any, Sequence
+from contextlib import contextmanager
+from queue import Queue, Empty
+from typing import Any, Sequence, TYPE_CHECKING
 
-from mysql.connector import connect, connection
-from pypika import MySQLQuery, Field, Criterion
-from sqlalchemy import create_engine
+from pypika import MySQLQuery, Field, Criterion, Parameter
+from pypika.terms import Values
 
-from settings.settings import mysql_db_config
+from settings.settings import mysql_db_config, mysql_pool_settings
+from src.Exceptions import DBNotAvailable
+from src.metrics import metrics
+
+if TYPE_CHECKING:
+    from mysql.connector import connection
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+# The MySQL driver is imported when the first connection is opened so importing the handler stays cheap
+connect = None
+
+
+class MysqlDBPool:
+    """
+    Pool of MySQL connections shared by every handler. Connections are opened when they're first needed,
+    up to pool_size, and are reconnected when they've dropped while sitting idle.
+    """
+
+    def __init__(self, db_config: dict = None, pool_size: int = None, checkout_timeout: float = None):
+        if db_config is None:
+            db_config = mysql_db_config
+        self.db_config = db_config
+        self.pool_size = pool_size or mysql_pool_settings.get("pool_size", 5)
+        self.checkout_timeout = checkout_timeout or mysql_pool_settings.get("checkout_timeout", 30)
+        self._idle_conns = Queue()
+        self._lock = threading.Lock()
+        self._num_conns = 0
+        # Running totals of the time spent waiting to check out a connection
+        self.num_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _open_connection(self) -> "connection" or None:
+        global connect
+        if connect is None:
+            from mysql.connector import connect
+        with self._lock:
+            if self._num_conns >= self.pool_size:
+                return None
+            self._num_conns += 1
+        try:
+            return connect(**self.db_config)
+        except Exception:
+            with self._lock:
+                self._num_conns -= 1
+            raise
+
+    def _ensure_connected(self, db_conn: "connection") -> "connection":
+        if not db_conn.is_connected():
+            print("MySQL connection has dropped. Reconnecting")
+            db_conn.reconnect(attempts=mysql_pool_settings.get("reconnect_attempts", 3),
+                              delay=mysql_pool_settings.get("reconnect_delay", 1))
+        return db_conn
+
+    def get_connection(self) -> "connection":
+        start = time.perf_counter()
+        try:
+            db_conn = self._idle_conns.get_nowait()
+        except Empty:
+            db_conn = self._open_connection()
+            if db_conn is None:
+                # Every connection is in use so wait for one to be returned
+                try:
+                    db_conn = self._idle_conns.get(timeout=self.checkout_timeout)
+                except Empty:
+                    raise DBNotAvailable
+        try:
+            db_conn = self._ensure_connected(db_conn)
+        except Exception:
+            self.discard_connection(db_conn)
+            raise
+        wait_time = time.perf_counter() - start
+        with self._lock:
+            self.num_checkouts += 1
+            self.total_wait += wait_time
+            self.max_wait = max(self.max_wait, wait_time)
+        metrics.observe("eihl_db_checkout_seconds", wait_time, handler="mysql")
+        return db_conn
+
+    def put_connection(self, db_conn: "connection"):
+        try:
+            # Don't hand an open transaction to the next unit of work
+            db_conn.rollback()
+        except Exception:
+            self.discard_connection(db_conn)
+            return
+        self._idle_conns.put(db_conn)
+
+    def discard_connection(self, db_conn: "connection"):
+        try:
+            db_conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._num_conns -= 1
+
+    @contextmanager
+    def connection(self):
+        db_conn = self.get_connection()
+        try:
+            yield db_conn
+        finally:
+            self.put_connection(db_conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self.discard_connection(self._idle_conns.get_nowait())
+            except Empty:
+                break
+        print("MySQL DB Pool is closed")
+
+    def print_summary(self):
+        with self._lock:
+            num_checkouts, total_wait, max_wait = self.num_checkouts, self.total_wait, self.max_wait
+            num_conns = self._num_conns
+        if num_checkouts == 0:
+            print("No MySQL connections were checked out")
+            return
+        print(f"MySQL pool: {num_checkouts} checkouts over {num_conns} connections. "
+              f"Wait mean: {total_wait / num_checkouts * 1000:.1f}ms, "
+              f"max: {max_wait * 1000:.1f}ms")
+
+
+def get_mysql_db_pool(db_config: dict = None) -> MysqlDBPool:
+    if db_config is None:
+        db_config = mysql_db_config
+    pool_key = tuple(sorted(db_config.items()))
+    with _db_pools_lock:
+        if pool_key not in _db_pools:
+            _db_pools[pool_key] = MysqlDBPool(db_config)
+        return _db_pools[pool_key]
 
 
 class EIHLMysqlHandler:
@@ -44,21 +179,36 @@ class EIHLMysqlHandler:
         "Save percentage": "save_percentage",
         "Faceoffs won": "faceoffs_won"
     }
+    # Directory of the migrations under sql/migrations (see src/migrations.py)
+    schema_dialect = "mysql"
+    # Unique key of each table that upserts are matched on
+    natural_keys = {
+        "match": ("match_date", "home_team", "away_team"),
+        "match_team_stats": ("match_id", "team_name"),
+        "match_player_stats": ("match_id", "team_name", "player_name"),
+        "championship": ("eihl_web_id",)
+    }
 
-    def __init__(self, db_conn: connection = None, db_config=None):
-        if db_config is None:
-            db_config = mysql_db_config
-        self.db_conn: connection = db_conn
-        if not self.db_conn:
-            self.db_conn = connect(**db_config)
-            self.db_engine = create_engine(
-                f"mysql+pymysql://{db_config.get('un', '')}:{db_config.get('pw', '')}@"
-                f"{db_config.get('host', '')}:{db_config.get('port', '')}/{db_config.get('db', '')}",
-                echo=True)
+    def __init__(self, db_conn: "connection" = None, db_config=None, db_pool: MysqlDBPool = None):
+        self._db_conn: "connection" = db_conn
+        self._db_pool = None
+        if not self._db_conn:
+            # A connection is only checked out of the pool when the handler first uses the DB
+            self._db_pool = db_pool if db_pool is not None else get_mysql_db_pool(db_config)
+
+    @property
+    def db_conn(self) -> "connection" or None:
+        if self._db_conn is None and self._db_pool is not None:
+            self._db_conn = self._db_pool.get_connection()
+        return self._db_conn
 
     def shut_down(self):
-        if self.db_conn:
-            self.db_conn.close()
+        if self._db_conn:
+            if self._db_pool is not None:
+                self._db_pool.put_connection(self._db_conn)
+            else:
+                self._db_conn.close()
+            self._db_conn = None
 
     def __enter__(self):
         return self
@@ -67,7 +217,10 @@ class EIHLMysqlHandler:
         self.shut_down()
 
     def __del__(self):
-        self.shut_down()
+        try:
+            self.shut_down()
+        except Exception:
+            pass
 
     def print_sql_query(self, query, params):
         if self.db_conn:
@@ -75,6 +228,11 @@ class EIHLMysqlHandler:
         else:
             print("ERROR unable to print SQL! No DB connection available!\n")
 
+    def commit(self):
+        with metrics.time("eihl_db_commit_seconds", handler="mysql"):
+            self.db_conn.commit()
+
+    @metrics.timed("eihl_db_seconds", handler="mysql")
     def fetch_all_data(self, query: str = None, params: dict = None,
                        table: str = None, columns: list[str] = None):
         try:
@@ -87,20 +245,24 @@ class EIHLMysqlHandler:
                 result = db_cur.fetchall()
                 return result
         except Exception:
+            metrics.inc("eihl_db_errors_total", handler="mysql", function="fetch_all_data")
             traceback.print_exc()
 
+    @metrics.timed("eihl_db_seconds", handler="mysql")
     def execute_query(self, query, params=None):
         with self.db_conn.cursor(dictionary=True) as db_cur:
             try:
                 db_cur.execute(query, params)
             except Exception:
+                metrics.inc("eihl_db_errors_total", handler="mysql", function="execute_query")
                 self.db_conn.rollback()
                 traceback.print_exc()
                 print(f"Query -> {query} \n Params -> {params}")
                 # self.print_sql_query(query, params)
             else:
-                self.db_conn.commit()
+                self.commit()
 
+    @metrics.timed("eihl_db_seconds", handler="mysql")
     def insert_data(self, table_name: str, new_val_dict: dict):
 
         query = str(MySQLQuery.into(table_name).columns(list(new_val_dict.keys())).insert(list(new_val_dict.values())))
@@ -110,6 +272,7 @@ class EIHLMysqlHandler:
         except TypeError:
             traceback.print_exc()
 
+    @metrics.timed("eihl_db_seconds", handler="mysql")
     def update_data(self, table_name: str, update_values: dict, where_clause: Criterion = None):
         try:
             new_query = MySQLQuery.update(table_name)
@@ -126,6 +289,51 @@ class EIHLMysqlHandler:
         except TypeError:
             traceback.print_exc()
 
+    @metrics.timed("eihl_db_seconds", handler="mysql")
+    def upsert_data(self, table_name: str, rows: Sequence[dict], conflict_cols: Sequence[str] = None,
+                    chunk_size: int = 500) -> int:
+        """
+        Insert rows or update them when they clash with an existing row's unique key using
+        INSERT ... ON DUPLICATE KEY UPDATE. Rows are sent with executemany and committed chunk_size at a time.
+        Args:
+            table_name: table to write to
+            rows: rows to write. Rows with different columns are written in separate statements
+            conflict_cols: unique key columns which are not updated. Defaults to the table's natural key
+            chunk_size: rows written per transaction
+        Returns: number of rows written
+        Raises: the error of the first chunk that fails after rolling it back. The chunks before it stay committed
+        """
+        if conflict_cols is None:
+            conflict_cols = self.natural_keys.get(table_name, ())
+        rows_by_cols = {}
+        for row in rows:
+            rows_by_cols.setdefault(tuple(row.keys()), []).append(row)
+
+        rows_written = 0
+        for cols, col_rows in rows_by_cols.items():
+            query = MySQLQuery.into(table_name).columns(*cols).insert(*[Parameter("%s")] * len(cols))
+            # If every column is part of the key there is nothing to update so keep the row as it is
+            update_cols = [col for col in cols if col not in conflict_cols] or cols[:1]
+            for col in update_cols:
+                query = query.on_duplicate_key_update(Field(col), Values(Field(col)))
+            query = str(query)
+            for i in range(0, len(col_rows), chunk_size):
+                chunk = [tuple(row[col] for col in cols) for row in col_rows[i:i + chunk_size]]
+                with self.db_conn.cursor() as db_cur:
+                    try:
+                        db_cur.executemany(query, chunk)
+                    except Exception:
+                        metrics.inc("eihl_db_errors_total", handler="mysql", function="upsert_data")
+                        self.db_conn.rollback()
+                        print(f"ERROR upserting {len(chunk)} rows into {table_name}. {rows_written} rows were written "
+                              f"before it. Query -> {query}")
+                        raise
+                self.commit()
+                rows_written += len(chunk)
+                metrics.inc("eihl_db_rows_written_total", len(chunk), handler="mysql", table=table_name)
+        return rows_written
+
+    @metrics.timed("eihl_db_seconds", handler="mysql")
     def get_dup_records(self, params: dict = None, query=None, table: str = None,
                         where_clause: Criterion = None) -> Sequence[Any]:
         if query is not None:
@@ -1,9 +1,11 @@
+import threading
 import traceback
 
 import psycopg2
 from psycopg2 import sql, extras, pool
 
 from settings.settings import postgres_db_config
+from src.metrics import metrics
 
 
 # TODO use builder pattern to include OR statements
@@ -14,15 +16,25 @@ def generate_and_where_clause(params):
 
 
 class PostgresDBPool:
-    db_conn_pool = pool.ThreadedConnectionPool(1, 20, user=postgres_db_config.un,
-                                               password=postgres_db_config.pw,
-                                               host=postgres_db_config.hostname,
-                                               port="5432",
-                                               database=postgres_db_config.db)
+    # Created when the first connection is needed rather than when the module is imported
+    db_conn_pool = None
+    _pool_lock = threading.Lock()
 
     def __init__(self):
         print("Create Postgres DB object")
 
+    @classmethod
+    def get_pool(cls) -> pool.ThreadedConnectionPool:
+        if cls.db_conn_pool is None:
+            with cls._pool_lock:
+                if cls.db_conn_pool is None:
+                    cls.db_conn_pool = pool.ThreadedConnectionPool(1, 20, user=postgres_db_config["un"],
+                                                                   password=postgres_db_config["pw"],
+                                                                   host=postgres_db_config["hostname"],
+                                                                   port=postgres_db_config.get("port", "5432"),
+                                                                   database=postgres_db_config["db"])
+        return cls.db_conn_pool
+
     def __del__(self):
         self.release_pool()
 
@@ -33,6 +45,10 @@ class PostgresDBPool:
 
 
 class EIHLPostgresHandler:
+    """
+    Handler of the DB in sql/eihlstats_postgres_create.sql. It has no upserts or migrations so the scraper can't
+    write to it: its tables reference teams and players by ID rather than by the names the scraper writes.
+    """
     match_player_stats_cols = {
         "Jersey": "jersey",
         "Player name": "player_name",
@@ -58,8 +74,11 @@ class EIHLPostgresHandler:
     }
 
     def __init__(self, db_conn=None, db_cur=None):
+        # Connections that were checked out of the pool are put back rather than closed
+        self._db_pool = None
         if not db_conn:
-            db_conn = PostgresDBPool.db_conn_pool.getconn()
+            self._db_pool = PostgresDBPool.get_pool()
+            db_conn = self._db_pool.getconn()
         self.db_conn = db_conn
         try:
             if not db_cur:
@@ -69,12 +88,16 @@ class EIHLPostgresHandler:
             print("ERROR creating DB Cursor!")
 
     def shut_down(self):
-        if self.db_conn:
-            print("Put connection back into queue")
-            self.db_conn.close()
-            # PostgresDBPool.db_conn_pool.putconn(self.db_conn)
-        if self.db_cur:
+        if getattr(self, "db_cur", None):
             self.db_cur.close()
+            self.db_cur = None
+        if self.db_conn:
+            if self._db_pool is not None:
+                print("Put connection back into queue")
+                self._db_pool.putconn(self.db_conn)
+            else:
+                self.db_conn.close()
+            self.db_conn = None
 
     def __enter__(self):
         return self
@@ -96,23 +119,32 @@ class EIHLPostgresHandler:
         else:
             print("ERROR unable to print SQL! No DB connection available!\n")
 
+    def commit(self):
+        with metrics.time("eihl_db_commit_seconds", handler="postgres"):
+            self.db_conn.commit()
+
+    @metrics.timed("eihl_db_seconds", handler="postgres")
     def fetch_all_data(self, query, params=None):
         try:
             self.db_cur.execute(query, params)
             result = self.db_cur.fetchall()
             return result
         except Exception:
+            metrics.inc("eihl_db_errors_total", handler="postgres", function="fetch_all_data")
             traceback.print_exc()
 
+    @metrics.timed("eihl_db_seconds", handler="postgres")
     def execute_query(self, query, params=None):
         try:
             self.db_cur.execute(query, params)
         except Exception:
+            metrics.inc("eihl_db_errors_total", handler="postgres", function="execute_query")
             self.db_conn.rollback()
             traceback.print_exc()
         else:
-            self.db_conn.commit()
+            self.commit()
 
+    @metrics.timed("eihl_db_seconds", handler="postgres")
     def insert_data(self, table: str, new_values: dict):
         query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
             sql.Identifier(table),
@@ -126,6 +158,7 @@ class EIHLPostgresHandler:
         except TypeError:
             traceback.print_exc()
 
+    @metrics.timed("eihl_db_seconds", handler="postgres")
     def update_data(self, table: str, update_values: dict, where_clause: sql.SQL = None):
         if where_clause is None:
             where_clause = generate_and_where_clause(update_values)
@@ -0,0 +1,205 @@
+import re
+import sqlite3
+import traceback
+from datetime import datetime, date
+from typing import Any, Sequence
+
+from pypika import Query, Field, Criterion
+
+from settings.settings import sqlite_db_config
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.metrics import metrics
+
+# Stored the way pypika writes dates in a query so the values compare as text
+sqlite3.register_adapter(datetime, lambda value: value.isoformat())
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: datetime.fromisoformat(value.decode()).date())
+
+# Same tables and keys as the MySQL DB after its migrations (sql/migrations/mysql) so upserts can match on them
+sqlite_schema = f"""
+CREATE TABLE IF NOT EXISTS "championship" (
+    "eihl_web_id" INTEGER PRIMARY KEY,
+    "name" TEXT NOT NULL,
+    "start_date" DATE,
+    "end_date" DATE
+);
+CREATE TABLE IF NOT EXISTS "match" (
+    "match_id" INTEGER PRIMARY KEY AUTOINCREMENT,
+    "eihl_web_match_id" TEXT,
+    "championship_id" INTEGER,
+    "match_date" TIMESTAMP NOT NULL,
+    "home_team" TEXT NOT NULL,
+    "away_team" TEXT NOT NULL,
+    "home_score" INTEGER,
+    "away_score" INTEGER,
+    "match_win_type" TEXT,
+    UNIQUE ("match_date", "home_team", "away_team")
+);
+CREATE INDEX IF NOT EXISTS "match_championship_idx" ON "match" ("championship_id", "match_date");
+CREATE INDEX IF NOT EXISTS "match_eihl_web_match_id_idx" ON "match" ("eihl_web_match_id");
+CREATE TABLE IF NOT EXISTS "match_team_stats" (
+    "match_id" INTEGER NOT NULL REFERENCES "match" ("match_id"),
+    "team_name" TEXT NOT NULL,
+    {", ".join(f'"{col}" REAL' for col in EIHLMysqlHandler.match_team_stats_cols.values())},
+    UNIQUE ("match_id", "team_name")
+);
+CREATE TABLE IF NOT EXISTS "match_player_stats" (
+    "match_id" INTEGER NOT NULL REFERENCES "match" ("match_id"),
+    "team_name" TEXT NOT NULL,
+    {", ".join(f'"{col}"' for col in EIHLMysqlHandler.match_player_stats_cols.values())},
+    UNIQUE ("match_id", "team_name", "player_name")
+);
+CREATE TABLE IF NOT EXISTS "match_scrape_state" (
+    "match_id" INTEGER PRIMARY KEY REFERENCES "match" ("match_id"),
+    "last_fetched" TIMESTAMP NOT NULL,
+    "content_hash" TEXT,
+    "has_score" BOOLEAN NOT NULL DEFAULT FALSE,
+    "has_team_stats" BOOLEAN NOT NULL DEFAULT FALSE,
+    "has_player_stats" BOOLEAN NOT NULL DEFAULT FALSE,
+    "failure_count" INTEGER NOT NULL DEFAULT 0,
+    "last_error" TEXT
+);
+CREATE TABLE IF NOT EXISTS "championship_scrape_state" (
+    "eihl_web_id" INTEGER PRIMARY KEY,
+    "last_fetched" TIMESTAMP NOT NULL,
+    "content_hash" TEXT,
+    "failure_count" INTEGER NOT NULL DEFAULT 0,
+    "last_error" TEXT
+);
+"""
+
+
+def quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def convert_params(query: str, params: dict or Sequence or None) -> tuple[str, dict or Sequence]:
+    # Queries are written for the MySQL connector's %(name)s and %s placeholders
+    query = re.sub(r"%\((\w+)\)s", r":\1", str(query)).replace("%s", "?")
+    return query, params if params is not None else ()
+
+
+class EIHLSqliteHandler:
+    """
+    Local stand-in for the MySQL handler backed by a SQLite file. It has the same interface so the scraper can
+    run without a DB server, e.g. for benchmarks and tests.
+    """
+    match_player_stats_cols = EIHLMysqlHandler.match_player_stats_cols
+    match_team_stats_cols = EIHLMysqlHandler.match_team_stats_cols
+    natural_keys = EIHLMysqlHandler.natural_keys
+    # The whole schema is created when the DB is opened so there are no migrations
+    schema_dialect = None
+
+    def __init__(self, db_path: str = None, db_conn: sqlite3.Connection = None):
+        if db_conn is None:
+            db_conn = sqlite3.connect(db_path or sqlite_db_config.get("database", ":memory:"),
+                                      detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+            db_conn.executescript(sqlite_schema)
+        db_conn.row_factory = sqlite3.Row
+        self.db_conn = db_conn
+
+    def shut_down(self):
+        if self.db_conn:
+            self.db_conn.close()
+            self.db_conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shut_down()
+
+    def commit(self):
+        with metrics.time("eihl_db_commit_seconds", handler="sqlite"):
+            self.db_conn.commit()
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def fetch_all_data(self, query: str = None, params: dict = None,
+                       table: str = None, columns: list[str] = None):
+        try:
+            if query is None:
+                query = Query.from_(table)
+                query = query.select(*columns) if columns is not None else query.select("*")
+            db_cur = self.db_conn.execute(*convert_params(query, params))
+            return [dict(row) for row in db_cur.fetchall()]
+        except Exception:
+            metrics.inc("eihl_db_errors_total", handler="sqlite", function="fetch_all_data")
+            traceback.print_exc()
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def execute_query(self, query, params=None):
+        try:
+            self.db_conn.execute(*convert_params(query, params))
+        except Exception:
+            metrics.inc("eihl_db_errors_total", handler="sqlite", function="execute_query")
+            self.db_conn.rollback()
+            traceback.print_exc()
+            print(f"Query -> {query} \n Params -> {params}")
+        else:
+            self.commit()
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def insert_data(self, table_name: str, new_val_dict: dict):
+        query = Query.into(table_name).columns(*new_val_dict.keys()).insert(*new_val_dict.values())
+        self.execute_query(str(query))
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def update_data(self, table_name: str, update_values: dict, where_clause: Criterion = None):
+        new_query = Query.update(table_name)
+        for key in update_values:
+            new_query = new_query.set(key, update_values[key])
+        if where_clause:
+            new_query = new_query.where(where_clause)
+        else:
+            for col in update_values:
+                new_query = new_query.where(Field(col) == update_values[col])
+        self.execute_query(str(new_query), update_values)
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def upsert_data(self, table_name: str, rows: Sequence[dict], conflict_cols: Sequence[str] = None,
+                    chunk_size: int = 500) -> int:
+        """Same as EIHLMysqlHandler.upsert_data using INSERT ... ON CONFLICT DO UPDATE"""
+        if conflict_cols is None:
+            conflict_cols = self.natural_keys.get(table_name, ())
+        rows_by_cols = {}
+        for row in rows:
+            rows_by_cols.setdefault(tuple(row.keys()), []).append(row)
+
+        rows_written = 0
+        for cols, col_rows in rows_by_cols.items():
+            query = (f"INSERT INTO {quote_identifier(table_name)} ({', '.join(map(quote_identifier, cols))}) "
+                     f"VALUES ({', '.join('?' * len(cols))})")
+            update_cols = [col for col in cols if col not in conflict_cols]
+            if conflict_cols:
+                conflict_action = ", ".join(f"{quote_identifier(col)} = excluded.{quote_identifier(col)}"
+                                            for col in update_cols)
+                query += (f" ON CONFLICT ({', '.join(map(quote_identifier, conflict_cols))}) "
+                          + (f"DO UPDATE SET {conflict_action}" if update_cols else "DO NOTHING"))
+            for i in range(0, len(col_rows), chunk_size):
+                chunk = [tuple(row[col] for col in cols) for row in col_rows[i:i + chunk_size]]
+                try:
+                    self.db_conn.executemany(query, chunk)
+                except Exception:
+                    metrics.inc("eihl_db_errors_total", handler="sqlite", function="upsert_data")
+                    self.db_conn.rollback()
+                    print(f"ERROR upserting {len(chunk)} rows into {table_name}. {rows_written} rows were written "
+                          f"before it. Query -> {query}")
+                    raise
+                self.commit()
+                rows_written += len(chunk)
+                metrics.inc("eihl_db_rows_written_total", len(chunk), handler="sqlite", table=table_name)
+        return rows_written
+
+    @metrics.timed("eihl_db_seconds", handler="sqlite")
+    def get_dup_records(self, params: dict = None, query=None, table: str = None,
+                        where_clause: Criterion = None) -> Sequence[Any]:
+        if query is not None:
+            return self.fetch_all_data(query)
+        dup_query = Query.from_(table).select("*")
+        if where_clause is not None:
+            return self.fetch_all_data(str(dup_query.where(where_clause)), params)
+        # Rows are duplicates when they have the same natural key
+        for col in self.natural_keys.get(table, ()) or (params or {}).keys():
+            dup_query = dup_query.where(Field(col) == params.get(col, None))
+        return self.fetch_all_data(str(dup_query))
@@ -0,0 +1,117 @@
+"""
+Work items that failed to scrape are kept in a dead-letter store with the error and the raw pages they failed on
+rather than only being printed. Each dead letter is a JSON file and its pages are saved as a replay corpus
+(see web_scraping.replay) so replaying the dead letters parses exactly the pages that failed.
+"""
+import json
+import os
+import re
+import threading
+import traceback
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from pathlib import Path
+
+from settings.settings import recovery_settings
+from src.metrics import metrics
+from src.web_scraping.replay import get_corpus_key, get_corpus_file_name, load_corpus_index, save_corpus_index
+
+_dead_letter_store = None
+_dead_letter_store_lock = threading.Lock()
+
+
+@dataclass()
+class DeadLetter:
+    # Type of work item e.g. "match" or "schedule_match"
+    kind: str
+    key: str
+    # The work item as it was when it failed. Datetimes are saved as strings
+    item: dict
+    stage: str
+    error: str
+    failed_at: str = field(default=None)
+    urls: list[str] = field(default_factory=list)
+    # Whether the raw page of every URL was saved
+    has_pages: bool = field(default=False)
+
+
+def format_error(error: Exception or str) -> str:
+    if isinstance(error, str):
+        return error
+    return "".join(traceback.format_exception(type(error), error, error.__traceback__)).strip()
+
+
+class DeadLetterStore:
+    def __init__(self, store_dir: str or Path = None):
+        if store_dir is None:
+            store_dir = recovery_settings["dead_letter_dir"]
+        self.store_dir = Path(store_dir)
+        self.letters_dir = self.store_dir / "letters"
+        self.pages_dir = self.store_dir / "pages"
+        self.letters_dir.mkdir(parents=True, exist_ok=True)
+        self.pages_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _letter_path(self, kind: str, key) -> Path:
+        return self.letters_dir / f"{kind}_{re.sub(r'[^A-Za-z0-9.-]+', '_', str(key))}.json"
+
+    def add(self, kind: str, key, item: dict, stage: str, error: Exception or str,
+            pages: dict[str, bytes or str] = None, urls: list[str] = None) -> DeadLetter:
+        """
+        Save a failed work item. A later failure of the same item replaces its dead letter.
+        Args:
+            pages: URL to raw content of the pages the item failed on
+            urls: every URL of the item, including those whose pages couldn't be fetched
+        """
+        pages = {url: page for url, page in (pages or {}).items() if page is not None}
+        dead_letter = DeadLetter(kind, str(key), item, stage, format_error(error), datetime.now().isoformat(),
+                                 list(dict.fromkeys([*(urls or []), *pages])),
+                                 len(pages) > 0 and all(url in pages for url in urls or []))
+        with self._lock:
+            if pages:
+                corpus_index = load_corpus_index(self.pages_dir)
+                for url, page in pages.items():
+                    file_name = get_corpus_file_name(url)
+                    (self.pages_dir / file_name).write_bytes(page.encode("utf-8") if isinstance(page, str) else page)
+                    corpus_index[get_corpus_key(url)] = file_name
+                save_corpus_index(self.pages_dir, corpus_index)
+            letter_path = self._letter_path(kind, key)
+            tmp_path = letter_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(asdict(dead_letter), default=str, indent=1))
+            os.replace(tmp_path, letter_path)
+        metrics.inc("eihl_dead_letters_total", kind=kind, stage=stage)
+        return dead_letter
+
+    def get_dead_letters(self, kind: str = None) -> list[DeadLetter]:
+        dead_letters = []
+        for letter_path in sorted(self.letters_dir.glob(f"{kind or '*'}_*.json")):
+            try:
+                dead_letters.append(DeadLetter(**json.loads(letter_path.read_text())))
+            except (OSError, ValueError, TypeError):
+                print(f"ERROR unable to read the dead letter {letter_path}")
+                traceback.print_exc()
+        return [dead_letter for dead_letter in dead_letters if kind is None or dead_letter.kind == kind]
+
+    def remove(self, kind: str, key):
+        """The pages are kept while a replay may still read them. They're deleted with prune_pages()"""
+        with self._lock:
+            self._letter_path(kind, key).unlink(missing_ok=True)
+
+    def prune_pages(self):
+        """Delete the saved pages that no dead letter refers to any more"""
+        urls = {get_corpus_key(url) for dead_letter in self.get_dead_letters() for url in dead_letter.urls}
+        with self._lock:
+            corpus_index = load_corpus_index(self.pages_dir)
+            for corpus_key in [corpus_key for corpus_key in corpus_index if corpus_key not in urls]:
+                (self.pages_dir / corpus_index.pop(corpus_key)).unlink(missing_ok=True)
+            save_corpus_index(self.pages_dir, corpus_index)
+
+
+def get_dead_letter_store() -> DeadLetterStore:
+    global _dead_letter_store
+    store_dir = Path(recovery_settings["dead_letter_dir"])
+    with _dead_letter_store_lock:
+        # A new store when the settings point somewhere else, e.g. a benchmark's work dir
+        if _dead_letter_store is None or _dead_letter_store.store_dir != store_dir:
+            _dead_letter_store = DeadLetterStore(store_dir)
+    return _dead_letter_store
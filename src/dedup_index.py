@@ -0,0 +1,99 @@
+"""
+In-memory index of the rows of a table by their natural key. A sync loads the index with one query (e.g. every
+match of a championship) and decides in memory which rows are new or changed, rather than looking up each row
+in the DB or rewriting rows that haven't changed. The index is updated as rows are written.
+"""
+import math
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable
+
+from pypika import Criterion
+
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.Exceptions import DBReadFailed
+from src.metrics import metrics
+from src.work_discovery import get_query_class
+
+
+def values_equal(db_value, new_value) -> bool:
+    # The DB hands back Decimals, dates and 0/1 booleans for the floats, datetimes and bools that were written
+    if isinstance(db_value, (int, float, Decimal)) and isinstance(new_value, (int, float, Decimal)):
+        return math.isclose(float(db_value), float(new_value), rel_tol=1e-9, abs_tol=1e-9)
+    if isinstance(db_value, date) and isinstance(new_value, date) and type(db_value) is not type(new_value):
+        db_value, new_value = [datetime.combine(value, datetime.min.time()) if not isinstance(value, datetime)
+                               else value for value in (db_value, new_value)]
+    return db_value == new_value
+
+
+@dataclass()
+class KeyIndex:
+    table: str
+    key_cols: tuple[str, ...]
+    rows: dict[tuple, dict] = field(default_factory=dict)
+
+    def get_key(self, row: dict) -> tuple:
+        return tuple(row.get(col, None) for col in self.key_cols)
+
+    def get(self, row: dict) -> dict or None:
+        return self.rows.get(self.get_key(row), None)
+
+    def is_new_or_changed(self, row: dict) -> bool:
+        db_row = self.get(row)
+        if db_row is None:
+            return True
+        return any(not values_equal(db_row[col], value) for col, value in row.items() if col in db_row)
+
+    def get_rows_to_write(self, rows: Iterable[dict]) -> list[dict]:
+        rows = list(rows)
+        rows_to_write = [row for row in rows if self.is_new_or_changed(row)]
+        metrics.inc("eihl_dedup_skipped_rows_total", len(rows) - len(rows_to_write), table=self.table)
+        return rows_to_write
+
+    def update(self, rows: Iterable[dict]):
+        for row in rows:
+            key = self.get_key(row)
+            self.rows[key] = {**self.rows.get(key, {}), **row}
+
+
+def load_key_index(db_handler: EIHLMysqlHandler, table: str, where: Criterion = None,
+                   key_cols: tuple[str, ...] = None) -> KeyIndex:
+    """
+    Args:
+        db_handler: DB to load the rows from
+        table: table to index
+        where: only index these rows, e.g. the matches of a championship
+        key_cols: defaults to the table's natural key
+    Returns: index of the rows loaded with a single query
+    Raises: DBReadFailed when the rows can't be read. An empty index would have every row rewritten as new
+    """
+    if key_cols is None:
+        key_cols = db_handler.natural_keys.get(table, ())
+    query = get_query_class(db_handler).from_(table).select("*")
+    if where is not None:
+        query = query.where(where)
+    key_index = KeyIndex(table, tuple(key_cols))
+    with metrics.time("eihl_dedup_load_seconds", table=table):
+        rows = db_handler.fetch_all_data(str(query))
+    if rows is None:
+        raise DBReadFailed(table)
+    key_index.update(rows)
+    return key_index
+
+
+def upsert_new_or_changed_rows(db_handler: EIHLMysqlHandler, key_index: KeyIndex, rows: Iterable[dict],
+                               conflict_cols: tuple[str, ...] = None) -> int:
+    """
+    Upsert only the rows that aren't already in the index with the same values and add them to the index
+    Returns: number of rows written
+    Raises: the error of the DB handler's upsert_data
+    """
+    rows_to_write = key_index.get_rows_to_write(rows)
+    if not rows_to_write:
+        return 0
+    # The index is left as it was when a chunk fails and raises so the next sync writes those rows again
+    rows_written = db_handler.upsert_data(key_index.table, rows_to_write, conflict_cols=conflict_cols)
+    key_index.update(rows_to_write)
+    return rows_written
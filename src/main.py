@@ -1,23 +1,28 @@
+import importlib
 from dataclasses import dataclass, field
-from datetime import datetime
 from enum import Enum
-from typing import Callable, Tuple
+from typing import Callable, Tuple, TYPE_CHECKING
 
-from pypika import Query, Field, Table
+from src.cli import get_db_handler_func
 
-from settings.settings import eihl_match_url
-from src.data_handlers.eihl_mysql import EIHLMysqlHandler
-# from src.data_handlers.eihl_postgres import EIHLPostgresHandler
-from src.match import update_eihl_scores_from_game_centre, refresh_championships, get_db_season_ids, \
-    update_match_scores
-from src.player_stats import update_players_stats
-from src.team_stats import update_match_team_stats
-from src.web_scraping.eihl_website_scraping import get_gamecentre_team_id, get_eihl_championship_options, \
-    get_gamecentre_month_id
+if TYPE_CHECKING:
+    from src.work_discovery import MatchFilter
 
-# TODO make builder function to get data source handler
-# ds_handler = EIHLPostgresHandler()
-db_handler_func = EIHLMysqlHandler
+# The scraper modules and their dependencies (bs4, requests, the DB drivers, pyarrow) are imported by each
+# function when it runs so the prompt, and every command of src/cli.py, starts without loading them all
+
+
+def db_handler_func():
+    # MySQL unless src/cli.py replaces this with the handler of the DB it's given
+    return get_db_handler_func("mysql")()
+
+
+def lazy_action(module_name: str, function_name: str) -> Callable:
+    """Returns: function that imports the module the first time it's called and runs its function"""
+    def run_action(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+
+    return run_action
 
 
 @dataclass(init=True)
@@ -33,122 +38,138 @@ def display_help():
         print(f"{option.name}: {option.value.help}")
 
 
-def enter_date(fmt: str = "%d/%m/%Y"):
-    while True:
-        date_input = input("Enter date -> ")
-        try:
-            return datetime.strptime(date_input, fmt)
-        except ValueError:
-            # TODO find a way to display the format parameter in error message
-            print("Invalid format! Format must be DD/MM/YY. Try again.")
-
-
-def get_data_range() -> tuple[datetime, datetime]:
-    while True:
-        start_date = enter_date()
-        end_date = enter_date()
-        if start_date <= end_date:
-            break
-        print("Start date after end_date. Try again.")
-    return start_date, end_date
-
-
-def get_ids(team_names: list = None, months: list = None, seasons: list = None, db_handler=None):
-    if db_handler is None:
-        db_handler = db_handler_func()
-    gc_team_id = get_gamecentre_team_id()
-    gc_month_id = get_gamecentre_month_id()
-    season_ids = get_db_season_ids(db_handler)
-    if season_ids is None or len(season_ids) == 0:
-        print("There are no championship IDs stored in the DB")
-        season_ids = get_eihl_championship_options()
-        # insert_championship_to_db(db_handler, *season_ids)
-    return gc_team_id, gc_month_id, season_ids
-
-
-def refresh_db():
-    db_handler = db_handler_func()
-    refresh_championships(db_handler)
-    update_eihl_scores_from_game_centre(db_handler, True)
-    update_match_team_stats(db_handler_func)
-    update_players_stats(db_handler_func)
-
-
-def update_recent_data():
-    db_handler = db_handler_func()
-    refresh_championships(db_handler)
-    match_query = Query.from_("match").select("*")
-
-    matches = db_handler.fetch_all_data(
-        str(match_query.where((Field("home_score").isnull()) | (Field("away_score").isnull()))))
-    if len(matches) > 0:
-        update_match_scores(db_handler,
-                            [f"{eihl_match_url}{match.get('eihl_web_match_id', None)}" for match in matches])
-        match_table = Table("match")
-        update_team_stats(db_handler, match_table, match_query)
-
-        update_player_stats(db_handler, match_query, match_table)
-    else:
-        print("There are no matches to update!")
-
-
-def update_player_stats(db_handler, match_query, match_table):
-    player_stats_table = Table("match_player_stats")
-    player_sub_query = Query() \
-        .from_(match_table) \
-        .select(match_table.match_id) \
-        .left_join(player_stats_table) \
-        .on(match_table.match_id == player_stats_table.match_id) \
-        .groupby(match_table.match_id, player_stats_table.goals, player_stats_table.shutouts,
-                 match_table.home_score, match_table.away_score) \
-        .having(
-        ((player_stats_table.goals == 0) & (player_stats_table.shutouts == 0)) |
-        (player_stats_table.saves == 0) | (match_table.home_score.isnull()) |
-        (match_table.away_score.isnull()))
-    miss_player_stat_query = str(match_query.where(Field("match_id").isin(player_sub_query)))
-    missing_player_stat_games = db_handler.fetch_all_data(miss_player_stat_query)
-    # missing_player_stat_games = db_handler.fetch_all_data( """SELECT * FROM `match` WHERE match_id IN (SELECT
-    # m.match_id FROM `match` m LEFT JOIN match_player_stats mps ON mps.match_id = m.match_id GROUP BY
-    # m.match_id, mps.goals, mps.shutouts, m.home_score, m.away_score HAVING (mps.goals=0 AND mps.shutouts=0) OR
-    # m.home_score IS NULL or m.away_score IS NULL)""")
-    update_players_stats(db_handler_func, matches=missing_player_stat_games)
-
-
-def update_team_stats(db_handler, match_table, match_query):
-    team_stats_table = Table("match_team_stats")
-
-    team_sub_query = Query() \
-        .from_(match_table) \
-        .select(match_table.match_id) \
-        .left_join(team_stats_table) \
-        .on(match_table.match_id == team_stats_table.match_id) \
-        .groupby(match_table.match_id, team_stats_table.shots, team_stats_table.saves,
-                 match_table.home_score, match_table.away_score) \
-        .having((team_stats_table.shots == 0) | (team_stats_table.saves == 0) | (match_table.home_score.isnull()) |
-                (match_table.away_score.isnull()))
-    missing_team_stat_games = db_handler.fetch_all_data(
-        str(match_query.where(Field("match_id").isin(team_sub_query))))
-    # missing_team_stat_games = db_handler.fetch_all_data( """SELECT * FROM `match` WHERE match_id IN (SELECT
-    # m.match_id FROM `match` m LEFT JOIN match_team_stats mts ON m.match_id = mts.match_id GROUP BY m.match_id,
-    # mts.shots, mts.saves, m.home_score, m.away_score HAVING mts.shots=0 or mts.saves=0 OR m.home_score IS NULL
-    # or m.away_score IS NULL)""")
-    update_match_team_stats(db_handler_func, matches=missing_team_stat_games)
-
+def print_run_summary():
+    from src.data_handlers.eihl_mysql import get_mysql_db_pool
+    from src.metrics import metrics
+    from src.web_scraping.fetcher import fetch_stats
+
+    fetch_stats.print_summary()
+    get_mysql_db_pool().print_summary()
+    metrics.write()
+
+
+def migrate_db():
+    from src.migrations import apply_migrations
+
+    with db_handler_func() as db_handler:
+        applied = apply_migrations(db_handler)
+    print(f"{len(applied)} migrations applied")
+
+
+def get_filtered_championships(db_handler, match_filter: "MatchFilter" = None) -> list[dict] or None:
+    """Returns: the championships of the filter. None when it doesn't filter them"""
+    from src.match import get_db_championships
+
+    if match_filter is None or not match_filter.championship_ids:
+        return None
+    return [championship for championship in get_db_championships(db_handler)
+            if championship["eihl_web_id"] in match_filter.championship_ids]
+
+
+def refresh_db(match_filter: "MatchFilter" = None, settings: dict = None, dry_run: bool = False):
+    """
+    Args:
+        match_filter: only scrape these matches and the schedules of their championships
+        settings: overrides async_scrape_settings (e.g. the number of parse workers)
+        dry_run: only print the championships and matches that would be scraped
+    """
+    from src.checkpoints import load_checkpoint
+    from src.match import update_eihl_scores_from_game_centre, refresh_championships, get_db_championships
+    from src.match_ingest import ingest_matches, get_checkpoint_name, print_planned_matches
+    from src.migrations import is_schema_current
+    from src.work_discovery import find_played_matches
+
+    # A refresh that was interrupted resumes from the championships and matches it hadn't written yet
+    checkpoint = load_checkpoint(get_checkpoint_name("refresh_db", match_filter))
+    with db_handler_func() as db_handler:
+        # The upserts match on the natural keys that the migrations add
+        if not is_schema_current(db_handler):
+            return
+        championships = get_filtered_championships(db_handler, match_filter)
+        if dry_run:
+            if championships is None:
+                championships = get_db_championships(db_handler)
+            print(f"Dry run: {len(checkpoint.get_pending('championship', championships, 'eihl_web_id'))} "
+                  f"championship schedules would be synced as well as any new championships")
+            print_planned_matches(find_played_matches(db_handler, match_filter=match_filter), checkpoint)
+            return
+        # The schedules of new championships are fetched once for their dates and their matches
+        schedules = refresh_championships(db_handler)
+        update_eihl_scores_from_game_centre(db_handler, season_ids=championships, schedules=schedules,
+                                            checkpoint=checkpoint)
+        checkpoint.save()
+        # The matches are read a page at a time from this connection while the ingestion writes on its own
+        ingest_matches(db_handler_func, find_played_matches(db_handler, match_filter=match_filter), settings=settings,
+                       checkpoint=checkpoint)
+    checkpoint.complete()
+    print_run_summary()
+
+
+def update_recent_data(match_filter: "MatchFilter" = None, settings: dict = None, dry_run: bool = False):
+    """
+    Sync only the matches that are new, incomplete or recently played using the scrape state ledger
+    Args:
+        match_filter: only scrape these matches and the schedules of their championships
+        settings: overrides async_scrape_settings (e.g. the number of parse workers)
+        dry_run: only print the matches that would be scraped
+    """
+    from src.match import update_eihl_scores_from_game_centre, refresh_championships
+    from src.match_ingest import ingest_matches, print_planned_matches
+    from src.migrations import is_schema_current
+    from src.work_discovery import find_matches_to_sync
+
+    with db_handler_func() as db_handler:
+        if not is_schema_current(db_handler):
+            return
+        if dry_run:
+            print_planned_matches(find_matches_to_sync(db_handler, match_filter=match_filter))
+            return
+        # The schedules of new championships are fetched once for their dates and their matches
+        schedules = refresh_championships(db_handler)
+        update_eihl_scores_from_game_centre(db_handler, season_ids=get_filtered_championships(db_handler,
+                                                                                              match_filter),
+                                            incremental=True, schedules=schedules)
+        # The matches are read a page at a time from this connection while the ingestion writes on its own.
+        # The ingestion reads the scrape states of each batch as it writes them
+        ingest_matches(db_handler_func, find_matches_to_sync(db_handler, match_filter=match_filter),
+                       settings=settings)
+    print_run_summary()
+
+
+def update_championships():
+    from src.match import refresh_championships
+
+    with db_handler_func() as db_handler:
+        refresh_championships(db_handler)
+
+
+def update_match_scores():
+    from src.match import update_eihl_scores_from_game_centre
+
+    with db_handler_func() as db_handler:
+        update_eihl_scores_from_game_centre(db_handler, incremental=True)
 
 
 class Options(Enum):
     UPDATE_PLAYER_MATCH_STATS = CMDOption("Update player's stats for a particular match",
-                                          update_players_stats, (db_handler_func,))
+                                          lazy_action("src.player_stats", "update_players_stats"), (db_handler_func,))
     UPDATE_DB_MATCH = CMDOption("Update score for a particular match in the database",
                                 lambda x: "This will be implemented in the future")
-    UPDATE_TEAM_MATCH_STATS = CMDOption("Update team's stats for a particular match", update_match_team_stats,
-                                        (db_handler_func,))
-    UPDATE_CHAMPIONSHIPS = CMDOption("Update EIHL championships in the DB", refresh_championships,
-                                     (db_handler_func(),))
-    UPDATE_MATCH_SCORES = CMDOption("Update DB with the latest EIHL matches", update_eihl_scores_from_game_centre,
-                                    (db_handler_func(), True))
+    UPDATE_TEAM_MATCH_STATS = CMDOption("Update team's stats for a particular match",
+                                        lazy_action("src.team_stats", "update_match_team_stats"), (db_handler_func,))
+    # Handlers are created when the option is run so the DB isn't connected to at import
+    UPDATE_CHAMPIONSHIPS = CMDOption("Update EIHL championships in the DB", update_championships)
+    UPDATE_MATCH_SCORES = CMDOption("Update DB with the latest EIHL matches", update_match_scores)
     REFRESH_DB = CMDOption("Update recent matches and stats", refresh_db)
     UPDATE_RECENT = CMDOption("Update recent matches and stats", update_recent_data)
+    BACKFILL = CMDOption("Re-scrape every match with a process pool of parsers",
+                         lazy_action("src.match_ingest", "backfill_matches"), (db_handler_func,))
+    EXPORT_STATS = CMDOption("Export match, team and player stats to Parquet files partitioned by championship "
+                             "and month", lazy_action("src.stats_export", "export_stats"), (db_handler_func,))
+    REPLAY_DEAD_LETTERS = CMDOption("Scrape only the matches and schedules that failed and were saved as dead "
+                                    "letters", lazy_action("src.match_ingest", "replay_dead_letters"),
+                                    (db_handler_func,))
+    MIGRATE_DB = CMDOption("Apply the schema migrations that the DB doesn't have yet", migrate_db)
     CHANGE_WEBSITE = CMDOption("Change Data Source", lambda x: "This will be implemented in the future")
     CHANGE_DATABASE = CMDOption("Change Database", lambda x: "This will be implemented in the future")
     HELP = CMDOption("You know what this function works you eejit!", display_help)
@@ -158,7 +179,10 @@ class Options(Enum):
 def main():
     """Main function that takes the user's input in the while loop
        and performs the function specified"""
+    from src.migrations import is_schema_current
 
+    with db_handler_func() as db_handler:
+        is_schema_current(db_handler)
     is_exit = False
     while not is_exit:
         user_input = input("What would you like to do? ->")
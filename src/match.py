@@ -1,14 +1,25 @@
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import partial
 from pprint import pprint
+from typing import Iterator
 
+import bs4
 from pypika import Query, Field, Parameter
 
+from settings.settings import championship_settings
+from src.checkpoints import Checkpoint
 # TODO Create Protocol for DB handler
 from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.dead_letters import DeadLetterStore, get_dead_letter_store
+from src.dedup_index import KeyIndex, load_key_index, upsert_new_or_changed_rows
+from src.scrape_state import get_championship_scrape_states, is_championship_scrape_complete, get_content_hash, \
+    build_failed_scrape_state, save_championship_scrape_states, is_match_in_recheck_window
 from src.web_scraping.eihl_website_scraping import get_matches_from_web_gamecentre, get_gamecentre_url, \
-    get_eihl_championship_options, get_start_end_dates_from_gamecentre, \
-    get_match_info_from_match_page
+    get_eihl_championship_options, get_start_end_dates_from_gamecentre, get_gamecentre_content, \
+    get_match_info_from_match_page, iter_matches_from_gamecentre, normalise_team_filters
+from src.work_discovery import MatchFilter
 
 
 # TODO Create team season ID table in DB to hold team ID for each season
@@ -21,6 +32,10 @@ def get_db_season_ids(db_handler: EIHLMysqlHandler, seasons: list[str] = None):
     return season_ids
 
 
+def get_db_championships(db_handler: EIHLMysqlHandler) -> list[dict]:
+    return db_handler.fetch_all_data(str(Query.from_("championship").select("eihl_web_id", "end_date"))) or []
+
+
 def update_db_match(db_handler, match: dict, where_clause=None):
     try:
         db_handler.update_data("match", match, where_clause)
@@ -36,29 +51,88 @@ def insert_match_to_db(db_handler: EIHLMysqlHandler, match: dict):
 
 
 def insert_championship_to_db(data_source_hdlr: EIHLMysqlHandler, *championships: dict):
+    # One query for the championships already in the DB rather than a lookup per championship
+    champ_index = load_key_index(data_source_hdlr, "championship")
     for champ in championships:
+        if champ_index.get(champ) is not None:
+            continue
         try:
-            if len(data_source_hdlr.get_dup_records(params=champ, table="championship")) == 0:
-                data_source_hdlr.insert_data("championship", champ)
+            data_source_hdlr.insert_data("championship", champ)
         except Exception:
             traceback.print_exc()
         else:
+            champ_index.update([champ])
             print("Championship has been inserted!")
 
 
-def refresh_championships(db_handler: EIHLMysqlHandler):
+def iter_season_schedules(schedule_urls: dict[int, str], schedules: dict[int, bs4.Tag] = None,
+                          max_workers: int = None) -> Iterator[tuple[int, bs4.Tag or None]]:
+    """
+    Fetch and parse the gamecentre schedule of several seasons at once and yield each one as soon as it's ready
+    so it can be processed while the rest are still being fetched
+    Args:
+        schedule_urls: gamecentre URL of each season ID
+        schedules: schedules that were already fetched. These are yielded first.
+    Returns: (season ID, gamecentre container) of each season. The container is None when it couldn't be fetched
+    """
+    schedules = schedules or {}
+    for season_id in schedule_urls:
+        if season_id in schedules:
+            yield season_id, schedules[season_id]
+    schedule_urls = {season_id: url for season_id, url in schedule_urls.items() if season_id not in schedules}
+    if not schedule_urls:
+        return
+    if max_workers is None:
+        max_workers = championship_settings.get("schedule_workers", 4)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(schedule_urls)))) as executor:
+        futures = {executor.submit(get_gamecentre_content, url): season_id for season_id, url in schedule_urls.items()}
+        for future in as_completed(futures):
+            season_id = futures[future]
+            try:
+                yield season_id, future.result()
+            except Exception:
+                print(f"ERROR unable to get the schedule: {schedule_urls[season_id]}")
+                traceback.print_exc()
+                yield season_id, None
+
+
+def fetch_season_schedules(schedule_urls: dict[int, str], max_workers: int = None) -> dict[int, bs4.Tag]:
+    """Returns: the gamecentre container of each season ID. Seasons that couldn't be fetched are left out."""
+    return {season_id: schedule for season_id, schedule in iter_season_schedules(schedule_urls, max_workers=max_workers)
+            if schedule is not None}
+
+
+def refresh_championships(db_handler: EIHLMysqlHandler) -> dict[int, bs4.Tag]:
+    """
+    Insert the championships that are on the website but not in the DB with the dates of their first and last match
+    Returns: the schedules fetched for the new championships so they can be reused to sync their matches
+    """
     db_champs = db_handler.fetch_all_data(Query.from_("championship").select(Field("eihl_web_id"), Field("name")))
-    eihl_web_champs = get_eihl_championship_options()
+    eihl_web_champs = get_eihl_championship_options(max_age=championship_settings.get("options_max_age", None))
     if eihl_web_champs == db_champs:
         print(f"All championship options are stored in the database")
-    else:
-        champ_diff = [x for x in eihl_web_champs if x not in db_champs]
-        for champ in champ_diff:
-            champ_schedule_url = get_gamecentre_url(season_id=champ.get("eihl_web_id", None))
-            start_dt, end_dt = get_start_end_dates_from_gamecentre(champ_schedule_url)
-            champ["start_date"] = start_dt
-            champ["end_date"] = end_dt
-        insert_championship_to_db(db_handler, *champ_diff)
+        return {}
+    champ_diff = [x for x in eihl_web_champs if x not in db_champs]
+    schedule_urls = {champ.get("eihl_web_id", None): get_gamecentre_url(season_id=champ.get("eihl_web_id", None))
+                     for champ in champ_diff}
+    schedules = fetch_season_schedules(schedule_urls)
+    for champ in champ_diff:
+        champ_id = champ.get("eihl_web_id", None)
+        start_dt, end_dt = get_start_end_dates_from_gamecentre(schedule_urls[champ_id], schedules.get(champ_id, None))
+        champ["start_date"] = start_dt
+        champ["end_date"] = end_dt
+    insert_championship_to_db(db_handler, *champ_diff)
+    return schedules
+
+
+def get_match_page_max_age(match: dict) -> int or None:
+    # Revalidate the cached pages of a match that hasn't finished or that finished recently enough for its stats
+    # to be corrected. Pages of older matches don't change so the page cache TTL rules apply
+    if match.get("home_score", None) is None or match.get("away_score", None) is None:
+        return 0
+    if is_match_in_recheck_window(match):
+        return 0
+    return None
 
 
 def get_db_matches(db_handler: EIHLMysqlHandler, teams: list[str] = None,
@@ -75,43 +149,164 @@ def get_db_matches(db_handler: EIHLMysqlHandler, teams: list[str] = None,
     return matches
 
 
+def get_db_matches_by_id(db_handler: EIHLMysqlHandler, match_ids: list[int]) -> list[dict]:
+    if not match_ids:
+        return []
+    return db_handler.fetch_all_data(str(Query.from_("match").select("*")
+                                         .where(Field("match_id").isin(list(match_ids))))) or []
+
+
 def update_match_scores(db_handler: EIHLMysqlHandler, match_urls):
     dup_clause = ((Field("match_date") == Parameter("%(match_date)s")) &
                   (Field("home_team") == Parameter("%(home_team)s")) &
                   (Field("away_team") == Parameter("%(away_team)s")))
-    for match_url in match_urls:
-        match_info = get_match_info_from_match_page(match_url)
-        dup_records = db_handler.get_dup_records(match_info, table="match", where_clause=dup_clause)
+    # Only matches without a score are updated so the cached pages must be revalidated
+    match_infos = {match_url: get_match_info_from_match_page(match_url, max_age=0) for match_url in match_urls}
+    if not match_infos:
+        return
+    # Only the matches with the dates of the pages are indexed rather than the whole table
+    match_index = load_key_index(db_handler, "match", Field("match_date").isin(
+        list({match_info["match_date"] for match_info in match_infos.values()})))
+    for match_url, match_info in match_infos.items():
+        db_match = match_index.get(match_info)
 
-        if dup_records and \
-                (dup_records[0].get("home_score", None) is None or dup_records[0].get("away_score", None) is None):
+        if db_match and (db_match.get("home_score", None) is None or db_match.get("away_score", None) is None):
             db_handler.update_data("match", match_info, where_clause=dup_clause)
+            match_index.update([match_info])
             print(f"Match Successfully updated: {match_url}")
         else:
             print(f"ERROR cannot find {match_info} in DB")
 
 
-def update_eihl_scores_from_game_centre(db_handler, team_ids=None, month_ids=None, season_ids=None):
-    dup_clause = ((Field("match_date") == Parameter("%(match_date)s")) &
-                  (Field("home_team") == Parameter("%(home_team)s")) &
-                  (Field("away_team") == Parameter("%(away_team)s")))
+def dead_letter_schedule_match(dead_letters: DeadLetterStore or None, season_id: int, schedule_url: str,
+                               tag: bs4.Tag, tag_error: Exception):
+    print(f"ERROR unable to read a match from the schedule of championship: {season_id}")
+    traceback.print_exc()
+    # The tag is kept with the dead letter as the schedule page is replayed from the website
+    (dead_letters or get_dead_letter_store()).add(
+        "schedule_match", f"{season_id}_{get_content_hash(str(tag))[:16]}",
+        {"championship_id": season_id, "tag_html": str(tag)}, "parse", tag_error, urls=[schedule_url])
 
-    try:
-        for season in season_ids:
-            season_id = season["eihl_web_id"]
-            season_gamecentre_url = get_gamecentre_url(season_id, team_ids, month_ids)
-            season_matches = get_matches_from_web_gamecentre(season_gamecentre_url)
-            update_match_scores(db_handler, season_matches)
+
+def write_schedule_matches(db_handler: EIHLMysqlHandler, match_index: KeyIndex, season_id: int,
+                           matches: list[dict], now: datetime) -> list[dict]:
+    """
+    Upsert a batch of the matches of a season's schedule
+    Returns: the DB rows of the matches of the batch that have been played by now
+    """
+    if not matches:
+        return []
+    upsert_new_or_changed_rows(db_handler, match_index, matches)
+    if any(match_index.get(match).get("match_id", None) is None for match in matches):
+        # New matches only get their match_id from the DB
+        match_dates = [match["match_date"] for match in matches]
+        batch_index = load_key_index(db_handler, "match", (Field("championship_id") == season_id) &
+                                     Field("match_date").between(min(match_dates), max(match_dates)))
+        match_index.update(batch_index.rows.values())
+    db_matches = [match_index.get(match) for match in matches]
+    return [db_match for db_match in db_matches
+            if db_match.get("match_id", None) is not None and db_match["match_date"] <= now]
+
+
+def stream_schedule_matches(db_handler: EIHLMysqlHandler, match_filter: MatchFilter = None, now: datetime = None,
+                            dead_letters: DeadLetterStore = None) -> Iterator[dict]:
+    """
+    Walk the gamecentre schedule of each season of the filter (every season by default) and yield the DB row of
+    each match that has been played. The matches are upserted in batches as the schedule is walked so the pages of
+    the first matches can be fetched and parsed while the rest of the schedule is still being read. The walk of a
+    season stops at the first match day after now (or the end date of the filter).
+    Seasons that fail are saved as dead letters.
+    """
+    if now is None:
+        now = datetime.now()
+    if match_filter is None:
+        match_filter = MatchFilter()
+    season_ids = match_filter.championship_ids or [champ["eihl_web_id"] for champ in get_db_championships(db_handler)]
+    schedule_urls = {season_id: get_gamecentre_url(season_id) for season_id in season_ids}
+    end_date = min(now, match_filter.end_date) if match_filter.end_date is not None else now
+    team_filters = normalise_team_filters(match_filter.teams)
+    batch_size = championship_settings.get("schedule_batch_size", 50)
+    for season_id, schedule in iter_season_schedules(schedule_urls):
+        try:
+            if schedule is None:
+                # A schedule that couldn't be fetched with the others is fetched again here
+                schedule = get_gamecentre_content(schedule_urls[season_id])
+            match_index = load_key_index(db_handler, "match", Field("championship_id") == season_id)
+            batch = []
+            for match in iter_matches_from_gamecentre(
+                    schedule, match_filter.start_date or datetime.min, end_date, team_filters,
+                    on_error=partial(dead_letter_schedule_match, dead_letters, season_id, schedule_urls[season_id])):
+                match["championship_id"] = season_id
+                batch.append(match)
+                if len(batch) >= batch_size:
+                    yield from write_schedule_matches(db_handler, match_index, season_id, batch, now)
+                    batch = []
+            yield from write_schedule_matches(db_handler, match_index, season_id, batch, now)
+        except Exception as season_error:
+            traceback.print_exc()
+            (dead_letters or get_dead_letter_store()).add("championship", season_id, {"eihl_web_id": season_id},
+                                                          "schedule", season_error, urls=[schedule_urls[season_id]])
+
+
+def update_eihl_scores_from_game_centre(db_handler, team_ids=None, month_ids=None, season_ids=None,
+                                        incremental: bool = False, schedules: dict[int, bs4.Tag] = None,
+                                        checkpoint: Checkpoint = None, dead_letters: DeadLetterStore = None):
+    """
+    Insert new matches and update the scores of existing matches from the gamecentre schedule of each season.
+    When incremental, seasons that finished before they were last scraped and seasons whose schedule
+    hasn't changed since it was last scraped are skipped.
+    Matches that can't be read from a schedule and seasons that fail are saved as dead letters.
+    Args:
+        schedules: full season schedules that were already fetched (e.g. by refresh_championships)
+        checkpoint: seasons that it has as done are skipped and each season is added to it once it's written
+        dead_letters: defaults to the store in recovery_settings
+    """
+    if season_ids is None:
+        season_ids = get_db_championships(db_handler)
+    if checkpoint is not None:
+        season_ids = checkpoint.get_pending("championship", season_ids, "eihl_web_id")
+    # The scrape state only describes the full schedule of a season
+    track_state = not team_ids and not month_ids
+    champ_states = get_championship_scrape_states(db_handler) if track_state else {}
+    new_champ_states = []
+    if incremental and track_state:
+        season_ids = [season for season in season_ids
+                      if not is_championship_scrape_complete(season, champ_states.get(season["eihl_web_id"], None))]
+    schedule_urls = {season["eihl_web_id"]: get_gamecentre_url(season["eihl_web_id"], team_ids or 0, month_ids or 999)
+                     for season in season_ids}
+    # The schedules only apply to the full season.
+    # Each season is written while the schedules of the others are still being fetched.
+    for season_id, schedule in iter_season_schedules(schedule_urls, schedules if track_state else None):
+        champ_state = champ_states.get(season_id, None)
+        try:
+            # Scores of matches already in the DB are updated when the match pages are ingested.
+            # A schedule that couldn't be fetched with the others is fetched again here.
+            season_matches = get_matches_from_web_gamecentre(
+                schedule_urls[season_id], schedule,
+                on_error=partial(dead_letter_schedule_match, dead_letters, season_id, schedule_urls[season_id]))
+            content_hash = get_content_hash(season_matches)
+            new_champ_states.append({"eihl_web_id": season_id, "last_fetched": datetime.now(),
+                                     "content_hash": content_hash, "failure_count": 0, "last_error": None})
+            if incremental and champ_state and champ_state.get("content_hash", None) == content_hash:
+                print(f"Schedule for championship: {season_id} hasn't changed")
+                if checkpoint is not None:
+                    checkpoint.mark_done("championship", season_id)
+                continue
             for match in season_matches:
                 pprint(match)
                 # TODO should the data storage class handle column name conversions?
                 match.update({"championship_id": season_id})
-
-                dup_records = db_handler.get_dup_records(params=match, table="match", where_clause=dup_clause)
-                if len(dup_records) > 1:
-                    # TODO Implement logging for this scenario
-                    print(f"More than 1 duplicate for match: {match}")
-                elif len(dup_records) == 0:
-                    insert_match_to_db(db_handler, match)
-    except Exception:
-        traceback.print_exc()
+            # New matches are inserted and existing matches (same date and teams) get the latest scores.
+            # The matches of the season are loaded in one query so only new or changed matches are written.
+            match_index = load_key_index(db_handler, "match", Field("championship_id") == season_id)
+            rows_written = upsert_new_or_changed_rows(db_handler, match_index, season_matches)
+            print(f"{rows_written} matches upserted for championship: {season_id}")
+            if checkpoint is not None:
+                checkpoint.mark_done("championship", season_id)
+        except Exception as season_error:
+            traceback.print_exc()
+            new_champ_states.append(build_failed_scrape_state("eihl_web_id", season_id, champ_state, season_error))
+            (dead_letters or get_dead_letter_store()).add("championship", season_id, {"eihl_web_id": season_id},
+                                                          "schedule", season_error, urls=[schedule_urls[season_id]])
+    if track_state:
+        save_championship_scrape_states(db_handler, new_champ_states)
@@ -0,0 +1,381 @@
+import itertools
+import traceback
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Callable, Iterable, Iterator
+
+from settings.settings import eihl_match_url, backfill_settings
+from src.checkpoints import Checkpoint, load_checkpoint
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.dead_letters import DeadLetterStore, get_dead_letter_store, format_error
+from src.match import get_db_matches, get_match_page_max_age, get_db_matches_by_id, get_db_championships, \
+    update_eihl_scores_from_game_centre, stream_schedule_matches
+from src.metrics import metrics
+from src.player_stats import build_match_stats_url, get_player_stats_records, insert_player_stats_to_db
+from src.scrape_engine import scrape_matches
+from src.scrape_state import get_content_hash, is_match_scrape_complete, get_match_scrape_states, \
+    save_match_scrape_states, build_failed_scrape_state
+from src.team_stats import get_team_stats_records, insert_team_match_stats_to_db
+from src.utils import parse_html
+from src.web_scraping.replay import replay_corpus
+from src.web_scraping.eihl_website_scraping import get_eihl_match_url, get_match_info_from_html, \
+    get_team_match_stats_from_html, match_article_strainer
+from src.work_discovery import MatchFilter, find_played_matches
+
+match_score_cols = ("home_score", "away_score", "match_win_type")
+
+
+@dataclass()
+class MatchRecord:
+    match_id: int
+    # Match row from the DB
+    match: dict = field(default_factory=dict)
+    match_info: dict = field(default_factory=dict)
+    team_stats: list[dict] = field(default_factory=list)
+    player_stats: list[dict] = field(default_factory=list)
+    content_hash: str = field(default=None)
+    # Errors of the extractors that failed. The match is saved as a dead letter with its pages
+    parse_errors: list[str] = field(default_factory=list)
+    # Raw content of the match pages. Only kept when there are parse errors
+    pages: dict[str, bytes] = field(default=None, repr=False)
+
+
+def build_match_page_urls(match: dict) -> dict[str, str]:
+    eihl_web_match_id = match.get("eihl_web_match_id", "")
+    page_urls = {"team_stats": get_eihl_match_url(eihl_web_match_id),
+                 "player_stats": build_match_stats_url(eihl_web_match_id)}
+    if not has_match_score(match):
+        # The score is read from the match page when the team stats page doesn't have it.
+        # It's fetched with the other pages so the parse workers never go to the website
+        page_urls["match"] = f"{eihl_match_url}{eihl_web_match_id}"
+    return page_urls
+
+
+def has_match_score(match: dict) -> bool:
+    return match.get("home_score", None) is not None and match.get("away_score", None) is not None
+
+
+def get_match_score(team_stats_content, match: dict, match_page: bytes = None,
+                    parse_errors: list[str] = None) -> dict:
+    match_url = f"{eihl_match_url}{match.get('eihl_web_match_id', '')}"
+    try:
+        # The match summary with the score is part of the team stats page
+        match_info = get_match_info_from_html(team_stats_content, match_url)
+    except Exception:
+        match_info = {}
+    if has_match_score(match_info) or has_match_score(match) or match_page is None:
+        return match_info
+    # Only read the match page when the team stats page doesn't have the score
+    try:
+        return get_match_info_from_html(parse_html(match_page, match_article_strainer), match_url)
+    except Exception as score_error:
+        print(f"ERROR unable to get the score from {match_url}")
+        traceback.print_exc()
+        if parse_errors is not None:
+            parse_errors.append(format_error(score_error))
+    return match_info
+
+
+@metrics.timed("eihl_scraper_seconds")
+def parse_match_pages(pages: dict[str, bytes], match: dict, team_stats_cols: dict = None,
+                      player_stats_cols: dict = None) -> list[MatchRecord]:
+    if team_stats_cols is None:
+        team_stats_cols = EIHLMysqlHandler.match_team_stats_cols
+    if player_stats_cols is None:
+        player_stats_cols = EIHLMysqlHandler.match_player_stats_cols
+    match_record = MatchRecord(match.get("match_id", None), match)
+    # The whole tree is built as both the match summary and the team stats are read from it
+    team_stats_content = parse_html(pages["team_stats"])
+    match_record.match_info = get_match_score(team_stats_content, match, pages.get("match", None),
+                                              match_record.parse_errors)
+    try:
+        match_record.team_stats = get_team_stats_records(match, get_team_match_stats_from_html(team_stats_content),
+                                                         team_stats_cols)
+    except (AttributeError, IndexError) as parse_error:
+        print(f"ERROR no team stats for match: {match.get('eihl_web_match_id', None)}")
+        traceback.print_exc()
+        match_record.parse_errors.append(format_error(parse_error))
+    try:
+        match_record.player_stats = get_player_stats_records(pages["player_stats"], match, player_stats_cols)
+    except AttributeError as parse_error:
+        print(f"ERROR no player stats for match: {match.get('eihl_web_match_id', None)}")
+        traceback.print_exc()
+        match_record.parse_errors.append(format_error(parse_error))
+    if match_record.parse_errors:
+        match_record.pages = pages
+    match_record.content_hash = get_content_hash(match_record.match_info, match_record.team_stats,
+                                                 match_record.player_stats)
+    return [match_record]
+
+
+def is_match_record_unchanged(match_record: MatchRecord, scrape_states: dict[int, dict]) -> bool:
+    # The match was already complete and nothing on its pages has changed since
+    prev_state = scrape_states.get(match_record.match_id, None)
+    return is_match_scrape_complete(prev_state) and prev_state.get("content_hash", None) == match_record.content_hash
+
+
+def build_match_scrape_state(match_record: MatchRecord) -> dict:
+    return {"match_id": match_record.match_id,
+            "last_fetched": datetime.now(),
+            "content_hash": match_record.content_hash,
+            "has_score": has_match_score(match_record.match_info) or has_match_score(match_record.match),
+            "has_team_stats": len(match_record.team_stats) > 0,
+            "has_player_stats": len(match_record.player_stats) > 0,
+            "failure_count": 0,
+            "last_error": None}
+
+
+def get_match_score_row(match_record: MatchRecord) -> dict or None:
+    if match_record.match_id is None or not has_match_score(match_record.match_info):
+        return None
+    # The whole DB row is written so the insert half of the upsert has every NOT NULL column
+    match_score = {**match_record.match, "match_id": match_record.match_id}
+    match_score.update({col: match_record.match_info.get(col, None) for col in match_score_cols})
+    return match_score
+
+
+def dead_letter_match(dead_letters: DeadLetterStore or None, match: dict, stage: str, error: Exception or str,
+                      pages: dict[str, bytes] = None):
+    if match.get("match_id", None) is None:
+        return
+    page_urls = build_match_page_urls(match)
+    (dead_letters or get_dead_letter_store()).add(
+        "match", match["match_id"], match, stage, error,
+        {page_urls[page_name]: page for page_name, page in (pages or {}).items() if page_name in page_urls},
+        list(page_urls.values()))
+
+
+def write_match_rows(db_handler: EIHLMysqlHandler, match_records: list[MatchRecord]):
+    """Write the score, team stats and player stats of the matches. Raises the error of the first write that fails"""
+    match_scores = [get_match_score_row(match_record) for match_record in match_records]
+    match_scores = [match_score for match_score in match_scores if match_score is not None]
+    if match_scores:
+        # Every match already exists so upserting on the primary key only updates the scores
+        db_handler.upsert_data("match", match_scores, conflict_cols=("match_id",))
+    insert_team_match_stats_to_db(db_handler, *[team_stats for match_record in match_records
+                                                for team_stats in match_record.team_stats])
+    insert_player_stats_to_db(db_handler, *[player_stats for match_record in match_records
+                                            for player_stats in match_record.player_stats])
+
+
+def write_match_records_or_get_failures(db_handler: EIHLMysqlHandler,
+                                        match_records: list[MatchRecord]) -> list[tuple[MatchRecord, Exception]]:
+    """
+    Write the matches together. When that fails each match is written on its own to find the matches that fail.
+    Returns: the matches that couldn't be written and their errors
+    """
+    try:
+        write_match_rows(db_handler, match_records)
+        return []
+    except Exception:
+        print(f"ERROR writing a batch of {len(match_records)} matches to the DB. Writing them one at a time")
+        traceback.print_exc()
+    failed_records = []
+    for match_record in match_records:
+        try:
+            write_match_rows(db_handler, [match_record])
+        except Exception as write_error:
+            print(f"ERROR writing match: {match_record.match.get('eihl_web_match_id', None)} to the DB")
+            traceback.print_exc()
+            failed_records.append((match_record, write_error))
+    return failed_records
+
+
+def get_match_record_ids(match_records: list[MatchRecord]) -> list[int]:
+    return [match_record.match_id for match_record in match_records if match_record.match_id is not None]
+
+
+def write_match_records(db_handler: EIHLMysqlHandler, match_records: list[MatchRecord],
+                        scrape_states: dict[int, dict] = None, checkpoint: Checkpoint = None,
+                        dead_letters: DeadLetterStore = None):
+    """
+    Write the matches and save their scrape states. Only the matches whose score and stats were all written are
+    saved as scraped and added to the checkpoint. The others are saved as failures and dead letters.
+    """
+    # Whatever could be parsed is still written
+    for match_record in match_records:
+        if match_record.parse_errors:
+            dead_letter_match(dead_letters, match_record.match, "parse", "\n\n".join(match_record.parse_errors),
+                              match_record.pages)
+    if scrape_states is None:
+        # Only the states of the batch are read so a run never holds the whole ledger
+        scrape_states = get_match_scrape_states(db_handler, get_match_record_ids(match_records))
+    changed_records = [match_record for match_record in match_records
+                       if not is_match_record_unchanged(match_record, scrape_states)]
+    failed_records = write_match_records_or_get_failures(db_handler, changed_records)
+
+    failed_match_ids = {match_record.match_id for match_record, _ in failed_records}
+    new_scrape_states = [build_match_scrape_state(match_record) for match_record in match_records
+                         if match_record.match_id is not None and match_record.match_id not in failed_match_ids]
+    for match_record, write_error in failed_records:
+        if match_record.match_id is not None:
+            new_scrape_states.append(build_failed_scrape_state(
+                "match_id", match_record.match_id, scrape_states.get(match_record.match_id, None),
+                write_error))
+            dead_letter_match(dead_letters, match_record.match, "write", write_error, match_record.pages)
+    save_match_scrape_states(db_handler, new_scrape_states)
+    if checkpoint is not None:
+        checkpoint.mark_done("match", *[match_record.match_id for match_record in match_records
+                                        if match_record.match_id is not None
+                                        and match_record.match_id not in failed_match_ids])
+
+
+def ingest_matches(db_obj_func: Callable, matches: Iterable[dict] = None, max_concurrency: int = None,
+                   scrape_states: dict[int, dict] = None, settings: dict = None, checkpoint: Checkpoint = None,
+                   dead_letters: DeadLetterStore = None):
+    """
+    Fetch the pages of each match once and update the match score, team stats and player stats from them.
+    The scrape state of every match is saved so later syncs can skip complete matches.
+    Matches that fail are saved as dead letters with the error and the pages that were fetched.
+    Args:
+        matches: defaults to every match played so far. An empty list scrapes nothing. An iterator (e.g. of
+            work_discovery.find_matches_to_sync) is read as the matches are scraped rather than all at once
+        scrape_states: defaults to reading the states of each batch of matches from the DB as it's written
+        settings: overrides async_scrape_settings (e.g. the parse executor and its number of workers)
+        checkpoint: matches that it has as done are skipped and each match is added to it once it's written.
+            It is saved when the ingestion stops so an interrupted run can resume from it
+        dead_letters: defaults to the store in recovery_settings
+    """
+    scrape_settings = dict(settings or {})
+    if max_concurrency:
+        scrape_settings["max_concurrency"] = max_concurrency
+    with db_obj_func() as db_handler:
+        if matches is None:
+            matches = get_db_matches(db_handler, end_date=datetime.now()) or []
+        if checkpoint is not None:
+            matches = iter_pending_matches(matches, checkpoint)
+        matches = iter(matches)
+        first_match = next(matches, None)
+        if first_match is None:
+            print("There are no matches to scrape!")
+            return
+        failed_matches = []
+
+        def record_failure(match: dict, error: Exception, pages: dict[str, bytes] or None, stage: str):
+            if match.get("match_id", None) is not None:
+                # The failed states are saved once the pipeline has stopped using the DB
+                failed_matches.append((match, error))
+                dead_letter_match(dead_letters, match, stage, error, pages)
+
+        try:
+            scrape_matches(itertools.chain([first_match], matches), build_match_page_urls,
+                           partial(parse_match_pages, team_stats_cols=db_handler.match_team_stats_cols,
+                                   player_stats_cols=db_handler.match_player_stats_cols),
+                           partial(write_match_records, db_handler, scrape_states=scrape_states,
+                                   checkpoint=checkpoint, dead_letters=dead_letters),
+                           get_max_age=get_match_page_max_age,
+                           on_error=record_failure,
+                           settings=scrape_settings)
+        finally:
+            if checkpoint is not None:
+                checkpoint.save()
+        save_failed_match_states(db_handler, failed_matches, scrape_states)
+    print("Match ingestion Successful!!!")
+
+
+def iter_pending_matches(matches: Iterable[dict], checkpoint: Checkpoint) -> Iterator[dict]:
+    """Yield the matches that the checkpoint doesn't have as done"""
+    num_skipped = 0
+    for match in matches:
+        if checkpoint.is_done("match", match.get("match_id", None)):
+            num_skipped += 1
+        else:
+            yield match
+    if num_skipped:
+        print(f"Skipped {num_skipped} matches that are done according to the checkpoint")
+
+
+def save_failed_match_states(db_handler: EIHLMysqlHandler, failed_matches: list[tuple[dict, Exception]],
+                             scrape_states: dict[int, dict] = None):
+    if not failed_matches:
+        return
+    if scrape_states is None:
+        scrape_states = get_match_scrape_states(db_handler, [match["match_id"] for match, _ in failed_matches])
+    save_match_scrape_states(db_handler, [build_failed_scrape_state("match_id", match["match_id"],
+                                                                    scrape_states.get(match["match_id"], None), error)
+                                          for match, error in failed_matches])
+
+
+def get_checkpoint_name(run_name: str, match_filter: MatchFilter = None) -> str:
+    # Filtered runs (e.g. of a season on each machine) resume from their own checkpoints
+    filter_name = match_filter.get_name() if match_filter is not None else ""
+    return f"{run_name}_{filter_name}" if filter_name else run_name
+
+
+def print_planned_matches(matches: Iterable[dict], checkpoint: Checkpoint = None):
+    """Print the matches a dry run would have scraped by championship"""
+    if checkpoint is not None:
+        matches = (match for match in matches if not checkpoint.is_done("match", match.get("match_id", None)))
+    # Counted as they're read so the matches are never all held at once
+    champ_match_counts = Counter(match.get("championship_id", None) for match in matches)
+    print(f"Dry run: {sum(champ_match_counts.values())} matches would be scraped")
+    for champ_id, match_count in sorted(champ_match_counts.items(), key=lambda item: str(item[0])):
+        print(f"  championship {champ_id}: {match_count} matches")
+
+
+def backfill_matches(db_obj_func: Callable, match_filter: MatchFilter = None, settings: dict = None,
+                     dry_run: bool = False):
+    """
+    Re-scrape every played match (optionally only those of the filter) with the parsing spread over
+    a process pool as configured in backfill_settings. The matches are streamed from the season schedules
+    (see match.stream_schedule_matches) so the match pages are fetched and parsed while the schedules are walked.
+    Args:
+        settings: overrides backfill_settings (e.g. the number of parse workers)
+        dry_run: only print the matches in the DB that would be scraped
+    """
+    # A backfill that was interrupted resumes from the matches it hadn't written yet
+    checkpoint = load_checkpoint(get_checkpoint_name("backfill", match_filter))
+    # The schedules are walked and their matches written on this connection while the ingestion writes on its own
+    with db_obj_func() as db_handler:
+        if dry_run:
+            print_planned_matches(find_played_matches(db_handler, match_filter=match_filter), checkpoint)
+            return
+        ingest_matches(db_obj_func, stream_schedule_matches(db_handler, match_filter),
+                       settings={**backfill_settings, **(settings or {})}, checkpoint=checkpoint)
+    checkpoint.complete()
+
+
+def replay_dead_letters(db_obj_func: Callable, dead_letters: DeadLetterStore = None):
+    """
+    Scrape only the matches and schedules in the dead-letter store again. Matches whose pages were saved are
+    parsed from the saved pages so a fix to an extractor is run against exactly the pages it failed on.
+    A dead letter is removed once its item succeeds. Items that fail again stay in the store.
+    """
+    if dead_letters is None:
+        dead_letters = get_dead_letter_store()
+    replayed_letters = dead_letters.get_dead_letters()
+    if not replayed_letters:
+        print("There are no dead letters to replay!")
+        return
+    championship_ids = {int(dead_letter.item.get("championship_id", dead_letter.item.get("eihl_web_id", 0)))
+                        for dead_letter in replayed_letters if dead_letter.kind in ("championship", "schedule_match")}
+    match_letters = {int(dead_letter.key): dead_letter for dead_letter in replayed_letters
+                     if dead_letter.kind == "match"}
+    with db_obj_func() as db_handler:
+        if championship_ids:
+            championships = [championship for championship in get_db_championships(db_handler)
+                             if championship["eihl_web_id"] in championship_ids]
+            update_eihl_scores_from_game_centre(db_handler, season_ids=championships, dead_letters=dead_letters)
+        matches = get_db_matches_by_id(db_handler, list(match_letters))
+    saved_page_matches = [match for match in matches if match_letters[match["match_id"]].has_pages]
+    if saved_page_matches:
+        with replay_corpus(dead_letters.pages_dir):
+            ingest_matches(db_obj_func, saved_page_matches, dead_letters=dead_letters)
+    fetch_matches = [match for match in matches if not match_letters[match["match_id"]].has_pages]
+    if fetch_matches:
+        ingest_matches(db_obj_func, fetch_matches, dead_letters=dead_letters)
+
+    # Items that failed again have a new dead letter in place of the replayed one
+    failed_at = {(dead_letter.kind, dead_letter.key): dead_letter.failed_at
+                 for dead_letter in dead_letters.get_dead_letters()}
+    num_failed = 0
+    for dead_letter in replayed_letters:
+        if failed_at.get((dead_letter.kind, dead_letter.key), None) == dead_letter.failed_at:
+            dead_letters.remove(dead_letter.kind, dead_letter.key)
+        else:
+            num_failed += 1
+    dead_letters.prune_pages()
+    print(f"{len(replayed_letters) - num_failed} of {len(replayed_letters)} dead letters replayed successfully")
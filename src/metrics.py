@@ -0,0 +1,164 @@
+"""
+Counters and latency histograms of each stage of a run: fetching pages, parsing them, DB lookups, inserts,
+updates and commits. At the end of a run they're written as a Prometheus text file or a JSON summary.
+Metrics recorded in process pool workers stay in the worker so only the parent's metrics are written.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Callable
+
+from settings.settings import metrics_settings
+
+# Upper bounds in seconds of the latency histogram buckets
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+label_value_escapes = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+@dataclass()
+class Histogram:
+    buckets: tuple = field(default=default_buckets)
+    bucket_counts: list[int] = field(default=None)
+    total: float = field(default=0.0)
+    count: int = field(default=0)
+
+    def __post_init__(self):
+        if self.bucket_counts is None:
+            self.bucket_counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+def get_label_str(labels: tuple) -> str:
+    return ",".join(f'{key}="{str(value).translate(label_value_escapes)}"' for key, value in labels)
+
+
+class MetricsRegistry:
+    """Thread safe store of counters and histograms by metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        label_key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self.counters.setdefault(name, {})
+            metric[label_key] = metric.get(label_key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        label_key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self.histograms.setdefault(name, {})
+            if label_key not in metric:
+                metric[label_key] = Histogram()
+            metric[label_key].observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels) -> Callable:
+        """Decorator that records the latency of every call of a function labelled with the function's name"""
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(name, function=func.__name__, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def get_total(self, name: str, **labels) -> float:
+        """Returns: sum of a counter, or of a histogram's observations, over the series that have the labels"""
+        label_items = set(labels.items())
+        with self._lock:
+            if name in self.counters:
+                return sum(value for label_key, value in self.counters[name].items()
+                           if label_items <= set(label_key))
+            return sum(histogram.total for label_key, histogram in self.histograms.get(name, {}).items()
+                       if label_items <= set(label_key))
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {name: [{"labels": dict(label_key), "value": value}
+                                    for label_key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "histograms": {name: [{"labels": dict(label_key), "count": histogram.count,
+                                       "sum": histogram.total,
+                                       "mean": histogram.total / histogram.count if histogram.count else 0.0,
+                                       "buckets": dict(zip(map(str, histogram.buckets), histogram.bucket_counts))}
+                                      for label_key, histogram in series.items()]
+                               for name, series in self.histograms.items()}
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{{{get_label_str(label_key)}}} {value}" for label_key, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for label_key, histogram in series.items():
+                    label_str = get_label_str(label_key)
+                    cumulative_count = 0
+                    for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                        cumulative_count += bucket_count
+                        lines.append(f'{name}_bucket{{{label_str + "," if label_str else ""}le="{upper_bound}"}} '
+                                     f'{cumulative_count}')
+                    lines.append(f'{name}_bucket{{{label_str + "," if label_str else ""}le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{label_str}}} {histogram.total}")
+                    lines.append(f"{name}_count{{{label_str}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, export_format: str = None, export_path: str or Path = None) -> Path or None:
+        """
+        Write the metrics as a Prometheus text file or a JSON summary
+        Args:
+            export_format: "prometheus" or "json". Defaults to metrics_settings. None writes nothing
+            export_path: file to write. Defaults to metrics_settings
+        Returns: path of the file written
+        """
+        export_format = export_format or metrics_settings.get("export_format", None)
+        if export_format is None:
+            return None
+        if export_path is None:
+            file_name = "eihl_stat_collector.prom" if export_format == "prometheus" else "eihl_stat_collector.json"
+            export_path = Path(metrics_settings.get("export_dir", "metrics")) / file_name
+        export_path = Path(export_path)
+        export_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = export_path.with_name(f"{export_path.name}.tmp")
+        with open(tmp_path, "w") as metrics_file:
+            if export_format == "prometheus":
+                metrics_file.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), metrics_file, indent=1)
+        # Prometheus' textfile collector must never read a half written file
+        os.replace(tmp_path, export_path)
+        print(f"Metrics written to {export_path}")
+        return export_path
+
+
+metrics = MetricsRegistry()
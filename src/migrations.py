@@ -0,0 +1,101 @@
+"""
+Versioned schema migrations of the MySQL DB. Each migration is a file in sql/migrations/<dialect>/ named
+V<version>__<name>.sql and the versions applied to a DB are recorded in its schema_migrations table.
+"""
+import re
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+
+migrations_dir = Path(__file__).resolve().parents[1] / "sql" / "migrations"
+migration_table = "schema_migrations"
+migration_file_regex = re.compile(r"V(\d+)__(\w+)\.sql")
+migration_table_ddl = (f"CREATE TABLE IF NOT EXISTS {migration_table} (version int NOT NULL PRIMARY KEY, "
+                       f"name varchar(255) NOT NULL, applied_at TIMESTAMP NOT NULL)")
+
+
+@dataclass()
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    def get_statements(self) -> list[str]:
+        sql_lines = [line for line in self.path.read_text().splitlines() if not line.strip().startswith("--")]
+        return [statement.strip() for statement in "\n".join(sql_lines).split(";") if statement.strip()]
+
+
+def get_migrations(dialect: str) -> list[Migration]:
+    migrations = []
+    for migration_path in (migrations_dir / dialect).glob("*.sql"):
+        file_match = migration_file_regex.fullmatch(migration_path.name)
+        if file_match is not None:
+            migrations.append(Migration(int(file_match.group(1)), file_match.group(2), migration_path))
+    return sorted(migrations, key=lambda migration: migration.version)
+
+
+def get_applied_versions(db_handler: EIHLMysqlHandler) -> set[int]:
+    db_cur = db_handler.db_conn.cursor()
+    try:
+        db_cur.execute(migration_table_ddl)
+        db_cur.execute(f"SELECT version FROM {migration_table}")
+        applied_versions = {row[0] for row in db_cur.fetchall()}
+    finally:
+        db_cur.close()
+    db_handler.commit()
+    return applied_versions
+
+
+def get_pending_migrations(db_handler: EIHLMysqlHandler) -> list[Migration]:
+    # Handlers without a dialect have no migrations, e.g. the SQLite stand-in creates its whole schema when it connects
+    dialect = getattr(db_handler, "schema_dialect", None)
+    if dialect is None:
+        return []
+    applied_versions = get_applied_versions(db_handler)
+    return [migration for migration in get_migrations(dialect) if migration.version not in applied_versions]
+
+
+def apply_migrations(db_handler: EIHLMysqlHandler) -> list[Migration]:
+    """
+    Apply the migrations that haven't been applied to the DB in version order. Stops at the first migration
+    that fails. MySQL commits each DDL statement so the statements of a failed migration that did run
+    have to be reverted by hand before it's applied again.
+    Returns: the migrations that were applied
+    """
+    applied = []
+    for migration in get_pending_migrations(db_handler):
+        db_cur = db_handler.db_conn.cursor()
+        try:
+            for statement in migration.get_statements():
+                db_cur.execute(statement)
+            db_cur.execute(f"INSERT INTO {migration_table} (version, name, applied_at) VALUES (%s, %s, %s)",
+                           (migration.version, migration.name, datetime.now()))
+            db_handler.commit()
+        except Exception:
+            db_handler.db_conn.rollback()
+            print(f"ERROR applying migration {migration.path.name}")
+            traceback.print_exc()
+            break
+        finally:
+            db_cur.close()
+        print(f"Applied migration {migration.path.name}")
+        applied.append(migration)
+    return applied
+
+
+def is_schema_current(db_handler: EIHLMysqlHandler) -> bool:
+    """Check the DB has every migration. The upserts and incremental syncs match on the keys they add."""
+    try:
+        pending = get_pending_migrations(db_handler)
+    except Exception:
+        print("ERROR unable to check the DB schema version")
+        traceback.print_exc()
+        return False
+    if pending:
+        print(f"The DB schema is out of date. Run MIGRATE_DB to apply: "
+              f"{', '.join(migration.path.name for migration in pending)}")
+    return len(pending) == 0
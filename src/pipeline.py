@@ -0,0 +1,78 @@
+"""
+Staged pipeline that streams items through a chain of async stages. Each stage has its own number of worker
+tasks and reads from a bounded queue so a slow stage holds back the stages before it rather than items piling
+up in memory. The items are read from the iterable only as fast as the first stage takes them.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Sequence
+
+# Put on a stage's queue once per worker after the last item so every worker finishes
+_end_of_stage = object()
+
+
+@dataclass()
+class Stage:
+    name: str
+    # Coroutine function that processes an item and returns the item for the next stage. None drops the item.
+    process: Callable[[object], Awaitable]
+    workers: int = field(default=1)
+    # Awaited once every worker of the stage has finished, e.g. to flush a partial batch
+    close: Callable[[], Awaitable] = field(default=None)
+
+
+async def _feed(items: Iterable, queue: asyncio.Queue, num_workers: int):
+    if isinstance(items, Sequence):
+        for item in items:
+            await queue.put(item)
+    else:
+        # Iterators may read their items from a DB a page at a time so they're read off the event loop
+        item_iter = iter(items)
+        while (item := await asyncio.to_thread(next, item_iter, _end_of_stage)) is not _end_of_stage:
+            await queue.put(item)
+    for _ in range(num_workers):
+        await queue.put(_end_of_stage)
+
+
+async def _run_worker(stage: Stage, in_queue: asyncio.Queue, out_queue: asyncio.Queue or None):
+    while True:
+        item = await in_queue.get()
+        if item is _end_of_stage:
+            return
+        result = await stage.process(item)
+        if result is not None and out_queue is not None:
+            await out_queue.put(result)
+
+
+async def _run_stage(stage: Stage, in_queue: asyncio.Queue, out_queue: asyncio.Queue or None,
+                     next_stage_workers: int):
+    await asyncio.gather(*(_run_worker(stage, in_queue, out_queue) for _ in range(stage.workers)))
+    if stage.close is not None:
+        await stage.close()
+    if out_queue is not None:
+        for _ in range(next_stage_workers):
+            await out_queue.put(_end_of_stage)
+
+
+async def run_pipeline(items: Iterable, stages: list[Stage], queue_size: int = 100):
+    """
+    Run every item through the stages in order and return once the last stage has finished.
+    An exception raised by a stage cancels the rest of the pipeline and is raised again here. Stages that
+    shouldn't stop the pipeline for a bad item must handle its errors themselves.
+    Args:
+        queue_size: max items waiting in front of each stage
+    """
+    queues = [asyncio.Queue(max(1, queue_size)) for _ in stages]
+    tasks = [asyncio.create_task(_feed(items, queues[0], stages[0].workers))]
+    for stage_num, stage in enumerate(stages):
+        is_last_stage = stage_num == len(stages) - 1
+        tasks.append(asyncio.create_task(
+            _run_stage(stage, queues[stage_num], None if is_last_stage else queues[stage_num + 1],
+                       0 if is_last_stage else stages[stage_num + 1].workers)))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
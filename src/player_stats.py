@@ -1,16 +1,20 @@
 import traceback
-from datetime import datetime
-from queue import Queue
-from threading import Thread
-from typing import Callable
+from functools import partial
+from typing import Callable, Iterator
 
-import pandas as pd
+from bs4 import BeautifulSoup
+from pypika import Field
 
 from settings.settings import eihl_match_url
 # TODO Create Protocol for DB handler
 from src.data_handlers.eihl_mysql import EIHLMysqlHandler
-from src.match import get_db_matches
-from src.web_scraping.eihl_website_scraping import extract_match_stats
+from src.dedup_index import load_key_index, upsert_new_or_changed_rows
+from src.match import get_match_page_max_age
+from src.metrics import metrics
+from src.scrape_engine import scrape_matches
+from src.utils import parse_html, get_html_content
+from src.web_scraping.eihl_website_scraping import iter_match_player_stats, match_stats_strainer
+from src.work_discovery import find_matches_missing_stats
 
 
 def build_match_stats_url(eihl_web_match_id):
@@ -19,93 +23,68 @@ def build_match_stats_url(eihl_web_match_id):
 
 
 def insert_player_stats_to_db(db_handler: EIHLMysqlHandler, *player_match_stats: dict):
-    for player_stats in player_match_stats:
-        team_name = player_stats.get("team_name", None)
-        player_name = player_stats.get("player_name", None)
-        match_id = player_stats.get("match_id", None)
-        # TODO find better solution to replace NaNs with Nones
-        player_stats = {k: (v if not isinstance(v, float) or not pd.isna(v) else None)
-                        for k, v in player_stats.items()}
-
-        try:
-            if len(db_handler.get_dup_records(params=player_stats, table="match_player_stats")) == 0:
-                print(f"Match ID: {match_id}, team: {team_name}, player {player_name} stats to be inserted!")
-                db_handler.insert_data("match_player_stats", player_stats)
-            else:
-                print(f"Match ID {match_id} team: {team_name}, player: {player_name} stats already exists in DB.")
-                db_handler.update_data("match_player_stats", player_stats)
-                print(f"Match ID {match_id} team: {team_name}, player: {player_name} Updated Successfully.")
-        except Exception:
-            traceback.print_exc()
-
-
-def get_player_stats(db_handler, match=None, match_stats_url: str = None) -> list[dict]:
-    player_stats = []
-    match_stats: pd.DataFrame = extract_match_stats(match_stats_url)
-    for team_name, team_stats in match_stats.items():
-        team_stats = team_stats.rename(columns=db_handler.match_player_stats_cols)
-        try:
-            team_stats["team_name"] = team_name
-            team_stats["match_id"] = match.get("match_id", None)
-            team_stat_dicts: dict = team_stats.to_dict('records')
-            player_stats.append(team_stat_dicts)
-        except AttributeError:
-            traceback.print_exc()
-            return
-    return player_stats
-
-
-def player_stats_producer(stat_queue, matches):
+    """Raises: the error of the DB when the stats can't be written"""
+    if not player_match_stats:
+        return
+    match_ids = {stats.get("match_id", None) for stats in player_match_stats}
+    # Rows that are already in the DB with the same values aren't written again
+    stats_index = load_key_index(db_handler, "match_player_stats", Field("match_id").isin(list(match_ids)))
+    rows_written = upsert_new_or_changed_rows(db_handler, stats_index, player_match_stats)
+    match_ids = sorted(str(match_id) for match_id in match_ids)
+    print(f"{rows_written} player stats upserted for match IDs: {', '.join(match_ids)}")
+
+
+def iter_player_stats_records(res_beaus: BeautifulSoup, match: dict, player_stats_cols: dict) -> Iterator[dict]:
+    match_id = match.get("match_id", None)
+    for team_name, player_stats in iter_match_player_stats(res_beaus):
+        player_stats = {player_stats_cols.get(col, col): value for col, value in player_stats.items()}
+        player_stats["team_name"] = team_name
+        player_stats["match_id"] = match_id
+        yield player_stats
+
+
+def get_player_stats_from_html(res_beaus: BeautifulSoup, match: dict, player_stats_cols: dict) -> list[list[dict]]:
+    player_stats = {}
+    for player_stats_record in iter_player_stats_records(res_beaus, match, player_stats_cols):
+        player_stats.setdefault(player_stats_record["team_name"], []).append(player_stats_record)
+    return list(player_stats.values())
+
+
+def get_player_stats(db_handler, match=None, match_stats_url: str = None) -> list[list[dict]]:
+    print(f"\nNext match is {match_stats_url}\n")
+    res_beaus = get_html_content(match_stats_url, get_match_page_max_age(match or {}), match_stats_strainer)
+    return get_player_stats_from_html(res_beaus, match or {}, db_handler.match_player_stats_cols)
+
+
+def get_player_stats_records(html: bytes, match_info: dict, player_stats_cols: dict) -> list[dict]:
+    return list(iter_player_stats_records(parse_html(html, match_stats_strainer), match_info, player_stats_cols))
+
+
+@metrics.timed("eihl_scraper_seconds")
+def parse_player_stats_page(html: bytes, match_info: dict, player_stats_cols: dict = None) -> list[dict]:
+    if player_stats_cols is None:
+        player_stats_cols = EIHLMysqlHandler.match_player_stats_cols
     try:
-        print("Producer: Running")
-        for match_info in matches:
-            match_stats_url = build_match_stats_url(match_info.get("eihl_web_match_id", ""))
-            stat_queue.put((match_info, match_stats_url))
-
-        print("Producer: Done")
-        # team_stats.apply(insert_team_match_stats, args=(db_cur, db_conn, True), axis=1)
-    except Exception:
+        return get_player_stats_records(html, match_info, player_stats_cols)
+    except AttributeError:
         traceback.print_exc()
+        return []
 
 
-def player_stats_consumer(stat_queue, db_object_func):
-    print("Consumer: Running")
-    db_handler = db_object_func()
-    while True:
-        match_info, match_url = stat_queue.get(block=True)
-        if match_info is None:
-            break
-        try:
-            all_player_stats = get_player_stats(db_handler, match=match_info, match_stats_url=match_url)
-            for team_player_stats in all_player_stats:
-                insert_player_stats_to_db(db_handler, *team_player_stats)
-        except Exception:
-            traceback.print_exc()
-        finally:
-            stat_queue.task_done()
-    print('Consumer: Done')
-
-
-def update_players_stats(db_obj_func: Callable, matches: list[dict] = None, num_threads=5):
-    db_handler = db_obj_func()
-    if matches is None or len(matches) == 0:
-        matches = get_db_matches(db_handler, end_date=datetime.now())
-
-    matches_queue = Queue()
-    player_stats_producer(matches_queue, matches)
-    consumers = [Thread(target=player_stats_consumer, args=(matches_queue, db_obj_func,)) for i in range(num_threads)]
-    # TODO implement logging
-    try:
-        for consumer in consumers:
-            # Setting daemon to True will let the main thread exit even though the workers are blocking
-            consumer.daemon = True
-            consumer.start()
-    except Exception:
-        print("THREADING ERROR!")
-    # producer = Thread(target=player_stats_producer, args=(matches_queue, matches))
-    # producer.start()
-    # producer.join()
-    # for consumer in consumers:
-    #     consumer.join()
-    matches_queue.join()
+def write_player_stats_batch(db_handler: EIHLMysqlHandler, player_stats_batch: list[dict]):
+    insert_player_stats_to_db(db_handler, *player_stats_batch)
+
+
+def update_players_stats(db_obj_func: Callable, matches: list[dict] = None, max_concurrency: int = None):
+    with db_obj_func() as db_handler, db_obj_func() as discovery_handler:
+        if matches is None:
+            # Only the matches that are missing a score or their stats. They're read a page at a time on their
+            # own connection while the stats are written on the other
+            matches = find_matches_missing_stats(discovery_handler, ("match_player_stats",))
+
+        scrape_matches(matches, lambda match_info: build_match_stats_url(match_info.get("eihl_web_match_id", "")),
+                       partial(parse_player_stats_page, player_stats_cols=db_handler.match_player_stats_cols),
+                       partial(write_player_stats_batch, db_handler),
+                       get_max_age=get_match_page_max_age,
+                       settings={"max_concurrency": max_concurrency} if max_concurrency else None)
     print("Player match stats insertion Successful!!!")
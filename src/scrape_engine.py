@@ -0,0 +1,156 @@
+import asyncio
+import time
+import traceback
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from typing import Callable, Iterable
+
+from settings.settings import async_scrape_settings, fetch_scheduler_settings
+from src.metrics import metrics
+from src.pipeline import run_pipeline, Stage
+from src.web_scraping.async_fetcher import AsyncFetcher
+
+
+def get_fetch_workers(settings: dict) -> int:
+    # A fetch worker over the fetch scheduler's limit would only wait for a request slot
+    return settings.get("max_concurrency", None) or fetch_scheduler_settings.get("max_concurrency", 20)
+
+
+def get_parse_workers(settings: dict) -> int:
+    return settings.get("parse_workers", None) or os.cpu_count()
+
+
+def build_parse_executor(settings: dict) -> Executor:
+    """
+    Thread workers suit a sync where most of the time is spent waiting on the website. A backfill is bound
+    by the CPU time of parsing so process workers let it use every core.
+    """
+    parse_workers = get_parse_workers(settings)
+    if settings.get("parse_executor", "thread") == "process":
+        return ProcessPoolExecutor(parse_workers)
+    return ThreadPoolExecutor(parse_workers)
+
+
+def _timed_parse(parse: Callable, html, match: dict) -> tuple[list, float]:
+    # Timed in the worker so time spent waiting for a free worker isn't counted
+    start = time.perf_counter()
+    records = parse(html, match)
+    return records, time.perf_counter() - start
+
+
+async def _write_batch(write_batch: Callable, db_executor: ThreadPoolExecutor, batch: list[dict],
+                       batch_matches: list[dict], on_error: Callable = None):
+    """
+    A batch that fails to write is reported as a failure of every match in it. write_batch must only record
+    the matches as done (e.g. in a checkpoint) once they're written so they're scraped again by the next run.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(db_executor, write_batch, batch)
+        metrics.observe("eihl_scrape_stage_seconds", time.perf_counter() - start, stage="write")
+        metrics.inc("eihl_scrape_records_total", len(batch))
+    except Exception as write_error:
+        metrics.inc("eihl_scrape_errors_total", stage="write")
+        print(f"ERROR writing a batch of {len(batch)} records of {len(batch_matches)} matches to the DB")
+        traceback.print_exc()
+        if on_error is not None:
+            for match in batch_matches:
+                on_error(match, write_error, None, "write")
+
+
+async def _scrape_matches(matches: Iterable[dict], build_url: Callable, parse: Callable, write_batch: Callable,
+                          get_max_age: Callable = None, on_error: Callable = None, settings: dict = None):
+    loop = asyncio.get_running_loop()
+    batch_size = settings.get("db_batch_size", 50)
+    batch = []
+    # Matches whose records are in the batch
+    batch_matches = []
+
+    def handle_error(match: dict, url, stage: str, scrape_error: Exception, html=None):
+        metrics.inc("eihl_scrape_errors_total", stage=stage)
+        print(f"ERROR scraping {url}")
+        traceback.print_exc()
+        if on_error is not None:
+            on_error(match, scrape_error, html, stage)
+
+    # A single DB thread keeps all writes on one connection
+    with build_parse_executor(settings) as parse_executor, \
+            ThreadPoolExecutor(1) as db_executor:
+        async with AsyncFetcher() as fetcher:
+            async def fetch_match(match: dict) -> tuple[dict, str or dict, bytes or dict] or None:
+                url = build_url(match)
+                max_age = get_max_age(match) if get_max_age else None
+                html = None
+                try:
+                    start = time.perf_counter()
+                    if isinstance(url, dict):
+                        # Several pages make up the match so fetch them all at once
+                        pages = await asyncio.gather(*(fetcher.fetch_page(page_url, max_age)
+                                                       for page_url in url.values()), return_exceptions=True)
+                        # The pages that were fetched are passed to on_error when another page fails
+                        html = {name: page for name, page in zip(url, pages) if not isinstance(page, BaseException)}
+                        for page in pages:
+                            if isinstance(page, BaseException):
+                                raise page
+                    else:
+                        html = await fetcher.fetch_page(url, max_age)
+                    metrics.observe("eihl_scrape_stage_seconds", time.perf_counter() - start, stage="fetch")
+                except Exception as scrape_error:
+                    handle_error(match, url, "fetch", scrape_error, html)
+                    return None
+                return match, url, html
+
+            async def parse_match(fetched: tuple[dict, str or dict, bytes or dict]) -> list or None:
+                match, url, html = fetched
+                try:
+                    records, parse_secs = await loop.run_in_executor(parse_executor, _timed_parse, parse, html, match)
+                    metrics.observe("eihl_scrape_stage_seconds", parse_secs, stage="parse")
+                except Exception as scrape_error:
+                    handle_error(match, url, "parse", scrape_error, html)
+                    return None
+                return (match, records) if records else None
+
+            async def write_records(parsed: tuple[dict, list]):
+                match, records = parsed
+                batch.extend(records)
+                batch_matches.append(match)
+                if len(batch) >= batch_size:
+                    await flush_records()
+
+            async def flush_records():
+                if batch:
+                    await _write_batch(write_batch, db_executor, batch.copy(), batch_matches.copy(), on_error)
+                    batch.clear()
+                    batch_matches.clear()
+
+            await run_pipeline(matches, [Stage("fetch", fetch_match, get_fetch_workers(settings)),
+                                         Stage("parse", parse_match, get_parse_workers(settings)),
+                                         Stage("write", write_records, 1, flush_records)],
+                               settings.get("queue_size", 100))
+
+
+def scrape_matches(matches: Iterable[dict], build_url: Callable[[dict], str or dict[str, str]],
+                   parse: Callable[[bytes or dict[str, bytes], dict], list], write_batch: Callable[[list], None],
+                   get_max_age: Callable[[dict], int or None] = None,
+                   on_error: Callable[[dict, Exception, bytes or dict or None, str], None] = None,
+                   settings: dict = None):
+    """
+    Fetch a page for every match concurrently, parse each page in a worker thread and write the parsed
+    records to the DB in batches from a single thread. The fetch, parse and write stages are connected by
+    bounded queues (see pipeline.run_pipeline) so memory use doesn't grow with the number of matches.
+    Args:
+        matches: match records from the DB. A generator is read as the matches are fetched
+        build_url: returns the URL of the page to scrape for a match or a dict of page name to URL
+            when a match is made up of several pages
+        parse: converts the raw page content (or a dict of page name to content) of a match
+            into a list of DB records. Must be picklable when parse_executor is "process"
+        write_batch: writes a list of DB records
+        get_max_age: returns the max age of a cached page for a match (see fetcher.fetch_page)
+        on_error: called from the event loop with the match, the exception, the content of the pages that
+            were fetched (None when no page was fetched) and the stage ("fetch", "parse" or "write") when a match
+            fails. A batch that fails to write fails every match in it
+        settings: overrides async_scrape_settings
+    """
+    scrape_settings = {**async_scrape_settings, **(settings or {})}
+    asyncio.run(_scrape_matches(matches, build_url, parse, write_batch, get_max_age, on_error,
+                                scrape_settings))
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import traceback
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from pypika import Field
+
+from settings.settings import scrape_state_settings
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.Exceptions import DBReadFailed
+
+match_state_table = "match_scrape_state"
+championship_state_table = "championship_scrape_state"
+match_state_flags = ("has_score", "has_team_stats", "has_player_stats")
+
+
+def get_content_hash(*content) -> str:
+    """Hash of the data extracted from a page so cosmetic changes to the page don't count as a change"""
+    content_json = json.dumps(content, default=str, sort_keys=True)
+    return hashlib.sha256(content_json.encode("utf-8")).hexdigest()
+
+
+def get_scrape_states(db_handler: EIHLMysqlHandler, table: str, key_col: str, keys: Iterable = None) \
+        -> dict[int, dict]:
+    """
+    Args:
+        keys: only read the states of these keys, e.g. of a batch of matches. Defaults to every state
+    Raises: DBReadFailed when the ledger can't be read. Taking it as empty would reset the failure counts and
+        have every complete match and championship scraped again
+    """
+    # work_discovery imports this module for the ledger's table and flags
+    from src.work_discovery import get_query_class
+
+    query = get_query_class(db_handler).from_(table).select("*")
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return {}
+        query = query.where(Field(key_col).isin(keys))
+    states = db_handler.fetch_all_data(str(query))
+    if states is None:
+        raise DBReadFailed(table)
+    return {state[key_col]: state for state in states}
+
+
+def get_match_scrape_states(db_handler: EIHLMysqlHandler, match_ids: Iterable[int] = None) -> dict[int, dict]:
+    return get_scrape_states(db_handler, match_state_table, "match_id", match_ids)
+
+
+def get_championship_scrape_states(db_handler: EIHLMysqlHandler) -> dict[int, dict]:
+    return get_scrape_states(db_handler, championship_state_table, "eihl_web_id")
+
+
+def is_match_scrape_complete(state: dict or None) -> bool:
+    return state is not None and all(state.get(flag, False) for flag in match_state_flags)
+
+
+def get_recheck_from(now: datetime = None) -> datetime:
+    """Returns: date from which complete matches are checked again in case their stats were corrected"""
+    return (now or datetime.now()) - timedelta(days=scrape_state_settings.get("recheck_days", 3))
+
+
+def is_match_in_recheck_window(match: dict, now: datetime = None) -> bool:
+    match_date = match.get("match_date", None)
+    if match_date is None:
+        return False
+    if not isinstance(match_date, datetime):
+        match_date = datetime.combine(match_date, datetime.min.time())
+    return match_date >= get_recheck_from(now)
+
+
+def is_championship_scrape_complete(championship: dict, state: dict or None) -> bool:
+    end_date = championship.get("end_date", None)
+    if state is None or end_date is None:
+        return False
+    if not isinstance(end_date, datetime):
+        end_date = datetime.combine(end_date, datetime.min.time())
+    grace_days = scrape_state_settings.get("championship_grace_days", 7)
+    return state.get("last_fetched", datetime.min) > end_date + timedelta(days=grace_days)
+
+
+def build_failed_scrape_state(key_col: str, key, state: dict or None, error: Exception) -> dict:
+    return {key_col: key,
+            "last_fetched": datetime.now(),
+            "failure_count": (state or {}).get("failure_count", 0) + 1,
+            "last_error": f"{type(error).__name__}: {error}"[:500]}
+
+
+def save_scrape_states(db_handler: EIHLMysqlHandler, table: str, key_col: str, states: list[dict]):
+    if not states:
+        return
+    try:
+        db_handler.upsert_data(table, states, conflict_cols=(key_col,))
+    except Exception:
+        print(f"ERROR saving {len(states)} scrape states to {table}")
+        traceback.print_exc()
+
+
+def save_match_scrape_states(db_handler: EIHLMysqlHandler, states: list[dict]):
+    save_scrape_states(db_handler, match_state_table, "match_id", states)
+
+
+def save_championship_scrape_states(db_handler: EIHLMysqlHandler, states: list[dict]):
+    save_scrape_states(db_handler, championship_state_table, "eihl_web_id", states)
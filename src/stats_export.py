@@ -0,0 +1,207 @@
+"""
+Export of the match, team stats and player stats tables to Parquet files partitioned by championship and month.
+Only partitions whose rows have changed since the last export are rewritten.
+"""
+import json
+import os
+import traceback
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable
+
+from settings.settings import stats_export_settings
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.Exceptions import DBReadFailed
+from src.scrape_state import get_content_hash
+from src.work_discovery import get_query_class
+
+# pyarrow is only needed to export or read the stats files so it's imported by check_pyarrow when they are
+pa = None
+pq = None
+
+export_tables = {
+    # table: columns rows are ordered by so a partition's content hash only changes with its rows
+    "match": ("match_id",),
+    "match_team_stats": ("match_id", "team_name"),
+    "match_player_stats": ("match_id", "team_name", "player_name")
+}
+manifest_file_name = "manifest.json"
+
+
+def check_pyarrow():
+    global pa, pq
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required to export or read the stats. Install it with: pip install pyarrow")
+    pa, pq = pyarrow, pyarrow.parquet
+
+
+def get_export_dir(export_dir: str or Path = None) -> Path:
+    return Path(export_dir if export_dir is not None else stats_export_settings.get("export_dir", "exports"))
+
+
+def get_match_partition(match: dict) -> tuple[str, str]:
+    match_date = match.get("match_date", None)
+    month = match_date.strftime("%Y-%m") if isinstance(match_date, (date, datetime)) else "unknown"
+    return str(match.get("championship_id", None) or "unknown"), month
+
+
+def get_partition_path(export_dir: Path, table: str, partition: tuple[str, str]) -> Path:
+    championship_id, month = partition
+    return export_dir / table / championship_id / f"{month}.parquet"
+
+
+def load_export_manifest(export_dir: Path) -> dict[str, dict[str, str]]:
+    """Returns: content hash of every exported partition by table and partition path"""
+    try:
+        with open(export_dir / manifest_file_name) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_export_manifest(export_dir: Path, manifest: dict[str, dict[str, str]]):
+    tmp_path = export_dir / f"{manifest_file_name}.tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, export_dir / manifest_file_name)
+
+
+def get_table_rows(db_handler: EIHLMysqlHandler, table: str) -> list[dict]:
+    """
+    Raises: DBReadFailed when the table can't be read. A failed read must never look like a table without rows
+        or every partition of it would be deleted
+    """
+    query = get_query_class(db_handler).from_(table).select("*").orderby(*export_tables[table])
+    rows = db_handler.fetch_all_data(str(query))
+    if rows is None:
+        raise DBReadFailed(table)
+    return rows
+
+
+def group_rows_by_partition(rows: list[dict], match_partitions: dict[int, tuple[str, str]]) \
+        -> dict[tuple[str, str], list[dict]]:
+    partition_rows = {}
+    for row in rows:
+        partition = match_partitions.get(row.get("match_id", None), ("unknown", "unknown"))
+        partition_rows.setdefault(partition, []).append(row)
+    return partition_rows
+
+
+def write_partition(path: Path, rows: list[dict]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(pa.Table.from_pylist(rows), tmp_path,
+                   compression=stats_export_settings.get("compression", "snappy"))
+    # Readers never see a half written file
+    os.replace(tmp_path, path)
+
+
+def export_table(table: str, partition_rows: dict[tuple[str, str], list[dict]], export_dir: Path,
+                 table_manifest: dict[str, str], partitions: set[tuple[str, str]] = None) -> int:
+    """
+    Write the partitions of a table whose content hash differs from the manifest and delete the files of
+    partitions that no longer have rows. Only the given partitions are touched when partitions is set.
+    Returns: number of partition files written
+    """
+    partitions_written = 0
+    for partition, rows in partition_rows.items():
+        partition_key = "/".join(partition)
+        content_hash = get_content_hash(rows)
+        if table_manifest.get(partition_key, None) == content_hash:
+            continue
+        try:
+            write_partition(get_partition_path(export_dir, table, partition), rows)
+        except Exception:
+            print(f"ERROR exporting {table} partition {partition_key}")
+            traceback.print_exc()
+        else:
+            table_manifest[partition_key] = content_hash
+            partitions_written += 1
+    for partition_key in list(table_manifest):
+        partition = tuple(partition_key.split("/"))
+        if partition in partition_rows or (partitions is not None and partition not in partitions):
+            continue
+        get_partition_path(export_dir, table, partition).unlink(missing_ok=True)
+        del table_manifest[partition_key]
+    return partitions_written
+
+
+def export_stats(db_obj_func: Callable, export_dir: str or Path = None,
+                 championship_ids: list[int] = None) -> dict[str, int]:
+    """
+    Export the match, match_team_stats and match_player_stats tables to Parquet partitioned by
+    championship and month. Team and player stats take the partition of their match.
+    Args:
+        db_obj_func: function that returns a DB handler
+        export_dir: defaults to stats_export_settings["export_dir"]
+        championship_ids: only export these championships
+    Returns: number of partition files written for each table
+    Raises: DBReadFailed when a table can't be read. Nothing is exported then
+    """
+    check_pyarrow()
+    export_dir = get_export_dir(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_export_manifest(export_dir)
+    with db_obj_func() as db_handler:
+        # Every table is read before any partition is written or deleted so a failed read changes nothing
+        table_rows = {table: get_table_rows(db_handler, table) for table in export_tables}
+    matches = table_rows["match"]
+    if championship_ids:
+        matches = [match for match in matches if match.get("championship_id", None) in championship_ids]
+    match_partitions = {match.get("match_id", None): get_match_partition(match) for match in matches}
+    partitions = set(match_partitions.values()) if championship_ids else None
+    partitions_written = {}
+    for table in export_tables:
+        rows = matches if table == "match" else [row for row in table_rows[table]
+                                                 if row.get("match_id", None) in match_partitions]
+        partitions_written[table] = export_table(table, group_rows_by_partition(rows, match_partitions),
+                                                 export_dir, manifest.setdefault(table, {}), partitions)
+    save_export_manifest(export_dir, manifest)
+    print(f"Stats exported to {export_dir}. Partitions rewritten: "
+          f"{', '.join(f'{table}: {count}' for table, count in partitions_written.items())}")
+    return partitions_written
+
+
+def get_partition_paths(table: str, championship_ids: list[int] = None, months: list[str] = None,
+                        export_dir: str or Path = None) -> list[Path]:
+    export_dir = get_export_dir(export_dir)
+    table_manifest = load_export_manifest(export_dir).get(table, {})
+    championship_ids = {str(championship_id) for championship_id in championship_ids or ()}
+    partition_paths = []
+    for partition_key in sorted(table_manifest):
+        championship_id, month = partition_key.split("/")
+        if (championship_ids and championship_id not in championship_ids) or (months and month not in months):
+            continue
+        partition_paths.append(get_partition_path(export_dir, table, (championship_id, month)))
+    return partition_paths
+
+
+def read_stats_table(table: str, championship_ids: list[int] = None, months: list[str] = None,
+                     columns: list[str] = None, export_dir: str or Path = None) -> "pa.Table":
+    """
+    Returns: Arrow table of the exported partitions of a table, optionally only of some championships and
+        months (YYYY-MM). The files are memory mapped while they're read.
+    """
+    check_pyarrow()
+    tables = [pq.read_table(path, columns=columns, memory_map=True)
+              for path in get_partition_paths(table, championship_ids, months, export_dir)]
+    if not tables:
+        return pa.table({column: [] for column in columns or ()})
+    # Partitions where a column is always empty have it typed as null
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def read_stats_columns(table: str, columns: list[str], championship_ids: list[int] = None,
+                       months: list[str] = None, export_dir: str or Path = None) -> dict:
+    """
+    Returns: NumPy array of each column. Parquet pages are compressed so the values are decoded from the
+        memory mapped files rather than mapped directly.
+    """
+    stats_table = read_stats_table(table, championship_ids, months, columns, export_dir)
+    return {column: stats_table.column(column).to_numpy() for column in columns}
@@ -1,94 +1,67 @@
-import traceback
-from datetime import datetime
-from queue import Queue
-from threading import Thread
+from functools import partial
 
-from pypika import Parameter, Field
+from pypika import Field
 
 # TODO Create Protocol for DB handler
 from src.data_handlers.eihl_mysql import EIHLMysqlHandler
-from src.match import get_db_matches
-from src.web_scraping.eihl_website_scraping import extract_team_match_stats, get_eihl_match_url
+from src.dedup_index import load_key_index, upsert_new_or_changed_rows
+from src.match import get_match_page_max_age
+from src.metrics import metrics
+from src.scrape_engine import scrape_matches
+from src.utils import parse_html
+from src.web_scraping.eihl_website_scraping import get_team_match_stats_from_html, get_eihl_match_url, \
+    match_stats_strainer
+from src.work_discovery import find_matches_missing_stats
 
 
-def team_stats_producer(stat_queue, matches):
-    try:
-        print("Producer: Running")
-        for match_info in matches:
-            match_stats_url = get_eihl_match_url(match_info.get('eihl_web_match_id', ''))
-            stat_queue.put((match_info, match_stats_url))
-        print("Producer: Done")
-        # team_stats.apply(insert_team_match_stats, args=(db_cur, db_conn, True), axis=1)
-    except Exception:
-        traceback.print_exc()
+def build_team_stats_url(match_info: dict) -> str:
+    return get_eihl_match_url(match_info.get('eihl_web_match_id', ''))
 
 
-def team_stats_consumer(stat_queue, db_object_func):
-    print("Consumer: Running")
-    db_handler = db_object_func()
-    while True:
-        match_info, match_url = stat_queue.get(block=True)
-        if match_info is None:
-            break
-        try:
-            match_stats = extract_team_match_stats(match_url)
-            for k, team_stats in match_stats.items():
-                # TODO data source handler should handle column name conversions
-                team_stats["team_name"] = match_info.get(k, None)
-                team_stats["match_id"] = match_info.get("match_id", None)
-                team_stats = {db_handler.match_team_stats_cols.get(k, k): v for k, v in team_stats.items()}
-                insert_team_match_stats_to_db(db_handler, team_stats)
-        except Exception:
-            traceback.print_exc()
-        finally:
-            stat_queue.task_done()
-    print('Consumer: Done')
+def get_team_stats_records(match_info: dict, match_stats: dict, team_stats_cols: dict) -> list[dict]:
+    team_stats_records = []
+    for k, team_stats in match_stats.items():
+        # TODO data source handler should handle column name conversions
+        team_stats["team_name"] = match_info.get(k, None)
+        team_stats["match_id"] = match_info.get("match_id", None)
+        team_stats_records.append({team_stats_cols.get(k, k): v for k, v in team_stats.items()})
+    return team_stats_records
 
 
-def insert_team_match_stats_to_db(db_handler: EIHLMysqlHandler, team_match_stats: dict):
-    team_name = team_match_stats.get("team_name", None)
-    match_id = team_match_stats.get("match_id", None)
-    dup_records = db_handler.get_dup_records(params=team_match_stats, table="match_team_stats",
-                                             where_clause=((Field("match_id") == Parameter("%(match_id)s")) &
-                                                           (Field("team_name") == Parameter("%(team_name)s"))
-                                                           )
-                                             )
+@metrics.timed("eihl_scraper_seconds")
+def parse_team_stats_page(html: bytes, match_info: dict, team_stats_cols: dict = None) -> list[dict]:
+    if team_stats_cols is None:
+        team_stats_cols = EIHLMysqlHandler.match_team_stats_cols
+    match_stats = get_team_match_stats_from_html(parse_html(html, match_stats_strainer))
+    return get_team_stats_records(match_info, match_stats, team_stats_cols)
 
-    if len(dup_records) == 0:
-        try:
-            db_handler.insert_data("match_team_stats", team_match_stats)
-        except TypeError:
-            traceback.print_exc()
-        else:
-            print(f"Match ID: {match_id} team: {team_name} stats inserted!")
-    else:
-        db_handler.update_data("match_team_stats", team_match_stats,
-                               where_clause=((Field("match_id") == Parameter("%(match_id)s")) &
-                                             (Field("team_name") == Parameter("%(team_name)s"))
-                                             )
-                               )
 
+def insert_team_match_stats_to_db(db_handler: EIHLMysqlHandler, *team_match_stats: dict):
+    """Raises: the error of the DB when the stats can't be written"""
+    if not team_match_stats:
+        return
+    match_ids = {stats.get("match_id", None) for stats in team_match_stats}
+    # Rows that are already in the DB with the same values aren't written again
+    stats_index = load_key_index(db_handler, "match_team_stats", Field("match_id").isin(list(match_ids)))
+    rows_written = upsert_new_or_changed_rows(db_handler, stats_index, team_match_stats)
+    match_ids = sorted(str(match_id) for match_id in match_ids)
+    print(f"{rows_written} team stats upserted for match IDs: {', '.join(match_ids)}")
 
-def update_match_team_stats(db_obj_func: callable, num_threads=5, matches: list[dict] = None):
-    db_handler = db_obj_func()
-    if len(matches) == 0:
-        matches = get_db_matches(db_handler, end_date=datetime.now())
 
-    matches_queue = Queue()
-    team_stats_producer(matches_queue, matches)
-    consumers = [Thread(target=team_stats_consumer, args=(matches_queue, db_obj_func,)) for i in range(num_threads)]
-    # TODO implement logging
-    try:
-        for consumer in consumers:
-            # Setting daemon to True will let the main thread exit even though the workers are blocking
-            consumer.daemon = True
-            consumer.start()
-    except Exception:
-        print("THREADING ERROR!")
-    # producer = Thread(target=player_stats_producer, args=(matches_queue, matches))
-    # producer.start()
-    # producer.join()
-    # for consumer in consumers:
-    #     consumer.join()
-    matches_queue.join()
+def write_team_stats_batch(db_handler: EIHLMysqlHandler, team_stats_batch: list[dict]):
+    insert_team_match_stats_to_db(db_handler, *team_stats_batch)
+
+
+def update_match_team_stats(db_obj_func: callable, max_concurrency: int = None, matches: list[dict] = None):
+    with db_obj_func() as db_handler, db_obj_func() as discovery_handler:
+        if matches is None:
+            # Only the matches that are missing a score or their stats. They're read a page at a time on their
+            # own connection while the stats are written on the other
+            matches = find_matches_missing_stats(discovery_handler, ("match_team_stats",))
+
+        scrape_matches(matches, build_team_stats_url,
+                       partial(parse_team_stats_page, team_stats_cols=db_handler.match_team_stats_cols),
+                       partial(write_team_stats_batch, db_handler),
+                       get_max_age=get_match_page_max_age,
+                       settings={"max_concurrency": max_concurrency} if max_concurrency else None)
     print("Team match stats insertion Successful!!!")
@@ -2,8 +2,13 @@ import re
 from dataclasses import dataclass, field
 from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+from settings.settings import html_parser_settings
+from src.metrics import metrics
+from src.web_scraping.fetcher import fetch_page
+
+percentage_regex = re.compile(r"(\d+.\d+)(?=%)")
 
 
 @dataclass()
@@ -40,14 +45,12 @@ def extract_date_from_str(text: str, fmt: str) -> datetime or None:
         return None
 
 
-def extract_float_from_str(str_value: str, float_regex=r"(\d+.\d+)(?=%)"):
+def extract_float_from_str(str_value: str, float_regex: str or re.Pattern = percentage_regex):
     if not isinstance(str_value, str):
         return None
 
-    if re.findall(float_regex, str_value):
-        float_value = re.search(float_regex, str_value).group(1)
-    else:
-        float_value = str_value
+    float_match = re.search(float_regex, str_value)
+    float_value = float_match.group(1) if float_match is not None else str_value
 
     try:
         float_value = float(float_value)
@@ -57,9 +60,34 @@ def extract_float_from_str(str_value: str, float_regex=r"(\d+.\d+)(?=%)"):
     return float_value
 
 
-def get_html_content(url: str) -> BeautifulSoup:
-    response = requests.get(url)
-    res_beaus = BeautifulSoup(response.content, 'html.parser')
+@metrics.timed("eihl_scraper_seconds")
+def parse_html(content: bytes or str, parse_only: SoupStrainer = None, parser: str = None,
+               use_strainers: bool = None) -> BeautifulSoup:
+    """
+    Args:
+        content: raw HTML
+        parse_only: restricts the tree to the tags the caller reads
+        parser: overrides the parser in html_parser_settings
+        use_strainers: overrides use_strainers in html_parser_settings
+    Returns: parsed HTML
+    """
+    if parser is None:
+        parser = html_parser_settings.get("parser", "html.parser")
+    if use_strainers is None:
+        use_strainers = html_parser_settings.get("use_strainers", False)
+    if not use_strainers:
+        parse_only = None
+    try:
+        res_beaus = BeautifulSoup(content, parser, parse_only=parse_only)
+    except FeatureNotFound:
+        print(f"HTML parser {parser} is not installed. Using html.parser instead")
+        html_parser_settings["parser"] = "html.parser"
+        res_beaus = BeautifulSoup(content, 'html.parser', parse_only=parse_only)
+    return res_beaus
+
+
+def get_html_content(url: str, max_age: int = None, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    res_beaus = parse_html(fetch_page(url, max_age), parse_only)
     return res_beaus
 
 
@@ -76,8 +104,7 @@ def get_ignore_words():
 
 
 def get_page_text(url: str, ignore_words: list = None) -> str:
-    response = requests.get(url)
-    res_beaus = BeautifulSoup(response.content, 'html.parser')
+    res_beaus = get_html_content(url)
     page_words: str = res_beaus.body.get_text()
     html_content = page_words.strip('\t\r\n')
     page_words = re.sub(r'\W', ' ', html_content)
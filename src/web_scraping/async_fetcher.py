@@ -0,0 +1,93 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from settings.settings import http_settings, fetch_scheduler_settings
+from src.metrics import metrics
+from src.web_scraping.fetch_scheduler import get_fetch_scheduler, get_retry_delay
+from src.web_scraping.fetcher import FetchTiming, fetch, fetch_stats, get_cached_page, get_conditional_headers, \
+    handle_page_response
+
+try:
+    import httpx
+except ImportError:
+    # Without httpx the blocking fetcher is run in the event loop's default thread pool
+    httpx = None
+
+
+class AsyncFetcher:
+    """
+    Fetches web pages concurrently from the event loop. Pages go through the same page cache, fetch scheduler
+    and fetch stats as the blocking fetcher so the fetch scheduler is the only limit on the requests in flight
+    and their rate.
+    """
+
+    def __init__(self, max_connections: int = None):
+        if max_connections is None:
+            max_connections = fetch_scheduler_settings.get("max_concurrency", 20)
+        self.max_connections = max_connections
+        self._client = None
+
+    async def __aenter__(self):
+        # Replayed pages go through the blocking fetcher's transport
+        if httpx is not None and http_settings.get("replay_corpus_dir", None) is None:
+            connect_timeout, read_timeout = http_settings.get("timeout", (5, 30))
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=http_settings.get("pool_maxsize", 10)),
+                headers={"User-Agent": http_settings.get("user_agent", "eihl_stat_collector")})
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, url: str, headers: dict = None) -> tuple[int, bytes, dict]:
+        if self._client is None:
+            # The blocking fetcher goes through the fetch scheduler itself
+            response = await asyncio.to_thread(fetch, url, headers)
+            return response.status_code, response.content, response.headers
+        return await self._get_with_retries(url, urlsplit(url).hostname, headers)
+
+    async def _get_with_retries(self, url: str, host: str, headers: dict = None) -> tuple[int, bytes, dict]:
+        fetch_scheduler = get_fetch_scheduler()
+        max_retries = fetch_scheduler.settings.get("max_retries", 3) if fetch_scheduler is not None else 0
+        for attempt in range(max_retries + 1):
+            if fetch_scheduler is not None:
+                await fetch_scheduler.acquire_async()
+            start = time.perf_counter()
+            try:
+                response = await self._client.get(url, headers=headers)
+            except httpx.TransportError:
+                if fetch_scheduler is not None:
+                    fetch_scheduler.release(None, time.perf_counter() - start)
+                if attempt == max_retries:
+                    raise
+                response = None
+            except BaseException:
+                # Other errors (e.g. a broken encoding, too many redirects or a cancelled task) aren't retried but
+                # still free the slot
+                if fetch_scheduler is not None:
+                    fetch_scheduler.release(None, time.perf_counter() - start)
+                raise
+            else:
+                elapsed = time.perf_counter() - start
+                fetch_stats.record(FetchTiming(url, host, response.status_code, elapsed, len(response.content)))
+                if fetch_scheduler is None:
+                    return response.status_code, response.content, response.headers
+                fetch_scheduler.release(response.status_code, elapsed)
+                if attempt == max_retries or not fetch_scheduler.is_retry_status(response.status_code):
+                    return response.status_code, response.content, response.headers
+            metrics.inc("eihl_fetch_retries_total")
+            await asyncio.sleep(get_retry_delay(attempt, response.headers.get("Retry-After", None)
+                                                if response is not None else None, fetch_scheduler.settings))
+
+    async def fetch_page(self, url: str, max_age: int = None) -> bytes:
+        # The page cache reads and writes files and an SQLite index so it's kept off the event loop
+        content, cached_page = await asyncio.to_thread(get_cached_page, url, max_age)
+        if content is not None:
+            return content
+        status_code, content, headers = await self._get(url, get_conditional_headers(cached_page))
+        return await asyncio.to_thread(handle_page_response, url, cached_page, status_code, content, headers)
@@ -2,19 +2,49 @@ import re
 import traceback
 from collections import defaultdict
 from datetime import datetime
+from typing import Callable, Iterator
 
 import bs4
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from settings.settings import eihl_schedule_url, eihl_match_url
-from src.utils import extract_date_from_str, extract_float_from_str, get_html_content, get_date_range_from_str_list
+from src.metrics import metrics
+from src.utils import extract_date_from_str, get_html_content, get_date_range_from_str_list
+
+# Parts of each EIHL page that the extractors read. When strainers are enabled only these are parsed
+gamecentre_container_class = "container-fluid text-center text-md-left"
+season_options_strainer = SoupStrainer(id="id_season")
+team_options_strainer = SoupStrainer("select", id="id_team")
+gamecentre_strainer = SoupStrainer(class_=gamecentre_container_class)
+match_article_strainer = SoupStrainer("article")
+match_stats_strainer = SoupStrainer("div", class_="container")
+# Team stat tokens with a digit are values, e.g. 20, 20.0, 20%, 20.06%. The rest are the stat names
+stat_value_regex = re.compile(r"\d")
+stat_float_regex = re.compile(r"(\d+(?:\.\d+)?)%?")
+gamecentre_date_fmt = "%A %d.%m.%Y"
+
+
+def find_gamecentre_container(res_beaus: BeautifulSoup) -> bs4.Tag:
+    try:
+        html_content = res_beaus.find("body").find("main").find(class_="wrapper")
+        return html_content.find(class_=gamecentre_container_class)
+    except AttributeError:
+        # The page was parsed with gamecentre_strainer so there's no body
+        return res_beaus.find(class_=gamecentre_container_class)
+
 
+def find_match_article(res_beaus: BeautifulSoup) -> bs4.Tag:
+    try:
+        return res_beaus.find("body").find("main").find(class_="wrapper").find("article")
+    except AttributeError:
+        # The page was parsed with match_article_strainer so there's no body
+        return res_beaus.find("article")
 
-def get_eihl_championship_options(schedule_url: str = eihl_schedule_url):
-    res_beaus = get_html_content(schedule_url)
-    html_id_season = res_beaus.body.find(id="id_season")
+
+@metrics.timed("eihl_scraper_seconds")
+def get_eihl_championship_options(schedule_url: str = eihl_schedule_url, max_age: int = None):
+    res_beaus = get_html_content(schedule_url, max_age, season_options_strainer)
+    html_id_season = res_beaus.find(id="id_season")
     champ_list = []
     id_search = "id_season="
     for s_id in html_id_season.find_all("option"):
@@ -30,71 +60,74 @@ def get_eihl_championship_options(schedule_url: str = eihl_schedule_url):
     return champ_list
 
 
-def get_start_end_dates_from_gamecentre(schedule_url: str) -> tuple[datetime or None, datetime or None]:
-    start_date = None
-    end_date = None
+def get_gamecentre_content(schedule_url: str, max_age: int = None) -> bs4.Tag:
     # Get container that holds matches
-    res_beaus = get_html_content(schedule_url)
-    html_content = res_beaus.find("body").find("main").find(class_="wrapper")
-    html_content = html_content.find(class_="container-fluid text-center text-md-left")
+    return find_gamecentre_container(get_html_content(schedule_url, max_age, gamecentre_strainer))
+
+
+@metrics.timed("eihl_scraper_seconds")
+def get_start_end_dates_from_gamecentre(schedule_url: str, html_content: bs4.Tag = None) \
+        -> tuple[datetime or None, datetime or None]:
+    if html_content is None:
+        html_content = get_gamecentre_content(schedule_url)
     html_text: str = html_content.get_text(separator=",", strip=True)
     start_date, end_date = get_date_range_from_str_list(html_text)
     return start_date, end_date
 
 
-def extract_team_match_stats(match_html: str) -> dict:
+def extract_team_match_stats(match_html: str, max_age: int = None) -> dict:
     # find div class called container
     # Then find an H2 called Team Stats
     # Iterate through the stats and assign them to the right team
-    match_html_content = get_html_content(match_html)
+    match_html_content = get_html_content(match_html, max_age, match_stats_strainer)
+    return get_team_match_stats_from_html(match_html_content)
+
+
+@metrics.timed("eihl_scraper_seconds")
+def get_team_match_stats_from_html(match_html_content: BeautifulSoup) -> dict:
     home_team_stats = defaultdict()
     away_team_stats = defaultdict()
 
-    html_container = match_html_content.findAll('div', attrs={'class': 'container'})[0]
+    html_container = match_html_content.find_all('div', attrs={'class': 'container'})[0]
     stats_html: bs4.Tag = html_container.find("div")
-    # E.g. of values that match Regex: 20, 20.0, 20%, 20.06%
-    stat_float_regex = r"(\d+(\.\d+)?%)|(\d+(\.\d+))|(\d+)"
     if "TEAM STATS" in stats_html.find("h2").get_text().upper():
         # Found the team stats section
         stat_list = list(stats_html.get_text("|", strip=True).split("|"))
         if stat_list[0].lower() == "team stats":
             del stat_list[0]
-        get_team_stats_from_list(away_team_stats, home_team_stats, stat_float_regex, stat_list)
+        get_team_stats_from_list(away_team_stats, home_team_stats, stat_list)
 
     match_team_stats = {"home_team": home_team_stats, "away_team": away_team_stats}
     return match_team_stats
 
 
-def get_team_stats_from_list(away_team_stats, home_team_stats, stat_float_regex, stat_list):
-    def assign_stat_to_team(header, team_stats, stats=None, stat_index=None, value=None):
-        if stats is not None and stat_index is not None:
-            try:
-                value = stats[stat_index]
-            except IndexError:
-                value = None
-        team_stats[header] = extract_float_from_str(value) or 0.0
-
-    stat_list_len = len(stat_list)
-    i = 0
-    stat_header = None
-    while i < stat_list_len:
-        stat_value = stat_list[i]
-        if not re.findall(stat_float_regex, stat_value):
-            stat_header = stat_value
-            # Add stats for category
-            assign_stat_to_team(stat_value, home_team_stats, stat_list, i + 1)
-            assign_stat_to_team(stat_value, away_team_stats, stat_list, i + 2)
-        elif stat_header is None:
-            # find the category this number belongs too
-            next_header_index = next((j for j in range(i, stat_list_len)
-                                      if not re.findall(stat_float_regex, stat_list[j])))
-            stat_header = stat_list[next_header_index]
-            assign_stat_to_team(stat_header, home_team_stats, value=stat_value)
-            assign_stat_to_team(stat_header, away_team_stats, stat_list, i + 1)
-            i = next_header_index + 1
-            stat_header = None
+def get_team_stat_value(stat_token: str or None) -> float:
+    stat_match = stat_float_regex.fullmatch(stat_token) if stat_token is not None else None
+    return float(stat_match.group(1)) if stat_match is not None else 0.0
+
+
+def get_team_stats_from_list(away_team_stats, home_team_stats, stat_list):
+    """
+    Pairs each stat with its home and away values in a single walk of the tokens. The values either follow
+    their stat (Shots|31|61) or, when the list starts with values, come before it (31|61|Shots).
+    """
+    values_first = True
+    stat_values = []
+    for i, stat_token in enumerate(stat_list):
+        if stat_value_regex.search(stat_token) is not None:
+            if values_first:
+                stat_values.append(stat_token)
             continue
-        i += 1
+        if values_first and stat_values:
+            home_value, away_value = stat_values[0], stat_values[1] if len(stat_values) > 1 else None
+            stat_values = []
+        else:
+            # Once a stat is followed by its values the rest of the list has the same layout
+            values_first = False
+            home_value = stat_list[i + 1] if i + 1 < len(stat_list) else None
+            away_value = stat_list[i + 2] if i + 2 < len(stat_list) else None
+        home_team_stats[stat_token] = get_team_stat_value(home_value)
+        away_team_stats[stat_token] = get_team_stat_value(away_value)
 
 
 def get_eihl_web_match_id(url: str) -> int or None:
@@ -107,10 +140,15 @@ def get_eihl_web_match_id(url: str) -> int or None:
     return None
 
 
-def get_match_info_from_match_page(match_url: str) -> dict:
+def get_match_info_from_match_page(match_url: str, max_age: int = None) -> dict:
+    res_beaus = get_html_content(match_url, max_age, match_article_strainer)
+    return get_match_info_from_html(res_beaus, match_url)
+
+
+@metrics.timed("eihl_scraper_seconds")
+def get_match_info_from_html(res_beaus: BeautifulSoup, match_url: str) -> dict:
     match_info = defaultdict()
-    res_beaus = get_html_content(match_url)
-    html_content = res_beaus.find("body").find("main").find(class_="wrapper").find("article")
+    html_content = find_match_article(res_beaus)
     match_divs = html_content.find("div")
     if match_divs is None:
         print(f"No match information was able for match URL: {match_url}")
@@ -129,7 +167,7 @@ def get_match_info_from_match_page(match_url: str) -> dict:
     match_overview_div = None
     for div in match_divs:
         try:
-            img_tags = div.findAll("img")
+            img_tags = div.find_all("img")
         except AttributeError:
             continue
         # Div with team logos is the one with the scores
@@ -140,7 +178,7 @@ def get_match_info_from_match_page(match_url: str) -> dict:
     home_team_info = match_overview_div.find("div")
     match_info["home_team"] = " ".join([x for x in home_team_info.find("a").stripped_strings])
 
-    match_score_div = home_team_info.find_next_sibling(lambda x: x.name == "div" and len(x.findAll("img")) == 0)
+    match_score_div = home_team_info.find_next_sibling(lambda x: x.name == "div" and len(x.find_all("img")) == 0)
     match_ending_text = match_score_div.find("div").get_text().strip()
     match_info["match_win_type"] = None
     if match_ending_text == "end":
@@ -149,7 +187,7 @@ def get_match_info_from_match_page(match_url: str) -> dict:
         match_info["match_win_type"] = "SO"
     elif match_ending_text == "end after overtime":
         match_info["match_win_type"] = "OT"
-    raw_score = match_score_div.findAll("div", attrs={'class': 'match-score'})[0].get_text()
+    raw_score = match_score_div.find_all("div", attrs={'class': 'match-score'})[0].get_text()
     try:
         home_score, away_score = map(int, raw_score.split(":"))
     except (TypeError, ValueError):
@@ -157,45 +195,72 @@ def get_match_info_from_match_page(match_url: str) -> dict:
     match_info["home_score"] = home_score
     match_info["away_score"] = away_score
 
-    away_team_info = match_score_div.find_next_sibling(lambda x: x.name == "div" and len(x.findAll("img")) == 0)
+    away_team_info = match_score_div.find_next_sibling(lambda x: x.name == "div" and len(x.find_all("img")) == 0)
     match_info["away_team"] = " ".join([x for x in away_team_info.find("a").stripped_strings])
     return match_info
 
 
-def get_matches_from_web_gamecentre(url: str, html_content: BeautifulSoup = None, start_date: datetime = datetime.min,
-                                    end_date: datetime = datetime.max, teams: list or tuple = None):
-    if teams is None:
-        teams = []
-    if html_content is None:
-        res_beaus = get_html_content(url)
+def normalise_team_filters(teams: list or tuple = None) -> tuple[str, ...]:
+    return tuple(team.lower() for team in teams or ())
 
-        html_content = res_beaus.find("body").find("main").find(class_="wrapper")
-        html_content = html_content.find(class_="container-fluid text-center text-md-left")
 
-    gamecentre_date_fmt = "%A %d.%m.%Y"
-    matches = []
+def is_gamecentre_match_tag(tag) -> bool:
+    return tag.name == "div" and tag.find() is not None
+
+
+def iter_matches_from_gamecentre(html_content: bs4.Tag, start_date: datetime = datetime.min,
+                                 end_date: datetime = datetime.max, team_filters: tuple[str, ...] = (),
+                                 on_error: Callable[[bs4.Tag, Exception], None] = None) -> Iterator[dict]:
+    """
+    Yield each match of a gamecentre schedule as the schedule is walked so the matches can be written and their
+    pages fetched before the walk has finished. The walk stops at the first match day after end_date.
+    Args:
+        team_filters: lowercase team names (see normalise_team_filters). Only matches of these teams are yielded
+        on_error: called with the tag and the exception when a match can't be read from its tag. The walk carries
+            on with the next match. Without it the exception is raised
+    """
     match_date = None
     for tag in html_content:
         tag_text = tag.get_text()
-
-        game_date = extract_date_from_str(tag_text, gamecentre_date_fmt)
-        if game_date is not None and match_date != tag_text:
+        is_match_tag = is_gamecentre_match_tag(tag)
+        # Match day headings are the only tags that aren't a match
+        game_date = None if is_match_tag else extract_date_from_str(tag_text, gamecentre_date_fmt)
+        if game_date is not None:
             match_date = game_date
         if match_date is not None:
-            if start_date > match_date or (teams and not [x for x in teams if x.lower() in tag_text.lower()]):
-                continue
-            elif match_date > end_date:
+            if match_date > end_date:
                 break
-        if tag.name == "div" and len(tag.find_all()) > 0:
-            match_info = extract_match_team_score_from_tag(tag)
-            match_info["match_date"] = match_date
+            if start_date > match_date:
+                continue
+            if team_filters:
+                tag_text = tag_text.lower()
+                if not any(team in tag_text for team in team_filters):
+                    continue
+        if is_match_tag:
+            try:
+                match_info = extract_match_team_score_from_tag(tag)
+            except Exception as tag_error:
+                if on_error is None:
+                    raise
+                on_error(tag, tag_error)
+                continue
             try:
                 match_info["match_date"] = datetime.combine(match_date, match_info.pop("match_time"))
             except (AttributeError, TypeError, KeyError):
                 # no time present. Created dummy placeholder
                 match_info["match_date"] = match_date
-            matches.append(match_info)
-    return matches
+            yield match_info
+
+
+@metrics.timed("eihl_scraper_seconds")
+def get_matches_from_web_gamecentre(url: str, html_content: BeautifulSoup = None, start_date: datetime = datetime.min,
+                                    end_date: datetime = datetime.max, teams: list or tuple = None,
+                                    on_error: Callable[[bs4.Tag, Exception], None] = None) -> list[dict]:
+    """Returns: every match of the schedule, e.g. to hash the whole schedule (see iter_matches_from_gamecentre)"""
+    if html_content is None:
+        html_content = get_gamecentre_content(url)
+    return list(iter_matches_from_gamecentre(html_content, start_date, end_date, normalise_team_filters(teams),
+                                             on_error))
 
 
 def extract_match_team_score_from_tag(tag) -> dict:
@@ -248,49 +313,83 @@ def extract_match_team_score_from_tag(tag) -> dict:
     return match_info
 
 
-def get_match_player_stats(url: str) -> defaultdict[pd.DataFrame]:
-    response = requests.get(url)
-    res_beaus = BeautifulSoup(response.content, 'html.parser')
+def get_match_player_stats(url: str, max_age: int = None) -> defaultdict:
+    res_beaus = get_html_content(url, max_age, match_stats_strainer)
+    return get_match_player_stats_from_html(res_beaus)
+
+
+def convert_table_value(value: str) -> int or float or str or None:
+    # Cells are typed as ints, floats or text. Empty cells are None rather than NaN
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def iter_table_rows(table_tag: bs4.Tag) -> Iterator[dict]:
+    headers = None
+    for row in table_tag.find_all("tr"):
+        cells = row.find_all(["th", "td"])
+        if headers is None:
+            headers = [cell.get_text(" ", strip=True) for cell in cells]
+            continue
+        if not cells:
+            continue
+        yield {header: convert_table_value(cell.get_text(" ", strip=True)) for header, cell in zip(headers, cells)}
+
+
+def iter_player_stats_tables(res_beaus: BeautifulSoup) -> Iterator[tuple[str, bs4.Tag]]:
     html_container = res_beaus.find('div', attrs={'class': 'container'})
-    # html_container: bs4.Tag = html_container.find("div")
-    game_stats = defaultdict(pd.DataFrame)
     pg_header_regex = re.compile("(?<= -).players|(?<= -).goalies")
     all_player_headers = [x for x in html_container.find_all("h2")
                           if re.search(pg_header_regex, x.get_text()) is not None]
-    head_index = 0
-    player_head_len = len(all_player_headers)
-    while head_index < player_head_len:
-        next_head_tag = None
+    for head_index, player_header in enumerate(all_player_headers):
+        team_name = player_header.get_text().strip().split("-")[0].strip()
+        next_head_tag = all_player_headers[head_index + 1] if head_index + 1 < len(all_player_headers) else None
         table_tag = None
-        player_stat_dtf = pd.DataFrame()
-        team_name = all_player_headers[head_index].get_text().strip().split("-")[0]
-        team_name = team_name.strip()
-        # Working with 0 index notation
-        if head_index + 1 < player_head_len:
-            next_head_tag = all_player_headers[head_index + 1]
-        for tag in all_player_headers[head_index].next_siblings:
+        for tag in player_header.next_siblings:
             if next_head_tag is not None and tag is next_head_tag:
                 break
             elif isinstance(tag, bs4.Tag):
-                table_tag = tag.findChildren("table", limit=1)
-                if table_tag is not None:
-                    table_tag = tag
-                    break
-        # TODO Change if statement to try except (use AttributeError?)
-        if isinstance(table_tag, bs4.Tag):
-            try:
-                player_stat_dtf = pd.read_html(str(table_tag))[0]
-            except ValueError:
-                print(f"ERROR No tables found for: {table_tag}")
+                # The table is in the first tag after the header
+                table_tag = tag if tag.name == "table" else tag.find("table")
+                break
+        if table_tag is None:
+            print(f"ERROR No tables found for: {team_name}")
+            continue
+        yield team_name, table_tag
 
-            game_stats[team_name] = pd.concat([game_stats[team_name], player_stat_dtf], ignore_index=False)
-            try:
-                game_stats[team_name]["Position"] = game_stats[team_name]["Position"].fillna("GW")
-            except KeyError:
-                pass
-        else:
-            print("Not a tag")
-        head_index += 1
+
+def iter_match_player_stats(res_beaus: BeautifulSoup) -> Iterator[tuple[str, dict]]:
+    """
+    Yields: the team name and the stats of each player as they are read from the players and goalies tables.
+        Goalie tables don't have a position so goalies get the position GW.
+    """
+    for team_name, table_tag in iter_player_stats_tables(res_beaus):
+        for player_stats in iter_table_rows(table_tag):
+            if player_stats.get("Position", None) is None:
+                player_stats["Position"] = "GW"
+            yield team_name, player_stats
+
+
+@metrics.timed("eihl_scraper_seconds")
+def get_match_player_stats_from_html(res_beaus: BeautifulSoup) -> defaultdict:
+    """Returns: DataFrame of the player stats for each team. Requires pandas"""
+    import pandas as pd
+
+    team_player_stats = defaultdict(list)
+    for team_name, player_stats in iter_match_player_stats(res_beaus):
+        team_player_stats[team_name].append(player_stats)
+    game_stats = defaultdict(pd.DataFrame)
+    for team_name, player_stats in team_player_stats.items():
+        game_stats[team_name] = pd.DataFrame(player_stats)
     return game_stats
 
 
@@ -317,7 +416,7 @@ def get_gamecentre_team_id(team_name: str = None, season_id=None):
         return 0
     team_id = None
     if season_id is not None:
-        html_content = get_html_content(eihl_schedule_url)
+        html_content = get_html_content(eihl_schedule_url, parse_only=team_options_strainer)
         team_dropdown_option = html_content.find("select", id="id_team")
         team_option = team_dropdown_option.find("option", text=team_name)
         try:
@@ -337,9 +436,13 @@ def get_eihl_match_url(match_id: int, base_url: str = eihl_match_url) -> str:
     return match_url
 
 
-def extract_match_stats(match_stats_url):
+def extract_match_stats(match_stats_url, max_age: int = None):
     print(f"\nNext match is {match_stats_url}\n")
-    match_stats = get_match_player_stats(match_stats_url)
+    match_stats = get_match_player_stats(match_stats_url, max_age)
+    return remove_team_score_table(match_stats)
+
+
+def remove_team_score_table(match_stats: defaultdict) -> defaultdict:
     # Check if the team score table came through
     if len(match_stats) > 4 and len(match_stats[0].columns) <= 4:
         del match_stats[0]
@@ -0,0 +1,183 @@
+"""
+Keeps the scraper polite to the EIHL website. Every request to the website is started through the fetch
+scheduler, which
+ - limits the rate of requests with a token bucket
+ - limits the requests in flight and halves the limit when the website returns a 429/5xx or slows down
+ - retries failed requests after a jittered exponential backoff
+ - pauses every request with a circuit breaker when requests keep failing rather than failing every match
+"""
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+from settings.settings import fetch_scheduler_settings, http_settings
+from src.metrics import metrics
+
+_fetch_scheduler = None
+_fetch_scheduler_lock = threading.Lock()
+# Seconds to wait before checking again for a free request slot
+slot_poll_interval = 0.05
+
+
+class FetchScheduler:
+    def __init__(self, settings: dict = None, clock: Callable[[], float] = time.monotonic):
+        if settings is None:
+            settings = fetch_scheduler_settings
+        self.settings = settings
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.max_rate = settings.get("requests_per_sec", None)
+        self.rate = self.max_rate
+        self.burst = settings.get("burst", 1)
+        self._tokens = float(self.burst)
+        self._last_refill = clock()
+        self.min_concurrency = settings.get("min_concurrency", 1)
+        self.max_concurrency = settings.get("max_concurrency", 20)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.avg_elapsed = None
+        self.consecutive_failures = 0
+        self.breaker_open_until = None
+        self.breaker_cooldown = settings.get("breaker_cooldown", 60)
+        self._probe_in_flight = False
+
+    def _refill_tokens(self, now: float):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def reserve(self) -> tuple[bool, float]:
+        """
+        Returns: whether a request slot was reserved and the seconds to wait before starting the request
+            (or before trying again when no slot was reserved)
+        """
+        with self._lock:
+            now = self.clock()
+            if self.breaker_open_until is not None:
+                if now < self.breaker_open_until:
+                    return False, self.breaker_open_until - now
+                if self._probe_in_flight:
+                    return False, slot_poll_interval
+                # Half open: a single request checks whether the website has recovered
+                self._probe_in_flight = True
+            elif self.in_flight >= int(self.concurrency_limit):
+                return False, slot_poll_interval
+            self.in_flight += 1
+            if not self.rate:
+                return True, 0
+            self._refill_tokens(now)
+            # The token is taken now so requests queue up behind each other when the bucket is empty
+            self._tokens -= 1
+            return True, max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        while True:
+            reserved, wait_secs = self.reserve()
+            if wait_secs:
+                time.sleep(wait_secs)
+            if reserved:
+                return
+
+    async def acquire_async(self):
+        while True:
+            reserved, wait_secs = self.reserve()
+            if wait_secs:
+                await asyncio.sleep(wait_secs)
+            if reserved:
+                return
+
+    def is_retry_status(self, status_code: int or None) -> bool:
+        return status_code is None or status_code in self.settings.get("retry_statuses", ())
+
+    def release(self, status_code: int or None, elapsed: float):
+        """
+        Args:
+            status_code: status of the response. None when the request failed to connect or timed out
+            elapsed: seconds the request took
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            is_probe = self.breaker_open_until is not None and self._probe_in_flight
+            if is_probe:
+                self._probe_in_flight = False
+            if self.is_retry_status(status_code):
+                self._on_failure(is_probe)
+            else:
+                self._on_success(elapsed)
+
+    def _on_failure(self, is_probe: bool):
+        metrics.inc("eihl_fetch_failures_total")
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        if self.max_rate:
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+        self.consecutive_failures += 1
+        # Requests that were already in flight when the breaker opened don't open it again
+        if is_probe or (self.breaker_open_until is None and
+                        self.consecutive_failures >= self.settings.get("breaker_threshold", 5)):
+            self.breaker_open_until = self.clock() + self.breaker_cooldown
+            metrics.inc("eihl_fetch_breaker_trips_total")
+            print(f"ERROR {self.consecutive_failures} requests in a row to the website failed. "
+                  f"Pausing requests for {self.breaker_cooldown}s")
+            self.breaker_cooldown = min(self.breaker_cooldown * 2,
+                                        self.settings.get("max_breaker_cooldown", self.breaker_cooldown))
+
+    def _on_success(self, elapsed: float):
+        if self.breaker_open_until is not None:
+            print("Requests to the website are getting through again")
+        self.breaker_open_until = None
+        self.breaker_cooldown = self.settings.get("breaker_cooldown", 60)
+        self.consecutive_failures = 0
+        is_slow = self.avg_elapsed is not None and \
+            elapsed > self.avg_elapsed * self.settings.get("slow_response_factor", 3)
+        self.avg_elapsed = elapsed if self.avg_elapsed is None else 0.9 * self.avg_elapsed + 0.1 * elapsed
+        if is_slow:
+            metrics.inc("eihl_fetch_slow_responses_total")
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            return
+        # Additive increase: the limit grows by about one for every round trip at the current limit
+        self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+        if self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def get_retry_delay(attempt: int, retry_after: str = None, settings: dict = None) -> float:
+    """
+    Returns: seconds to wait before retry number attempt (0 is the first retry). A Retry-After header from the
+        website is honoured up to max_retry_backoff.
+    """
+    if settings is None:
+        settings = fetch_scheduler_settings
+    max_backoff = settings.get("max_retry_backoff", 30)
+    if retry_after:
+        try:
+            return min(max_backoff, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(max_backoff, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+            except (TypeError, ValueError):
+                pass
+    # Full jitter so requests that failed together don't retry together
+    return random.uniform(0, min(max_backoff, settings.get("retry_backoff", 0.5) * 2 ** attempt))
+
+
+def get_fetch_scheduler() -> FetchScheduler or None:
+    global _fetch_scheduler
+    # Replayed pages don't go to the website
+    if not fetch_scheduler_settings.get("enabled", True) or http_settings.get("replay_corpus_dir", None) is not None:
+        return None
+    if _fetch_scheduler is None:
+        with _fetch_scheduler_lock:
+            if _fetch_scheduler is None:
+                _fetch_scheduler = FetchScheduler()
+    return _fetch_scheduler
+
+
+def reset_fetch_scheduler():
+    global _fetch_scheduler
+    with _fetch_scheduler_lock:
+        _fetch_scheduler = None
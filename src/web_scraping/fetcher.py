@@ -0,0 +1,244 @@
+import random
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from settings.settings import http_settings, page_cache_settings
+from src.Exceptions import PageNotCached, PageNotAvailable
+from src.metrics import metrics
+from src.web_scraping.fetch_scheduler import get_fetch_scheduler, get_retry_delay
+from src.web_scraping.page_cache import get_page_cache, CachedPage, PageCache
+from src.web_scraping.replay import ReplayAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+
+@dataclass()
+class FetchTiming:
+    url: str
+    host: str = field(default=None)
+    status_code: int = field(default=None)
+    elapsed: float = field(default=0.0)
+    num_bytes: int = field(default=0)
+
+
+class FetchStats:
+    """
+    Thread safe totals of the requests made through the fetcher. The median and p95 are taken from a
+    reservoir of up to max_samples request times so memory use doesn't grow over a long backfill.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self.max_samples = max_samples
+        self.reset()
+
+    def record(self, timing: FetchTiming):
+        with self._lock:
+            if self.requests == 0:
+                self.first_elapsed = timing.elapsed
+            self.requests += 1
+            self.num_bytes += timing.num_bytes
+            self.total_elapsed += timing.elapsed
+            self.max_elapsed = max(self.max_elapsed, timing.elapsed)
+            if len(self.samples) < self.max_samples:
+                self.samples.append(timing.elapsed)
+            else:
+                # Reservoir sampling keeps every request equally likely to be in the samples
+                sample_index = random.randrange(self.requests)
+                if sample_index < self.max_samples:
+                    self.samples[sample_index] = timing.elapsed
+        metrics.observe("eihl_fetch_seconds", timing.elapsed, host=timing.host, status=timing.status_code)
+        metrics.inc("eihl_fetch_bytes_total", timing.num_bytes, host=timing.host)
+        if http_settings.get("log_requests", False):
+            print(f"GET {timing.url} -> {timing.status_code} in {timing.elapsed * 1000:.1f}ms "
+                  f"({timing.num_bytes} bytes)")
+
+    def record_cache_hit(self, revalidated: bool = False):
+        metrics.inc("eihl_page_cache_hits_total", revalidated=revalidated)
+        with self._lock:
+            if revalidated:
+                self.revalidated += 1
+            else:
+                self.cache_hits += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.num_bytes = 0
+            self.total_elapsed = 0.0
+            self.first_elapsed = 0.0
+            self.max_elapsed = 0.0
+            self.samples: list[float] = []
+            self.cache_hits = 0
+            self.revalidated = 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            if self.requests == 0:
+                return {"requests": 0, "cache_hits": self.cache_hits, "revalidated": self.revalidated}
+            elapsed = sorted(self.samples)
+            return {
+                "requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "revalidated": self.revalidated,
+                "bytes": self.num_bytes,
+                "total_secs": self.total_elapsed,
+                # The first request to a host pays for the TCP/TLS handshake, the rest should reuse the connection
+                "first_ms": self.first_elapsed * 1000,
+                "mean_ms": self.total_elapsed / self.requests * 1000,
+                "median_ms": statistics.median(elapsed) * 1000,
+                "p95_ms": elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))] * 1000,
+                "max_ms": self.max_elapsed * 1000
+            }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Page cache hits: {summary['cache_hits']}, revalidated (304): {summary['revalidated']}")
+        if summary["requests"] == 0:
+            print("No web pages were fetched")
+            return
+        print(f"Fetched {summary['requests']} pages ({summary['bytes']} bytes) in {summary['total_secs']:.2f}s. "
+              f"First: {summary['first_ms']:.1f}ms, mean: {summary['mean_ms']:.1f}ms, "
+              f"median: {summary['median_ms']:.1f}ms, p95: {summary['p95_ms']:.1f}ms, max: {summary['max_ms']:.1f}ms")
+
+
+fetch_stats = FetchStats()
+
+
+def build_session(settings: dict = None) -> requests.Session:
+    if settings is None:
+        settings = http_settings
+    session = requests.Session()
+    # pool_block stops more than pool_maxsize connections being opened to a single host
+    adapter = HTTPAdapter(pool_connections=settings.get("pool_connections", 4),
+                          pool_maxsize=settings.get("pool_maxsize", 10),
+                          pool_block=True)
+    if settings.get("replay_corpus_dir", None) is not None:
+        # Requests are answered from recorded pages rather than the website
+        adapter = ReplayAdapter(settings["replay_corpus_dir"], settings.get("replay_latency", 0))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # ACCEPT_ENCODING includes br when the brotli package is installed
+    session.headers.update({"Accept-Encoding": ACCEPT_ENCODING,
+                            "User-Agent": settings.get("user_agent", "eihl_stat_collector"),
+                            "Connection": "keep-alive"})
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def fetch(url: str, headers: dict = None, timeout=None) -> requests.Response:
+    """
+    GET the URL through the fetch scheduler. Requests that fail to connect, time out or get a retryable status
+    are retried. Returns the last response or raises the last connection error once the retries run out.
+    Any other error of the request is raised straight away. The request's slot is given back to the fetch
+    scheduler however the request ends.
+    """
+    if timeout is None:
+        timeout = http_settings.get("timeout", None)
+    fetch_scheduler = get_fetch_scheduler()
+    max_retries = fetch_scheduler.settings.get("max_retries", 3) if fetch_scheduler is not None else 0
+    for attempt in range(max_retries + 1):
+        if fetch_scheduler is not None:
+            fetch_scheduler.acquire()
+        start = time.perf_counter()
+        try:
+            response = get_session().get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if fetch_scheduler is not None:
+                fetch_scheduler.release(None, time.perf_counter() - start)
+            if attempt == max_retries:
+                raise
+            response = None
+        except BaseException:
+            # Other errors (e.g. a broken encoding or too many redirects) aren't retried but still free the slot
+            if fetch_scheduler is not None:
+                fetch_scheduler.release(None, time.perf_counter() - start)
+            raise
+        else:
+            elapsed = time.perf_counter() - start
+            fetch_stats.record(FetchTiming(url, urlsplit(url).hostname, response.status_code, elapsed,
+                                           len(response.content)))
+            if fetch_scheduler is None:
+                return response
+            fetch_scheduler.release(response.status_code, elapsed)
+            if attempt == max_retries or not fetch_scheduler.is_retry_status(response.status_code):
+                return response
+        metrics.inc("eihl_fetch_retries_total")
+        time.sleep(get_retry_delay(attempt, response.headers.get("Retry-After", None)
+                                   if response is not None else None, fetch_scheduler.settings))
+
+
+def get_cached_page(url: str, max_age: int = None) -> tuple[bytes or None, CachedPage or None]:
+    """
+    Args:
+        url: web page to look up in the page cache
+        max_age: seconds a cached copy of the page is valid for. Overrides the cache's TTL rules
+            (e.g. 0 revalidates a page that may have changed such as a match that has not finished)
+    Returns: the page content if the cached page can be used without going to the website
+        and the cached page (if any) to revalidate with
+    """
+    page_cache = get_page_cache()
+    if page_cache is None:
+        return None, None
+
+    cached_page = page_cache.lookup(url)
+    if cached_page is not None and (page_cache.is_fresh(cached_page, max_age)
+                                    or page_cache_settings.get("offline", False)):
+        fetch_stats.record_cache_hit()
+        return cached_page.body, cached_page
+    if page_cache_settings.get("offline", False):
+        raise PageNotCached(url)
+    return None, cached_page
+
+
+def get_conditional_headers(cached_page: CachedPage or None) -> dict or None:
+    if cached_page is None:
+        return None
+    return PageCache.get_conditional_headers(cached_page)
+
+
+def handle_page_response(url: str, cached_page: CachedPage or None, status_code: int,
+                         content: bytes, headers) -> bytes:
+    page_cache = get_page_cache()
+    if status_code == 304 and cached_page is not None and page_cache is not None:
+        page_cache.mark_revalidated(url)
+        fetch_stats.record_cache_hit(revalidated=True)
+        return cached_page.body
+    if not 200 <= status_code < 300:
+        # An error page (e.g. a 404 or a 503 after the retries ran out) fails the match rather than being parsed
+        raise PageNotAvailable(url, status_code)
+    if page_cache is not None:
+        page_cache.store(url, content, headers)
+    return content
+
+
+def fetch_page(url: str, max_age: int = None) -> bytes:
+    content, cached_page = get_cached_page(url, max_age)
+    if content is not None:
+        return content
+    response = fetch(url, headers=get_conditional_headers(cached_page))
+    return handle_page_response(url, cached_page, response.status_code, response.content, response.headers)
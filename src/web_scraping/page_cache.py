@@ -0,0 +1,187 @@
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from settings.settings import page_cache_settings
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+@dataclass()
+class CachedPage:
+    url: str
+    key: str
+    size: int = field(default=0)
+    fetched_at: float = field(default=0.0)
+    accessed_at: float = field(default=0.0)
+    etag: str = field(default=None)
+    last_modified: str = field(default=None)
+    body: bytes = field(default=None, repr=False)
+
+
+def get_url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """
+    Persistent cache of raw web pages. Pages are gzipped on disk under a hash of their URL and
+    an SQLite index holds the revalidation headers, fetch time and last access time of each page.
+    """
+
+    def __init__(self, cache_dir: str or Path, max_size_bytes: int = None, ttl_rules: list = None,
+                 default_ttl: int or None = None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self.ttl_rules = [(re.compile(url_regex), ttl) for url_regex, ttl in (ttl_rules or [])]
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._evict_thread = None
+        self._db = sqlite3.connect(self.cache_dir / "index.sqlite", check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS page (key TEXT PRIMARY KEY, url TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                         "etag TEXT, last_modified TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS page_accessed_at ON page (accessed_at)")
+        self._db.commit()
+
+    def close(self):
+        self.wait_for_eviction()
+        with self._lock:
+            self._db.close()
+
+    def _body_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.gz"
+
+    def get_ttl(self, url: str) -> int or None:
+        for url_regex, ttl in self.ttl_rules:
+            if url_regex.search(url):
+                return ttl
+        return self.default_ttl
+
+    def is_fresh(self, page: CachedPage, max_age: int = None) -> bool:
+        ttl = max_age if max_age is not None else self.get_ttl(page.url)
+        if ttl is None:
+            return True
+        return time.time() - page.fetched_at < ttl
+
+    def lookup(self, url: str) -> CachedPage or None:
+        key = get_url_key(url)
+        with self._lock:
+            row = self._db.execute("SELECT size, fetched_at, accessed_at, etag, last_modified FROM page "
+                                   "WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with gzip.open(self._body_path(key), "rb") as body_file:
+                    body = body_file.read()
+            except (OSError, EOFError):
+                # The page file has gone missing or is corrupt so forget about it
+                self._db.execute("DELETE FROM page WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            accessed_at = time.time()
+            self._db.execute("UPDATE page SET accessed_at = ? WHERE key = ?", (accessed_at, key))
+            self._db.commit()
+        size, fetched_at, _, etag, last_modified = row
+        return CachedPage(url, key, size, fetched_at, accessed_at, etag, last_modified, body)
+
+    @staticmethod
+    def get_conditional_headers(page: CachedPage) -> dict:
+        headers = {}
+        if page.etag:
+            headers["If-None-Match"] = page.etag
+        if page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def store(self, url: str, body: bytes, headers: dict = None):
+        if headers is None:
+            headers = {}
+        key = get_url_key(url)
+        body_path = self._body_path(key)
+        body_path.parent.mkdir(exist_ok=True)
+        # Write to a temp file first so a reader never sees half a page
+        tmp_path = body_path.with_suffix(f".{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, "wb") as body_file:
+            body_file.write(body)
+        os.replace(tmp_path, body_path)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO page (key, url, size, fetched_at, accessed_at, etag, "
+                             "last_modified) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, url, body_path.stat().st_size, now, now, headers.get("ETag", None),
+                              headers.get("Last-Modified", None)))
+            self._db.commit()
+        self.evict_in_background()
+
+    def mark_revalidated(self, url: str):
+        with self._lock:
+            self._db.execute("UPDATE page SET fetched_at = ? WHERE key = ?", (time.time(), get_url_key(url)))
+            self._db.commit()
+
+    def remove(self, url: str):
+        key = get_url_key(url)
+        with self._lock:
+            self._db.execute("DELETE FROM page WHERE key = ?", (key,))
+            self._db.commit()
+        self._body_path(key).unlink(missing_ok=True)
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM page").fetchone()[0]
+
+    def evict_in_background(self):
+        """Evict from a background thread so the fetch that stored a page doesn't wait on the disk"""
+        if self.max_size_bytes is None:
+            return
+        with self._lock:
+            if self._evict_thread is not None and self._evict_thread.is_alive():
+                return
+            self._evict_thread = threading.Thread(target=self.evict, name="page_cache_evict", daemon=True)
+            self._evict_thread.start()
+
+    def wait_for_eviction(self):
+        evict_thread = self._evict_thread
+        if evict_thread is not None:
+            evict_thread.join()
+
+    def evict(self):
+        """Remove the least recently used pages until the cache is under its size cap"""
+        if self.max_size_bytes is None:
+            return
+        with self._lock:
+            total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM page").fetchone()[0]
+            if total_size <= self.max_size_bytes:
+                return
+            evicted_keys = []
+            for key, size in self._db.execute("SELECT key, size FROM page ORDER BY accessed_at"):
+                if total_size <= self.max_size_bytes:
+                    break
+                evicted_keys.append(key)
+                total_size -= size
+            self._db.executemany("DELETE FROM page WHERE key = ?", [(key,) for key in evicted_keys])
+            self._db.commit()
+        for key in evicted_keys:
+            self._body_path(key).unlink(missing_ok=True)
+
+
+def get_page_cache() -> PageCache or None:
+    global _page_cache
+    if not page_cache_settings.get("enabled", False):
+        return None
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                _page_cache = PageCache(page_cache_settings["cache_dir"],
+                                        page_cache_settings.get("max_size_bytes", None),
+                                        page_cache_settings.get("ttl_rules", None),
+                                        page_cache_settings.get("default_ttl", None))
+    return _page_cache
@@ -0,0 +1,148 @@
+"""
+Transport that answers the scraper's requests from a corpus of recorded pages so it can run without the website.
+A corpus is a directory of HTML files with an index.json that maps each URL to its file.
+"""
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from settings.settings import http_settings
+
+corpus_index_name = "index.json"
+
+
+def get_corpus_key(url: str) -> str:
+    # /schedule/?b=1&a=2 and /schedule?a=2&b=1 are the same page
+    url_parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(url_parts.query)))
+    return f"{url_parts.netloc.lower()}{url_parts.path.rstrip('/') or '/'}" + (f"?{query}" if query else "")
+
+
+def get_corpus_file_name(url: str) -> str:
+    # Drop the host as every page is from the same site
+    page_path = get_corpus_key(url).split("/", 1)[-1]
+    return (re.sub(r"[^A-Za-z0-9.-]+", "_", page_path).strip("_") or "index") + ".html"
+
+
+def load_corpus_index(corpus_dir: str or Path) -> dict[str, str]:
+    try:
+        with open(Path(corpus_dir) / corpus_index_name) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_corpus_index(corpus_dir: str or Path, corpus_index: dict[str, str]):
+    with open(Path(corpus_dir) / corpus_index_name, "w") as index_file:
+        json.dump(corpus_index, index_file, indent=1, sort_keys=True)
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests transport that serves recorded pages. URLs that weren't recorded get a 404.
+    latency is slept before every response to stand in for the round trip to the website.
+    """
+
+    def __init__(self, corpus_dir: str or Path, latency: float = 0):
+        super().__init__()
+        self.corpus_dir = Path(corpus_dir)
+        self.latency = latency
+        self.corpus_index = load_corpus_index(self.corpus_dir)
+        self.replayed = 0
+        self.missed: list[str] = []
+
+    def get_page(self, url: str) -> bytes or None:
+        file_name = self.corpus_index.get(get_corpus_key(url), None)
+        if file_name is None:
+            return None
+        return (self.corpus_dir / file_name).read_bytes()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        content = self.get_page(request.url)
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.encoding = "utf-8"
+        if content is None:
+            self.missed.append(request.url)
+            response.status_code = 404
+            response._content = b""
+        else:
+            self.replayed += 1
+            response.status_code = 200
+            response._content = content
+        response.headers = CaseInsensitiveDict({"Content-Type": "text/html; charset=utf-8",
+                                                "Content-Length": str(len(response._content))})
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter that saves every page it successfully fetches into a corpus so it can be replayed later"""
+
+    def __init__(self, corpus_dir: str or Path, **kwargs):
+        super().__init__(**kwargs)
+        self.corpus_dir = Path(corpus_dir)
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        self.corpus_index = load_corpus_index(self.corpus_dir)
+        self._lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            file_name = get_corpus_file_name(request.url)
+            (self.corpus_dir / file_name).write_bytes(response.content)
+            with self._lock:
+                self.corpus_index[get_corpus_key(request.url)] = file_name
+                save_corpus_index(self.corpus_dir, self.corpus_index)
+        return response
+
+
+def record_pages(urls: list[str], corpus_dir: str or Path) -> int:
+    """
+    Fetch the pages from the website and add them to a corpus
+    Returns: number of pages recorded
+    """
+    from src.web_scraping.fetcher import build_session
+
+    session = build_session(dict(http_settings, replay_corpus_dir=None))
+    adapter = RecordingAdapter(corpus_dir)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    num_recorded = 0
+    with session:
+        for url in urls:
+            response = session.get(url, timeout=http_settings.get("timeout", None))
+            if response.status_code == 200:
+                num_recorded += 1
+            else:
+                print(f"ERROR unable to record {url}. Status code: {response.status_code}")
+    return num_recorded
+
+
+@contextmanager
+def replay_corpus(corpus_dir: str or Path, latency: float = 0):
+    """Answer every request made through the fetcher from the corpus while in the with block"""
+    from src.web_scraping.fetcher import close_session
+
+    prev_settings = {key: http_settings.get(key, None) for key in ("replay_corpus_dir", "replay_latency")}
+    close_session()
+    http_settings.update({"replay_corpus_dir": corpus_dir, "replay_latency": latency})
+    try:
+        yield
+    finally:
+        close_session()
+        http_settings.update(prev_settings)
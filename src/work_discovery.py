@@ -0,0 +1,142 @@
+"""
+Finds the matches that still have to be scraped with NOT EXISTS queries on the natural keys of the stats
+tables (see sql/migrations) rather than grouping every match with its stats. The matches are read a page at
+a time with a keyset cursor on match_id so every page is an index range scan however big the history is.
+The find_* functions return iterators that only read the next page once the last one has been used, so a run
+never holds every match in memory.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator
+
+from pypika import Query, MySQLQuery, Table, Criterion, Order
+from pypika.functions import Lower
+from pypika.terms import ExistsCriterion
+
+from settings.settings import scrape_state_settings
+# TODO Create Protocol for DB handler
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.scrape_state import match_state_table, match_state_flags, get_recheck_from
+
+stats_tables = ("match_team_stats", "match_player_stats")
+match_table = Table("match").as_("m")
+
+
+@dataclass()
+class MatchFilter:
+    """Limits the matches a run works on, e.g. to split a backfill over several machines by season"""
+    championship_ids: list[int] = field(default_factory=list)
+    # Part of a team's name in any case e.g. "fife"
+    teams: list[str] = field(default_factory=list)
+    start_date: datetime = field(default=None)
+    end_date: datetime = field(default=None)
+
+    def build_criterion(self) -> Criterion or None:
+        criteria = []
+        if self.championship_ids:
+            criteria.append(match_table.championship_id.isin(list(self.championship_ids)))
+        if self.teams:
+            criteria.append(Criterion.any([Lower(team_col).like(f"%{team.lower()}%") for team in self.teams
+                                           for team_col in (match_table.home_team, match_table.away_team)]))
+        if self.start_date is not None:
+            criteria.append(match_table.match_date >= self.start_date)
+        if self.end_date is not None:
+            criteria.append(match_table.match_date <= self.end_date)
+        return Criterion.all(criteria) if criteria else None
+
+    def get_name(self) -> str:
+        """Returns: name of the filter for the checkpoint of a filtered run. Empty when it doesn't filter"""
+        name_parts = [*(f"c{champ_id}" for champ_id in sorted(self.championship_ids)),
+                      *(team.lower().replace(" ", "-") for team in sorted(self.teams)),
+                      *(date.strftime("%Y%m%d") for date in (self.start_date, self.end_date) if date is not None)]
+        return "_".join(name_parts)
+
+
+def add_match_filter(criterion: Criterion, match_filter: MatchFilter = None) -> Criterion:
+    filter_criterion = match_filter.build_criterion() if match_filter is not None else None
+    return criterion if filter_criterion is None else criterion & filter_criterion
+
+
+def get_query_class(db_handler: EIHLMysqlHandler) -> type[Query]:
+    # Subqueries are quoted the way the outer query is
+    return MySQLQuery if getattr(db_handler, "schema_dialect", None) == "mysql" else Query
+
+
+def not_exists(table_name: str, criterion: Criterion) -> Criterion:
+    return ExistsCriterion(Query.from_(Table(table_name)).select(1).where(criterion)).negate()
+
+
+def build_missing_stats_criterion(tables: tuple[str, ...] = stats_tables) -> Criterion:
+    """
+    Matches without a score or without stats in one of the tables. Team stats are named after the teams of
+    the match so a match missing the stats of either team is incomplete. Player stats are named after the
+    headings of the stats page so they're only checked for the match.
+    """
+    criteria = [match_table.home_score.isnull(), match_table.away_score.isnull()]
+    for table_name in tables:
+        stats_table = Table(table_name)
+        is_match_stats = stats_table.match_id == match_table.match_id
+        if table_name == "match_team_stats":
+            criteria.extend(not_exists(table_name, is_match_stats & (stats_table.team_name == team_col))
+                            for team_col in (match_table.home_team, match_table.away_team))
+        else:
+            criteria.append(not_exists(table_name, is_match_stats))
+    return Criterion.any(criteria)
+
+
+def build_sync_criterion(now: datetime) -> Criterion:
+    """
+    Matches that have been played and have no complete scrape state or are recent enough that their stats could
+    still change. Matches that keep failing are left out. A complete match missing stats (e.g. a match without
+    player stats on the website) is only scraped again while it's in the recheck window.
+    """
+    state_table = Table(match_state_table)
+    is_match_state = state_table.match_id == match_table.match_id
+    is_state_complete = Criterion.all([state_table.field(flag) == True for flag in match_state_flags])
+    has_failed = state_table.failure_count >= scrape_state_settings.get("max_failures", 5)
+    return ((match_table.match_date <= now) &
+            not_exists(match_state_table, is_match_state & has_failed) &
+            (not_exists(match_state_table, is_match_state & is_state_complete) |
+             (match_table.match_date >= get_recheck_from(now))))
+
+
+def iter_match_pages(db_handler: EIHLMysqlHandler, criterion: Criterion, page_size: int = None) \
+        -> Iterator[list[dict]]:
+    """Yield the matches that meet the criterion in pages ordered by match_id"""
+    if page_size is None:
+        page_size = scrape_state_settings.get("discovery_page_size", 500)
+    query_cls = get_query_class(db_handler)
+    last_match_id = None
+    while True:
+        page_criterion = criterion if last_match_id is None else criterion & (match_table.match_id > last_match_id)
+        query = query_cls.from_(match_table).select(match_table.star).where(page_criterion) \
+            .orderby(match_table.match_id, order=Order.asc).limit(page_size)
+        matches = db_handler.fetch_all_data(str(query)) or []
+        if matches:
+            yield matches
+        if len(matches) < page_size:
+            return
+        last_match_id = matches[-1]["match_id"]
+
+
+def iter_matches(db_handler: EIHLMysqlHandler, criterion: Criterion) -> Iterator[dict]:
+    """Yield the matches that meet the criterion. The next page is only read once the last one has been used"""
+    for matches in iter_match_pages(db_handler, criterion):
+        yield from matches
+
+
+def find_matches_missing_stats(db_handler: EIHLMysqlHandler, tables: tuple[str, ...] = stats_tables,
+                               end_date: datetime = None, match_filter: MatchFilter = None) -> Iterator[dict]:
+    """Returns: matches played before end_date without a score or without the stats of either team"""
+    criterion = (match_table.match_date <= (end_date or datetime.now())) & build_missing_stats_criterion(tables)
+    return iter_matches(db_handler, add_match_filter(criterion, match_filter))
+
+
+def find_matches_to_sync(db_handler: EIHLMysqlHandler, now: datetime = None,
+                         match_filter: MatchFilter = None) -> Iterator[dict]:
+    return iter_matches(db_handler, add_match_filter(build_sync_criterion(now or datetime.now()), match_filter))
+
+
+def find_played_matches(db_handler: EIHLMysqlHandler, now: datetime = None,
+                        match_filter: MatchFilter = None) -> Iterator[dict]:
+    return iter_matches(db_handler, add_match_filter(match_table.match_date <= (now or datetime.now()), match_filter))
@@ -0,0 +1,16 @@
+from pathlib import Path
+
+import pytest
+
+from settings.settings import page_cache_settings
+from src.web_scraping.replay import replay_corpus
+
+eihl_corpus_dir = Path(__file__).parent / "fixtures" / "eihl_pages"
+
+
+@pytest.fixture
+def replay_pages(monkeypatch):
+    """Answer every request from the recorded pages of the EIHL website without using the page cache"""
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    with replay_corpus(eihl_corpus_dir):
+        yield eihl_corpus_dir
@@ -0,0 +1,25 @@
+import json
+
+from src.checkpoints import Checkpoint, load_checkpoint
+
+
+def test_checkpoint_is_saved_every_interval_and_resumed(tmp_path):
+    now = [0.0]
+    checkpoint = Checkpoint("backfill", tmp_path, interval=10, clock=lambda: now[0])
+    checkpoint.mark_done("match", 1, 2)
+    assert not checkpoint.path.exists()
+    now[0] = 10
+    checkpoint.mark_done("match", 3)
+
+    resumed = load_checkpoint("backfill", tmp_path)
+    assert resumed.done == {"match": {1, 2, 3}}
+    assert resumed.get_pending("match", [{"match_id": i} for i in range(5)], "match_id") == \
+           [{"match_id": 0}, {"match_id": 4}]
+
+    resumed.complete()
+    assert load_checkpoint("backfill", tmp_path).done == {}
+
+
+def test_old_checkpoint_is_ignored(tmp_path):
+    (tmp_path / "backfill.json").write_text(json.dumps({"name": "backfill", "saved_at": 0, "done": {"match": [1]}}))
+    assert load_checkpoint("backfill", tmp_path, max_age=60).done == {}
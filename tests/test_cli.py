@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from benchmarks.sample_pages import build_pipeline_corpus
+from settings.settings import page_cache_settings, recovery_settings
+from src import main
+from src.cli import build_arg_parser, build_match_filter, build_scrape_settings, run_cli
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.match import refresh_championships, update_eihl_scores_from_game_centre
+from src.web_scraping.replay import replay_corpus
+
+
+def test_sync_flags_become_a_filter_and_settings():
+    args = build_arg_parser().parse_args(["sync", "--season", "36", "--season", "37", "--team", "fife",
+                                          "--start-date", "2023-09-01", "--end-date", "31/01/2024",
+                                          "--parse-workers", "8", "--dry-run"])
+    match_filter = build_match_filter(args)
+    assert match_filter.championship_ids == [36, 37] and match_filter.teams == ["fife"]
+    assert match_filter.start_date == datetime(2023, 9, 1)
+    assert match_filter.end_date.date() == datetime(2024, 1, 31).date() and match_filter.end_date.hour == 23
+    assert build_scrape_settings(args) == {"parse_workers": 8} and args.dry_run and not args.full
+
+
+def test_only_dbs_the_scraper_can_write_to_are_choices(capsys):
+    with pytest.raises(SystemExit):
+        build_arg_parser().parse_args(["sync", "--db", "postgres"])
+    assert "invalid choice: 'postgres'" in capsys.readouterr().err
+
+
+def test_backfill_of_a_season(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    monkeypatch.setitem(recovery_settings, "checkpoint_dir", tmp_path / "checkpoints")
+    monkeypatch.setitem(recovery_settings, "dead_letter_dir", tmp_path / "dead_letters")
+    # The CLI points main at the DB it's given
+    monkeypatch.setattr(main, "db_handler_func", main.db_handler_func)
+    build_pipeline_corpus(tmp_path / "corpus", num_seasons=2, matches_per_season=4)
+    db_path = str(tmp_path / "eihlstats.sqlite3")
+    with replay_corpus(tmp_path / "corpus"), EIHLSqliteHandler(db_path) as db_handler:
+        update_eihl_scores_from_game_centre(db_handler, schedules=refresh_championships(db_handler))
+
+    run_cli(["backfill", "--db", "sqlite", "--db-path", db_path, "--season", "100", "--dry-run"])
+    assert "Dry run: 4 matches would be scraped" in capsys.readouterr().out
+    with EIHLSqliteHandler(db_path) as db_handler:
+        assert db_handler.fetch_all_data(table="match_team_stats") == []
+
+    with replay_corpus(tmp_path / "corpus"):
+        run_cli(["backfill", "--db", "sqlite", "--db-path", db_path, "--season", "100",
+                 "--parse-executor", "thread", "--parse-workers", "2"])
+    with EIHLSqliteHandler(db_path) as db_handler:
+        matches = {match["match_id"]: match for match in db_handler.fetch_all_data(table="match")}
+        team_stats = db_handler.fetch_all_data(table="match_team_stats")
+    assert len(team_stats) == 8
+    assert {matches[stats["match_id"]]["championship_id"] for stats in team_stats} == {100}
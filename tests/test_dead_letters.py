@@ -0,0 +1,66 @@
+from functools import partial
+
+from benchmarks.sample_pages import build_pipeline_corpus
+from settings.settings import page_cache_settings
+from src.checkpoints import load_checkpoint
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.dead_letters import DeadLetterStore
+from src.match import refresh_championships, update_eihl_scores_from_game_centre
+from src import match_ingest
+from src.match_ingest import ingest_matches, replay_dead_letters
+from src.web_scraping.replay import replay_corpus, load_corpus_index
+
+
+def test_dead_letter_pages_are_replayable(tmp_path):
+    store = DeadLetterStore(tmp_path)
+    store.add("match", 7, {"match_id": 7}, "parse", ValueError("bad page"),
+              {"https://www.eliteleague.co.uk/game/7-a-b/stats": b"<html></html>"},
+              ["https://www.eliteleague.co.uk/game/7-a-b/team-stats", "https://www.eliteleague.co.uk/game/7-a-b/stats"])
+
+    dead_letter, = store.get_dead_letters("match")
+    assert dead_letter.key == "7" and "ValueError: bad page" in dead_letter.error and not dead_letter.has_pages
+    assert load_corpus_index(store.pages_dir) == {"www.eliteleague.co.uk/game/7-a-b/stats": "game_7-a-b_stats.html"}
+
+    store.remove("match", 7)
+    store.prune_pages()
+    assert store.get_dead_letters() == [] and load_corpus_index(store.pages_dir) == {}
+
+
+def test_failed_matches_are_dead_lettered_and_replayed(tmp_path, monkeypatch):
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    corpus_dir = tmp_path / "corpus"
+    build_pipeline_corpus(corpus_dir, num_seasons=2, matches_per_season=4)
+    db_path = str(tmp_path / "eihlstats.sqlite3")
+    store = DeadLetterStore(tmp_path / "dead_letters")
+    with replay_corpus(corpus_dir), EIHLSqliteHandler(db_path) as db_handler:
+        update_eihl_scores_from_game_centre(db_handler, schedules=refresh_championships(db_handler))
+        matches = db_handler.fetch_all_data(table="match")
+    played_matches = [match for match in matches if match["home_score"] is not None]
+    played_match_ids = {match["match_id"] for match in played_matches}
+
+    def broken_team_stats_extractor(html_content):
+        raise AttributeError("no team stats table")
+
+    monkeypatch.setattr(match_ingest, "get_team_match_stats_from_html", broken_team_stats_extractor)
+    checkpoint = load_checkpoint("test", tmp_path / "checkpoints")
+    with replay_corpus(corpus_dir):
+        ingest_matches(partial(EIHLSqliteHandler, db_path), played_matches, checkpoint=checkpoint,
+                       dead_letters=store)
+    dead_letters = store.get_dead_letters("match")
+    assert {int(dead_letter.key) for dead_letter in dead_letters} == played_match_ids
+    assert all(dead_letter.stage == "parse" and dead_letter.has_pages and "no team stats table" in dead_letter.error
+               for dead_letter in dead_letters)
+    # What could be parsed is written and the matches aren't scraped again when the run resumes
+    assert load_checkpoint("test", tmp_path / "checkpoints").done["match"] == played_match_ids
+    with EIHLSqliteHandler(db_path) as db_handler:
+        assert db_handler.fetch_all_data(table="match_team_stats") == []
+        assert len(db_handler.fetch_all_data(table="match_player_stats")) > 0
+
+    # With the extractor fixed the saved pages are parsed without the website
+    monkeypatch.undo()
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    replay_dead_letters(partial(EIHLSqliteHandler, db_path), store)
+    assert store.get_dead_letters() == [] and load_corpus_index(store.pages_dir) == {}
+    with EIHLSqliteHandler(db_path) as db_handler:
+        team_stats = db_handler.fetch_all_data(table="match_team_stats")
+    assert {stats["match_id"] for stats in team_stats} == played_match_ids
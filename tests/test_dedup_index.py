@@ -0,0 +1,54 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from pypika import Field
+
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.Exceptions import DBReadFailed
+from src.dedup_index import load_key_index, upsert_new_or_changed_rows, values_equal
+from src.match import insert_championship_to_db
+
+
+def build_season_matches(num_matches: int) -> list[dict]:
+    return [{"eihl_web_match_id": f"{4000 + i}-fif-she", "championship_id": 36,
+             "match_date": datetime(2023, 1, 1 + i % 28, 19), "home_team": "Fife Flyers",
+             "away_team": "Sheffield Steelers" if i < 28 else "Cardiff Devils", "home_score": None,
+             "away_score": None} for i in range(num_matches)]
+
+
+def test_only_new_or_changed_matches_are_written():
+    season_matches = build_season_matches(40)
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        match_index = load_key_index(db_handler, "match", Field("championship_id") == 36)
+        assert upsert_new_or_changed_rows(db_handler, match_index, season_matches) == 40
+        # The index is updated with the written rows so they aren't written again
+        assert upsert_new_or_changed_rows(db_handler, match_index, season_matches) == 0
+
+        season_matches[3] = {**season_matches[3], "home_score": 4, "away_score": 1}
+        match_index = load_key_index(db_handler, "match", Field("championship_id") == 36)
+        assert len(match_index.rows) == 40
+        assert match_index.get_rows_to_write(season_matches) == [season_matches[3]]
+        assert load_key_index(db_handler, "match", Field("championship_id") == 37).rows == {}
+
+
+def test_failed_read_isnt_an_empty_index(monkeypatch):
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        monkeypatch.setattr(db_handler, "fetch_all_data", lambda query: None)
+        with pytest.raises(DBReadFailed):
+            load_key_index(db_handler, "match", Field("championship_id") == 36)
+
+
+def test_insert_championship_only_inserts_new_championships():
+    championship = {"eihl_web_id": 36, "name": "2022/23 Elite League", "start_date": datetime(2022, 9, 10)}
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        insert_championship_to_db(db_handler, championship, {**championship, "eihl_web_id": 37})
+        insert_championship_to_db(db_handler, championship)
+        assert len(db_handler.fetch_all_data(table="championship", columns=["eihl_web_id"])) == 2
+
+
+def test_values_equal_across_db_types():
+    assert values_equal(Decimal("0.9"), 0.9)
+    assert values_equal(1, True)
+    assert values_equal(datetime(2022, 9, 10).date(), datetime(2022, 9, 10))
+    assert not values_equal(None, 0)
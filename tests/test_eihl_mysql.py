@@ -0,0 +1,104 @@
+import pytest
+
+from src.Exceptions import DBNotAvailable
+from src.data_handlers import eihl_mysql
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler, MysqlDBPool
+
+
+class FakeCursor:
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def executemany(self, query, params):
+        self.db_conn.statements.append((query, params))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_upsert_data_chunks_rows_by_columns():
+    db_conn = FakeConnection()
+    db_handler = EIHLMysqlHandler(db_conn=db_conn)
+    rows = [{"match_id": 1, "team_name": "Fife Flyers", "shots": i} for i in range(5)]
+    rows.append({"match_id": 1, "team_name": "Sheffield Steelers", "saves": 22})
+
+    assert db_handler.upsert_data("match_team_stats", rows, chunk_size=2) == 6
+    assert db_conn.commits == 4
+    assert db_conn.statements[0] == (
+        "INSERT INTO `match_team_stats` (`match_id`,`team_name`,`shots`) VALUES (%s,%s,%s) "
+        "ON DUPLICATE KEY UPDATE `shots`=VALUES(`shots`)", [(1, "Fife Flyers", 0), (1, "Fife Flyers", 1)])
+    assert db_conn.statements[-1] == (
+        "INSERT INTO `match_team_stats` (`match_id`,`team_name`,`saves`) VALUES (%s,%s,%s) "
+        "ON DUPLICATE KEY UPDATE `saves`=VALUES(`saves`)", [(1, "Sheffield Steelers", 22)])
+
+
+def test_upsert_data_raises_when_a_chunk_fails(monkeypatch):
+    db_conn = FakeConnection()
+    db_handler = EIHLMysqlHandler(db_conn=db_conn)
+    rows = [{"match_id": 1, "team_name": "Fife Flyers", "shots": i} for i in range(3)]
+    rows.append({"match_id": 1, "team_name": "Sheffield Steelers", "shots": None})
+
+    def executemany(cursor, query, params):
+        if any(row[-1] is None for row in params):
+            raise ValueError("shots can't be NULL")
+        db_conn.statements.append((query, params))
+
+    monkeypatch.setattr(FakeCursor, "executemany", executemany)
+    with pytest.raises(ValueError):
+        db_handler.upsert_data("match_team_stats", rows, chunk_size=2)
+    # The chunk before the failed one stays committed
+    assert db_conn.commits == 1 and len(db_conn.statements) == 1
+
+
+class FakePoolConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.connected = True
+        self.reconnects = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def reconnect(self, attempts=1, delay=0):
+        self.reconnects += 1
+        self.connected = True
+
+
+def test_pool_reuses_and_reconnects_connections(monkeypatch):
+    opened = []
+    monkeypatch.setattr(eihl_mysql, "connect", lambda **kwargs: opened.append(FakePoolConnection()) or opened[-1])
+    db_pool = MysqlDBPool({"host": "test"}, pool_size=2, checkout_timeout=0.01)
+
+    with EIHLMysqlHandler(db_pool=db_pool) as db_handler:
+        # No connection is opened until the handler uses the DB
+        assert opened == []
+        first_conn = db_handler.db_conn
+    first_conn.connected = False
+    with db_pool.connection() as db_conn:
+        assert db_conn is first_conn and db_conn.reconnects == 1
+        with db_pool.connection():
+            with pytest.raises(DBNotAvailable):
+                db_pool.get_connection()
+    assert len(opened) == 2
+    assert db_pool.num_checkouts == 3 and db_pool.max_wait >= db_pool.total_wait / 3
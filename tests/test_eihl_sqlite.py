@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from benchmarks.pipeline import run_pipeline_benchmark
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.match import get_db_matches
+
+
+def test_upsert_data_matches_on_natural_key():
+    match = {"eihl_web_match_id": "4002-fif-she", "championship_id": 36, "match_date": datetime(2023, 1, 25, 19),
+             "home_team": "Fife Flyers", "away_team": "Sheffield Steelers", "home_score": None, "away_score": None}
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        assert db_handler.upsert_data("match", [match, {**match, "home_score": 3, "away_score": 2}]) == 2
+        matches = get_db_matches(db_handler, end_date=datetime(2023, 2, 1))
+        assert len(matches) == 1 and matches[0]["home_score"] == 3
+        assert matches[0]["match_date"] == datetime(2023, 1, 25, 19)
+
+        db_handler.upsert_data("match_team_stats", [{"match_id": 1, "team_name": "Fife Flyers", "shots": 31}] * 2)
+        assert db_handler.fetch_all_data(table="match_team_stats", columns=["shots"]) == [{"shots": 31}]
+
+
+def test_pipeline_benchmark_runs_offline(tmp_path):
+    results = run_pipeline_benchmark(num_seasons=2, matches_per_season=8, work_dir=tmp_path)
+    with EIHLSqliteHandler(str(tmp_path / "eihlstats.sqlite3")) as db_handler:
+        num_player_stats = len(db_handler.fetch_all_data(table="match_player_stats", columns=["match_id"]))
+        num_played = len([match for match in get_db_matches(db_handler) if match["home_score"] is not None])
+    assert results["refresh_db"]["pages"] > 0 and results["refresh_db"]["rows"] > 0
+    # Each played match has 24 players and goalies per team
+    assert num_played > 8 and num_player_stats == num_played * 48
+    assert results["update_recent_data"]["pages"] < results["refresh_db"]["pages"]
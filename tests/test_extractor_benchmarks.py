@@ -0,0 +1,63 @@
+"""
+Benchmarks of each extractor over the recorded EIHL pages. Run them on their own with:
+python -m pytest tests/test_extractor_benchmarks.py --benchmark-only
+"""
+from datetime import datetime
+
+import pytest
+
+from src.web_scraping.eihl_website_scraping import get_matches_from_web_gamecentre, get_gamecentre_url, \
+    get_match_info_from_match_page, extract_team_match_stats, get_match_player_stats, iter_match_player_stats, \
+    match_stats_strainer
+from src.utils import get_html_content
+
+pytest.importorskip("pytest_benchmark")
+
+match_url = "https://www.eliteleague.co.uk/game/"
+
+
+@pytest.mark.parametrize("season_id,num_matches,first_match_date", [(36, 8, datetime(2022, 9, 10, 19, 0)),
+                                                                     (22, 5, datetime(2003, 9, 12))])
+def test_get_matches_from_web_gamecentre(benchmark, replay_pages, season_id, num_matches, first_match_date):
+    matches = benchmark(get_matches_from_web_gamecentre, get_gamecentre_url(season_id))
+    assert len(matches) == num_matches
+    assert matches[0]["match_date"] == first_match_date
+
+
+@pytest.mark.parametrize("eihl_web_match_id,expected", [
+    ("4002-fif-she", {"eihl_web_match_id": "4002-fif-she", "match_date": datetime(2023, 1, 25, 19, 0),
+                      "home_team": "Fife Flyers", "match_win_type": "R", "home_score": 3, "away_score": 2,
+                      "away_team": "Sheffield Steelers"}),
+    ("2154-lon-bas", {"eihl_web_match_id": "2154-lon-bas", "match_date": datetime(2004, 3, 2),
+                      "home_team": "London Racers", "match_win_type": "R", "home_score": 4, "away_score": 0,
+                      "away_team": "Basingstoke Bison"})])
+def test_get_match_info_from_match_page(benchmark, replay_pages, eihl_web_match_id, expected):
+    match_info = benchmark(get_match_info_from_match_page, f"{match_url}{eihl_web_match_id}")
+    assert dict(match_info) == expected
+
+
+@pytest.mark.parametrize("eihl_web_match_id,home_shots,away_save_percentage", [("4002-fif-she", 31.0, 88.0),
+                                                                               ("2154-lon-bas", 0.0, 0.0)])
+def test_extract_team_match_stats(benchmark, replay_pages, eihl_web_match_id, home_shots, away_save_percentage):
+    match_team_stats = benchmark(extract_team_match_stats, f"{match_url}{eihl_web_match_id}/team-stats")
+    assert len(match_team_stats["home_team"]) == len(match_team_stats["away_team"]) == 10
+    assert match_team_stats["home_team"]["Shots"] == home_shots
+    assert match_team_stats["away_team"]["Save percentage"] == away_save_percentage
+
+
+@pytest.mark.parametrize("eihl_web_match_id,num_players", [("4002-fif-she", 44), ("2154-lon-bas", 36)])
+def test_iter_match_player_stats(benchmark, replay_pages, eihl_web_match_id, num_players):
+    def get_player_stats_rows():
+        res_beaus = get_html_content(f"{match_url}{eihl_web_match_id}/stats", parse_only=match_stats_strainer)
+        return list(iter_match_player_stats(res_beaus))
+
+    player_stats = benchmark(get_player_stats_rows)
+    assert len(player_stats) == num_players
+    assert all(stats["Position"] for _, stats in player_stats)
+
+
+def test_get_match_player_stats(benchmark, replay_pages):
+    # The optional pandas output
+    pytest.importorskip("pandas")
+    match_stats = benchmark(get_match_player_stats, f"{match_url}4002-fif-she/stats")
+    assert {team: len(stats) for team, stats in match_stats.items()} == {"Fife Flyers": 22, "Sheffield Steelers": 22}
@@ -0,0 +1,150 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from settings.settings import fetch_scheduler_settings, page_cache_settings
+from src.Exceptions import PageNotAvailable
+from src.web_scraping import async_fetcher, fetcher
+from src.web_scraping.async_fetcher import AsyncFetcher
+from src.web_scraping.fetch_scheduler import FetchScheduler, get_retry_delay, slot_poll_interval
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_scheduler(**settings) -> tuple[FetchScheduler, FakeClock]:
+    clock = FakeClock()
+    return FetchScheduler({**fetch_scheduler_settings, "requests_per_sec": None, **settings}, clock), clock
+
+
+def test_token_bucket_spaces_out_requests():
+    fetch_scheduler, clock = build_scheduler(requests_per_sec=2, burst=1)
+    assert [fetch_scheduler.reserve() for _ in range(3)] == [(True, 0), (True, 0.5), (True, 1.0)]
+    clock.now = 10
+    for _ in range(3):
+        fetch_scheduler.release(200, 0.1)
+    assert fetch_scheduler.reserve() == (True, 0)
+
+
+def test_concurrency_limit_backs_off_on_errors():
+    fetch_scheduler, clock = build_scheduler(max_concurrency=4)
+    assert all(fetch_scheduler.reserve()[0] for _ in range(4))
+    assert fetch_scheduler.reserve() == (False, slot_poll_interval)
+
+    fetch_scheduler.release(503, 0.1)
+    assert fetch_scheduler.concurrency_limit == 2 and not fetch_scheduler.reserve()[0]
+    fetch_scheduler.release(200, 0.1)
+    fetch_scheduler.release(200, 0.1)
+    # Only the slot of the slow response is freed and the limit is halved again
+    fetch_scheduler.release(200, 5)
+    assert fetch_scheduler.concurrency_limit < 2 and fetch_scheduler.reserve()[0]
+
+
+def test_circuit_breaker_pauses_requests():
+    fetch_scheduler, clock = build_scheduler(breaker_threshold=2, breaker_cooldown=10, max_breaker_cooldown=15)
+    for _ in range(2):
+        fetch_scheduler.reserve()
+        fetch_scheduler.release(None, 1)
+    assert fetch_scheduler.reserve() == (False, 10)
+
+    # A single request checks the website once the pause is over
+    clock.now = 10
+    assert fetch_scheduler.reserve() == (True, 0)
+    assert fetch_scheduler.reserve() == (False, slot_poll_interval)
+    fetch_scheduler.release(500, 1)
+    assert fetch_scheduler.reserve() == (False, 15)
+
+    clock.now = 25
+    assert fetch_scheduler.reserve()[0]
+    fetch_scheduler.release(200, 1)
+    assert fetch_scheduler.breaker_open_until is None and fetch_scheduler.reserve()[0]
+
+
+def test_retry_delay_is_jittered_and_honours_retry_after():
+    assert all(0 <= get_retry_delay(2, settings={"retry_backoff": 0.5}) <= 2 for _ in range(20))
+    assert get_retry_delay(0, "3") == 3
+    assert get_retry_delay(0, "3600", {"max_retry_backoff": 30}) == 30
+
+
+class FlakyAdapter(BaseAdapter):
+    def __init__(self, status_codes: list[int]):
+        super().__init__()
+        self.status_codes = status_codes
+        self.num_requests = 0
+
+    def send(self, request, **kwargs):
+        status_code = self.status_codes[min(self.num_requests, len(self.status_codes) - 1)]
+        if isinstance(status_code, Exception):
+            self.num_requests += 1
+            raise status_code
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = b"<html></html>"
+        response.url = request.url
+        self.num_requests += 1
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def flaky_site(monkeypatch):
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    fetch_scheduler, _ = build_scheduler(retry_backoff=0, max_retries=2)
+    monkeypatch.setattr(fetcher, "get_fetch_scheduler", lambda: fetch_scheduler)
+
+    def mount(status_codes: list[int]) -> FlakyAdapter:
+        adapter = FlakyAdapter(status_codes)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        monkeypatch.setattr(fetcher, "get_session", lambda: session)
+        return adapter
+
+    return mount
+
+
+def test_fetch_retries_server_errors(flaky_site):
+    adapter = flaky_site([503, 502, 200])
+    assert fetcher.fetch_page("https://www.eliteleague.co.uk/game/1") == b"<html></html>"
+    assert adapter.num_requests == 3
+
+
+def test_fetch_page_fails_once_retries_run_out(flaky_site):
+    adapter = flaky_site([503])
+    with pytest.raises(PageNotAvailable):
+        fetcher.fetch_page("https://www.eliteleague.co.uk/game/1")
+    assert adapter.num_requests == 3
+
+
+def test_request_errors_give_back_their_slot(flaky_site):
+    adapter = flaky_site([requests.TooManyRedirects("Exceeded 30 redirects")])
+    with pytest.raises(requests.TooManyRedirects):
+        fetcher.fetch("https://www.eliteleague.co.uk/game/1")
+    assert adapter.num_requests == 1
+    assert fetcher.get_fetch_scheduler().in_flight == 0
+
+
+def test_async_request_errors_give_back_their_slot(monkeypatch):
+    fetch_scheduler, _ = build_scheduler(retry_backoff=0, max_retries=2)
+    monkeypatch.setattr(async_fetcher, "get_fetch_scheduler", lambda: fetch_scheduler)
+
+    def send(request: httpx.Request):
+        raise httpx.DecodingError("Bad gzip", request=request)
+
+    async def fetch_page():
+        page_fetcher = AsyncFetcher()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(send)) as page_fetcher._client:
+            await page_fetcher._get_with_retries("https://www.eliteleague.co.uk/game/1", "www.eliteleague.co.uk")
+
+    with pytest.raises(httpx.DecodingError):
+        asyncio.run(fetch_page())
+    assert fetch_scheduler.in_flight == 0
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+
+from src.player_stats import get_player_stats_from_html
+from src.utils import parse_html
+from src.web_scraping.eihl_website_scraping import get_team_match_stats_from_html, match_stats_strainer, \
+    get_matches_from_web_gamecentre, find_gamecentre_container, gamecentre_strainer, iter_match_player_stats, \
+    get_team_stats_from_list, iter_matches_from_gamecentre, normalise_team_filters
+
+team_stats_page = """<html><head><title>Game</title></head><body>
+<main><div class="container"><div><h2>Team Stats</h2>
+<div><span>Shots</span><span>31</span><span>61</span></div>
+<div><span>Shots efficiency</span><span>12.00%</span><span>5.13%</span></div>
+<div><span>Saves</span><span>37</span><span>22</span></div>
+</div></div></main></body></html>"""
+
+gamecentre_page = """<html><body><main><div class="wrapper">
+<div class="container-fluid text-center text-md-left">
+<h2>Saturday 10.09.2022</h2>
+<div><span>19:00</span><span>Fife Flyers   3:2   Sheffield Steelers</span><a href="/game/4002-fif-she">details</a></div>
+<h2>Sunday 11.09.2022</h2>
+<div><span>16:00</span><span>Belfast Giants   -:-   Cardiff Devils</span><a href="/game/4003-bel-car">details</a></div>
+</div></div></main></body></html>"""
+
+player_stats_page = """<html><body><main><div class="container">
+<h2>Fife Flyers - players</h2><div><table><thead><tr><th>Jersey</th><th>Player name</th><th>Position</th><th>G</th>
+</tr></thead><tbody><tr><td>9</td><td>Bob Smith</td><td>F</td><td>1</td></tr></tbody></table></div>
+<h2>Sheffield Steelers - players</h2><div><table><thead><tr><th>Jersey</th><th>Player name</th><th>Position</th>
+<th>G</th></tr></thead><tbody><tr><td>19</td><td>Tom Jones</td><td>D</td><td>0</td></tr></tbody></table></div>
+</div></main></body></html>"""
+
+parser_configs = [("html.parser", False), ("lxml", False), ("lxml", True), ("html.parser", True)]
+
+
+@pytest.mark.parametrize("parser,use_strainers", parser_configs)
+def test_team_stats_parsers_match(parser, use_strainers):
+    res_beaus = parse_html(team_stats_page, match_stats_strainer, parser, use_strainers)
+    assert get_team_match_stats_from_html(res_beaus) == {
+        "home_team": {"Shots": 31.0, "Shots efficiency": 12.0, "Saves": 37.0},
+        "away_team": {"Shots": 61.0, "Shots efficiency": 5.13, "Saves": 22.0}}
+
+
+@pytest.mark.parametrize("parser,use_strainers", parser_configs)
+def test_gamecentre_parsers_match(parser, use_strainers):
+    baseline = get_matches_from_web_gamecentre(
+        None, find_gamecentre_container(parse_html(gamecentre_page, parser="html.parser", use_strainers=False)))
+    matches = get_matches_from_web_gamecentre(
+        None, find_gamecentre_container(parse_html(gamecentre_page, gamecentre_strainer, parser, use_strainers)))
+    assert len(matches) == 2
+    assert matches == baseline
+
+
+@pytest.mark.parametrize("parser,use_strainers", parser_configs)
+def test_player_stats_parsers_match(parser, use_strainers):
+    res_beaus = parse_html(player_stats_page, match_stats_strainer, parser, use_strainers)
+    player_stats = get_player_stats_from_html(res_beaus, {"match_id": 1}, {"Player name": "player_name"})
+    assert [[(p["team_name"], p["player_name"]) for p in team] for team in player_stats] == \
+           [[("Fife Flyers", "Bob Smith")], [("Sheffield Steelers", "Tom Jones")]]
+
+
+def test_player_stats_rows_are_typed():
+    goalies_page = player_stats_page.replace("</div></main>", """<h2>Fife Flyers - goalies</h2><div><table><thead>
+<tr><th>Jersey</th><th>Player name</th><th>SVS%</th><th>MIN</th></tr></thead><tbody><tr><td>30</td><td>Sam Lee</td>
+<td>92.5</td><td></td></tr></tbody></table></div></div></main>""")
+    res_beaus = parse_html(goalies_page, match_stats_strainer)
+    player_stats = list(iter_match_player_stats(res_beaus))
+    assert player_stats[0] == ("Fife Flyers", {"Jersey": 9, "Player name": "Bob Smith", "Position": "F", "G": 1})
+    assert player_stats[-1] == ("Fife Flyers", {"Jersey": 30, "Player name": "Sam Lee", "SVS%": 92.5, "MIN": None,
+                                                "Position": "GW"})
+
+
+@pytest.mark.parametrize("stat_list", [["Shots", "31", "61", "Shots efficiency", "12.00%", "5%"],
+                                       ["31", "61", "Shots", "12.00%", "5%", "Shots efficiency"]])
+def test_team_stats_from_list_layouts(stat_list):
+    home_team_stats, away_team_stats = {}, {}
+    get_team_stats_from_list(away_team_stats, home_team_stats, stat_list)
+    assert home_team_stats == {"Shots": 31.0, "Shots efficiency": 12.0}
+    assert away_team_stats == {"Shots": 61.0, "Shots efficiency": 5.0}
+
+
+def test_gamecentre_walk_stops_after_end_date():
+    gamecentre = find_gamecentre_container(parse_html(gamecentre_page, gamecentre_strainer))
+    matches = get_matches_from_web_gamecentre(None, gamecentre, end_date=datetime(2022, 9, 10, 23, 59))
+    assert [match["eihl_web_match_id"] for match in matches] == ["4002-fif-she"]
+
+    matches = get_matches_from_web_gamecentre(None, gamecentre, teams=["CARDIFF Devils"])
+    assert [match["match_date"] for match in matches] == [datetime(2022, 9, 11, 16)]
+
+
+def test_gamecentre_matches_are_streamed():
+    gamecentre = find_gamecentre_container(parse_html(gamecentre_page, gamecentre_strainer))
+    matches = iter_matches_from_gamecentre(gamecentre, team_filters=normalise_team_filters(["Fife"]))
+    assert next(matches)["eihl_web_match_id"] == "4002-fif-she"
+    assert next(matches, None) is None
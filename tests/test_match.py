@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.sample_pages import build_pipeline_corpus
+from settings.settings import page_cache_settings, eihl_schedule_url, championship_settings
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src import match
+from src.match import refresh_championships, update_eihl_scores_from_game_centre, get_db_matches, \
+    get_match_page_max_age, stream_schedule_matches, update_match_scores
+from src.work_discovery import MatchFilter
+from src.web_scraping.fetcher import get_session
+from src.web_scraping.replay import replay_corpus
+
+
+def test_championship_schedules_are_fetched_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    build_pipeline_corpus(tmp_path, num_seasons=3, matches_per_season=6)
+    with replay_corpus(tmp_path), EIHLSqliteHandler(":memory:") as db_handler:
+        replay_adapter = get_session().get_adapter(eihl_schedule_url)
+        schedules = refresh_championships(db_handler)
+        # The championship list and the schedule of each new championship
+        assert replay_adapter.replayed == 4 and sorted(schedules) == [100, 101, 102]
+        championships = db_handler.fetch_all_data(table="championship")
+        assert all(champ["start_date"] is not None for champ in championships)
+
+        update_eihl_scores_from_game_centre(db_handler, schedules=schedules)
+        assert replay_adapter.replayed == 4
+        assert len(get_db_matches(db_handler)) == 18
+
+
+@pytest.mark.parametrize("days_ago,home_score,expected", [
+    (0, None, 0),
+    (1, 3, 0),
+    (30, 3, None)
+])
+def test_recent_match_pages_are_revalidated(days_ago, home_score, expected):
+    # Matches in the recheck window go back to the website in case their stats were corrected
+    match = {"match_date": datetime.now() - timedelta(days=days_ago), "home_score": home_score, "away_score": 2}
+    assert get_match_page_max_age(match) == expected
+
+
+def test_schedule_matches_are_written_as_they_are_streamed(tmp_path, monkeypatch):
+    monkeypatch.setitem(page_cache_settings, "enabled", False)
+    monkeypatch.setitem(championship_settings, "schedule_batch_size", 3)
+    build_pipeline_corpus(tmp_path, num_seasons=2, matches_per_season=8)
+    now = datetime.now()
+    with replay_corpus(tmp_path), EIHLSqliteHandler(":memory:") as db_handler:
+        refresh_championships(db_handler)
+        matches = stream_schedule_matches(db_handler, MatchFilter(championship_ids=[100]), now)
+        first_match = next(matches)
+        # Only the first batch of the schedule has been read and written
+        assert len(get_db_matches(db_handler)) == 3
+        played_matches = [first_match, *matches]
+        assert len(played_matches) == 8 and all(match["match_id"] is not None for match in played_matches)
+
+        # The walk of the current season stops at the first match day after now
+        current_matches = list(stream_schedule_matches(db_handler, MatchFilter(championship_ids=[101]), now))
+        assert 0 < len(current_matches) < 8 and all(match["match_date"] <= now for match in current_matches)
+        assert all(match["match_date"].date() <= now.date() for match in get_db_matches(db_handler)
+                   if match["championship_id"] == 101)
+
+
+def test_update_match_scores_only_indexes_the_matches_it_updates(monkeypatch):
+    match_date = datetime(2023, 1, 25, 19)
+    match_info = {"match_date": match_date, "home_team": "Fife Flyers", "away_team": "Sheffield Steelers"}
+    monkeypatch.setattr(match, "get_match_info_from_match_page",
+                        lambda match_url, max_age=None: {**match_info, "home_score": 3, "away_score": 2})
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        db_handler.upsert_data("match", [{**match_info, "championship_id": 36},
+                                         {**match_info, "championship_id": 36, "match_date": datetime(2023, 1, 26)}])
+        queries = []
+        fetch_all_data = db_handler.fetch_all_data
+        monkeypatch.setattr(db_handler, "fetch_all_data", lambda query: queries.append(query) or fetch_all_data(query))
+        update_match_scores(db_handler, ["https://www.eliteleague.co.uk/game/4002-fif-she"])
+
+        assert len(queries) == 1 and '"match_date" IN' in queries[0]
+        assert [(db_match["match_date"], db_match["home_score"]) for db_match in get_db_matches(db_handler)] == \
+               [(match_date, 3), (datetime(2023, 1, 26), None)]
@@ -0,0 +1,116 @@
+from datetime import datetime
+from functools import partial
+
+import pytest
+
+from src import match_ingest, player_stats, team_stats
+from src.checkpoints import Checkpoint
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.dead_letters import DeadLetterStore
+from src.match_ingest import parse_match_pages, build_match_page_urls, ingest_matches, write_match_records, \
+    MatchRecord
+from src.scrape_state import get_match_scrape_states
+
+team_stats_page = b"""<html><body><main><div class="wrapper"><article><div>
+<div>25 Jan 2023, 19:00</div>
+<div><div><img src="fif.png"/><a><span>Fife</span><span>Flyers</span></a></div>
+<div><div>end</div><div class="match-score">3:2</div></div>
+<div><a><span>Sheffield</span><span>Steelers</span></a></div></div>
+</div></article>
+<div class="container"><div><h2>Team Stats</h2>
+<div><span>Shots</span><span>31</span><span>61</span></div>
+<div><span>Saves</span><span>37</span><span>22</span></div>
+</div></div></div></main></body></html>"""
+
+player_stats_page = b"""<html><body><main><div class="container">
+<h2>Fife Flyers - players</h2><div><table><thead><tr><th>Jersey</th><th>Player name</th><th>G</th></tr></thead>
+<tbody><tr><td>9</td><td>Bob Smith</td><td>1</td></tr></tbody></table></div>
+</div></main></body></html>"""
+
+
+def test_build_match_page_urls():
+    assert build_match_page_urls({"eihl_web_match_id": "4002-fif-she", "home_score": 3, "away_score": 2}) == {
+        "team_stats": "https://www.eliteleague.co.uk/game/4002-fif-she/team-stats",
+        "player_stats": "https://www.eliteleague.co.uk/game/4002-fif-she/stats"}
+    # The match page is fetched in case the team stats page doesn't have the score either
+    assert build_match_page_urls({"eihl_web_match_id": "4002-fif-she"})["match"] == \
+           "https://www.eliteleague.co.uk/game/4002-fif-she"
+
+
+def test_parse_match_pages_combines_all_extractors():
+    match = {"match_id": 7, "eihl_web_match_id": "4002-fif-she", "home_team": "Fife Flyers",
+             "away_team": "Sheffield Steelers", "home_score": None, "away_score": None}
+    match_record, = parse_match_pages({"team_stats": team_stats_page, "player_stats": player_stats_page}, match)
+
+    assert match_record.match_id == 7
+    assert (match_record.match_info["home_score"], match_record.match_info["away_score"],
+            match_record.match_info["match_win_type"]) == (3, 2, "R")
+    assert match_record.team_stats == [
+        {"shots": 31.0, "saves": 37.0, "team_name": "Fife Flyers", "match_id": 7},
+        {"shots": 61.0, "saves": 22.0, "team_name": "Sheffield Steelers", "match_id": 7}]
+    assert [(p["player_name"], p["goals"], p["team_name"]) for p in match_record.player_stats] == \
+           [("Bob Smith", 1, "Fife Flyers")]
+
+
+def test_ingest_of_an_empty_list_scrapes_nothing(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "eihlstats.sqlite3")
+    with EIHLSqliteHandler(db_path) as db_handler:
+        db_handler.insert_data("match", {"eihl_web_match_id": "4002-fif-she", "championship_id": 36,
+                                         "match_date": datetime(2023, 1, 25, 19), "home_team": "Fife Flyers",
+                                         "away_team": "Sheffield Steelers"})
+    scraped = []
+    monkeypatch.setattr(match_ingest, "scrape_matches", lambda matches, *args, **kwargs: scraped.extend(matches))
+    ingest_matches(partial(EIHLSqliteHandler, db_path), [])
+    ingest_matches(partial(EIHLSqliteHandler, db_path), iter([]))
+    assert scraped == []
+    ingest_matches(partial(EIHLSqliteHandler, db_path))
+    assert [match["eihl_web_match_id"] for match in scraped] == ["4002-fif-she"]
+
+
+@pytest.mark.parametrize("stats_module,update_stats", [(player_stats, player_stats.update_players_stats),
+                                                       (team_stats, team_stats.update_match_team_stats)])
+def test_stats_update_of_an_empty_list_scrapes_nothing(tmp_path, monkeypatch, stats_module, update_stats):
+    db_path = str(tmp_path / "eihlstats.sqlite3")
+    with EIHLSqliteHandler(db_path) as db_handler:
+        db_handler.insert_data("match", {"eihl_web_match_id": "4002-fif-she", "championship_id": 36,
+                                         "match_date": datetime(2023, 1, 25, 19), "home_team": "Fife Flyers",
+                                         "away_team": "Sheffield Steelers"})
+    scraped = []
+    monkeypatch.setattr(stats_module, "scrape_matches", lambda matches, *args, **kwargs: scraped.extend(matches))
+    update_stats(partial(EIHLSqliteHandler, db_path), matches=[])
+    assert scraped == []
+    update_stats(partial(EIHLSqliteHandler, db_path))
+    assert [match["eihl_web_match_id"] for match in scraped] == ["4002-fif-she"]
+
+
+def test_matches_that_fail_to_write_are_not_saved_as_scraped(tmp_path, monkeypatch):
+    matches = [{"match_id": match_id, "eihl_web_match_id": f"{match_id}-fif-she", "championship_id": 36,
+                "match_date": datetime(2023, 1, match_id, 19), "home_team": "Fife Flyers",
+                "away_team": "Sheffield Steelers"} for match_id in (1, 2)]
+    match_records = [MatchRecord(match["match_id"], match, {"home_score": 3, "away_score": 2},
+                                 [{"match_id": match["match_id"], "team_name": "Fife Flyers", "shots": 31.0}],
+                                 [{"match_id": match["match_id"], "team_name": "Fife Flyers",
+                                   "player_name": "Bob Smith", "goals": 1}]) for match in matches]
+    insert_player_stats_to_db = match_ingest.insert_player_stats_to_db
+
+    def fail_match_2(db_handler, *player_stats):
+        if any(stats["match_id"] == 2 for stats in player_stats):
+            raise RuntimeError("lost connection to the DB")
+        insert_player_stats_to_db(db_handler, *player_stats)
+
+    monkeypatch.setattr(match_ingest, "insert_player_stats_to_db", fail_match_2)
+    checkpoint = Checkpoint("test", tmp_path / "checkpoints")
+    dead_letters = DeadLetterStore(tmp_path / "dead_letters")
+    with EIHLSqliteHandler(str(tmp_path / "eihlstats.sqlite3")) as db_handler:
+        for match in matches:
+            db_handler.insert_data("match", match)
+        write_match_records(db_handler, match_records, checkpoint=checkpoint, dead_letters=dead_letters)
+        scrape_states = get_match_scrape_states(db_handler)
+        player_stats = db_handler.fetch_all_data(table="match_player_stats")
+
+    assert [stats["match_id"] for stats in player_stats] == [1]
+    assert scrape_states[1]["has_player_stats"] and scrape_states[1]["failure_count"] == 0
+    assert scrape_states[2]["failure_count"] == 1 and "lost connection" in scrape_states[2]["last_error"]
+    assert checkpoint.done == {"match": {1}}
+    dead_letter, = dead_letters.get_dead_letters("match")
+    assert dead_letter.key == "2" and dead_letter.stage == "write"
@@ -0,0 +1,29 @@
+import json
+
+from src.metrics import MetricsRegistry
+
+
+def test_metrics_export_as_prometheus_and_json(tmp_path):
+    registry = MetricsRegistry()
+
+    @registry.timed("eihl_db_seconds", handler="mysql")
+    def upsert_data():
+        registry.inc("eihl_db_rows_written_total", 20, handler="mysql", table="match")
+
+    upsert_data()
+    upsert_data()
+    registry.observe("eihl_fetch_seconds", 0.3, host="www.eliteleague.co.uk", status=200)
+    registry.observe("eihl_fetch_seconds", 40, host="www.eliteleague.co.uk", status=200)
+
+    assert registry.get_total("eihl_db_rows_written_total", table="match") == 40
+    assert registry.get_total("eihl_fetch_seconds") == 40.3
+    prometheus_text = registry.write("prometheus", tmp_path / "eihl.prom").read_text()
+    assert 'eihl_db_rows_written_total{handler="mysql",table="match"} 40' in prometheus_text
+    assert 'eihl_db_seconds_count{function="upsert_data",handler="mysql"} 2' in prometheus_text
+    assert 'eihl_fetch_seconds_bucket{host="www.eliteleague.co.uk",status="200",le="0.5"} 1' in prometheus_text
+    assert 'eihl_fetch_seconds_bucket{host="www.eliteleague.co.uk",status="200",le="+Inf"} 2' in prometheus_text
+
+    summary = json.loads(registry.write("json", tmp_path / "eihl.json").read_text())
+    fetch_summary = summary["histograms"]["eihl_fetch_seconds"][0]
+    assert fetch_summary["count"] == 2 and fetch_summary["labels"] == {"host": "www.eliteleague.co.uk",
+                                                                        "status": 200}
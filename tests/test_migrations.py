@@ -0,0 +1,71 @@
+from src.data_handlers.eihl_mysql import EIHLMysqlHandler
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.migrations import get_migrations, apply_migrations, get_pending_migrations, is_schema_current
+
+
+class FakeMigrationCursor:
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+        self.rows = []
+
+    def execute(self, query, params=None):
+        if query in self.db_conn.failing_statements:
+            raise RuntimeError(f"Unable to run {query}")
+        self.db_conn.statements.append(query)
+        if query.startswith("INSERT INTO schema_migrations"):
+            self.db_conn.versions.append(params[0])
+        self.rows = [(version,) for version in self.db_conn.versions] if query.startswith("SELECT version") else []
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeMigrationConnection:
+    def __init__(self, failing_statements=()):
+        self.statements = []
+        self.versions = []
+        self.failing_statements = failing_statements
+
+    def cursor(self):
+        return FakeMigrationCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_migrations_are_ordered_by_version():
+    migrations = get_migrations("mysql")
+    assert [migration.version for migration in migrations] == [1, 2]
+    assert all(len(migration.get_statements()) >= 2 for migration in migrations)
+    assert not any(statement.startswith("--") for statement in migrations[0].get_statements())
+
+
+def test_apply_migrations_records_versions():
+    db_conn = FakeMigrationConnection()
+    db_handler = EIHLMysqlHandler(db_conn=db_conn)
+    assert not is_schema_current(db_handler)
+
+    assert [migration.version for migration in apply_migrations(db_handler)] == [1, 2]
+    assert any("`match_natural_key_uq`" in statement for statement in db_conn.statements)
+    assert get_pending_migrations(db_handler) == [] and is_schema_current(db_handler)
+    assert apply_migrations(db_handler) == []
+
+
+def test_apply_migrations_stops_at_failed_migration():
+    failing_statement = get_migrations("mysql")[0].get_statements()[-1]
+    db_conn = FakeMigrationConnection(failing_statements=(failing_statement,))
+    db_handler = EIHLMysqlHandler(db_conn=db_conn)
+
+    assert apply_migrations(db_handler) == []
+    assert db_conn.versions == []
+
+
+def test_sqlite_schema_is_always_current():
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        assert is_schema_current(db_handler)
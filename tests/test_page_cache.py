@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from settings.settings import page_cache_settings
+from src.Exceptions import PageNotCached
+from src.web_scraping import fetcher, page_cache
+from src.web_scraping.page_cache import PageCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    test_cache = PageCache(tmp_path, ttl_rules=[(r"/schedule", 60), (r"/game/", None)], default_ttl=10)
+    yield test_cache
+    test_cache.close()
+
+
+def test_store_and_lookup(cache):
+    url = "https://www.eliteleague.co.uk/game/4002-fif-she/team-stats"
+    cache.store(url, b"<html>team stats</html>", {"ETag": '"abc"', "Last-Modified": "Wed, 25 Jan 2023 22:00:00 GMT"})
+    cached_page = cache.lookup(url)
+    assert cached_page.body == b"<html>team stats</html>"
+    assert cache.get_conditional_headers(cached_page) == {"If-None-Match": '"abc"',
+                                                          "If-Modified-Since": "Wed, 25 Jan 2023 22:00:00 GMT"}
+    assert cache.lookup("https://www.eliteleague.co.uk/game/1-abc-def") is None
+
+
+@pytest.mark.parametrize("url,age,max_age,expected", [
+    ("https://www.eliteleague.co.uk/schedule?id_season=36", 30, None, True),
+    ("https://www.eliteleague.co.uk/schedule?id_season=36", 90, None, False),
+    ("https://www.eliteleague.co.uk/game/4002-fif-she", 10 ** 8, None, True),
+    ("https://www.eliteleague.co.uk/game/4002-fif-she", 10, 0, False),
+    ("https://www.eliteleague.co.uk/team/310", 30, None, False)
+])
+def test_is_fresh(cache, url, age, max_age, expected):
+    cache.store(url, b"page")
+    cached_page = cache.lookup(url)
+    cached_page.fetched_at = time.time() - age
+    assert cache.is_fresh(cached_page, max_age) == expected
+
+
+def test_lru_eviction(tmp_path):
+    cache = PageCache(tmp_path, max_size_bytes=10 ** 6)
+    for i in range(3):
+        cache.store(f"https://www.eliteleague.co.uk/game/{i}", bytes(range(256)) * 100)
+        time.sleep(0.01)
+    # Reading page 0 makes page 1 the least recently used
+    cache.lookup("https://www.eliteleague.co.uk/game/0")
+    cache.max_size_bytes = cache.total_size() - 1
+    cache.evict()
+    assert cache.lookup("https://www.eliteleague.co.uk/game/1") is None
+    assert cache.lookup("https://www.eliteleague.co.uk/game/0") is not None
+    assert cache.lookup("https://www.eliteleague.co.uk/game/2") is not None
+    cache.close()
+
+
+def test_store_evicts_in_the_background(tmp_path):
+    cache = PageCache(tmp_path, max_size_bytes=10 ** 6)
+    cache.store("https://www.eliteleague.co.uk/game/0", bytes(range(256)) * 100)
+    cache.max_size_bytes = 1
+    cache.store("https://www.eliteleague.co.uk/game/1", bytes(range(256)) * 100)
+    cache.wait_for_eviction()
+    assert cache.total_size() == 0
+    cache.close()
+
+
+def test_offline_fetch_replays_cache(cache, monkeypatch):
+    monkeypatch.setattr(page_cache, "_page_cache", cache)
+    monkeypatch.setitem(page_cache_settings, "enabled", True)
+    monkeypatch.setitem(page_cache_settings, "offline", True)
+    url = "https://www.eliteleague.co.uk/game/4002-fif-she"
+    cache.store(url, b"<html>match</html>")
+    assert fetcher.fetch_page(url, max_age=0) == b"<html>match</html>"
+    with pytest.raises(PageNotCached):
+        fetcher.fetch_page("https://www.eliteleague.co.uk/game/2154-lon-bas")
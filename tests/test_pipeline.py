@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from src.pipeline import run_pipeline, Stage
+
+
+def test_items_flow_through_every_stage_with_bounded_queues():
+    consumed = []
+    written = []
+    max_read_ahead = 0
+
+    def read_items():
+        for item in range(50):
+            consumed.append(item)
+            yield item
+
+    async def double(item):
+        await asyncio.sleep(0)
+        return None if item % 10 == 0 else item * 2
+
+    async def write(item):
+        nonlocal max_read_ahead
+        # The slow last stage holds back the items read from the generator
+        await asyncio.sleep(0.001)
+        written.append(item)
+        max_read_ahead = max(max_read_ahead, len(consumed) - len(written))
+
+    async def close_write():
+        written.append("closed")
+
+    asyncio.run(run_pipeline(read_items(), [Stage("double", double, 3), Stage("write", write, 1, close_write)],
+                             queue_size=2))
+    assert sorted(written[:-1]) == [item * 2 for item in range(50) if item % 10 != 0]
+    assert written[-1] == "closed"
+    # Both queues, the workers and the 5 dropped items
+    assert max_read_ahead <= 2 + 3 + 2 + 1 + 5
+
+
+def test_stage_error_stops_the_pipeline():
+    processed = []
+
+    async def fail_on_five(item):
+        if item == 5:
+            raise ValueError("bad item")
+        return item
+
+    async def record(item):
+        processed.append(item)
+
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(run_pipeline(iter(range(10_000)), [Stage("check", fail_on_five, 2),
+                                                                        Stage("record", record, 1)],
+                                                  queue_size=4), timeout=5))
+    assert len(processed) < 100
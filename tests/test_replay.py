@@ -0,0 +1,40 @@
+import pytest
+
+from src.Exceptions import PageNotAvailable
+from src.scrape_engine import scrape_matches
+from src.web_scraping.fetcher import FetchStats, FetchTiming, fetch, fetch_page
+from src.web_scraping.replay import get_corpus_key
+
+
+def test_corpus_key_ignores_trailing_slash_and_query_order():
+    assert get_corpus_key("https://www.eliteleague.co.uk/schedule/?id_team=0&id_season=36") == \
+           get_corpus_key("https://www.eliteleague.co.uk/schedule?id_season=36&id_team=0")
+
+
+def test_replay_serves_recorded_pages(replay_pages):
+    content = fetch_page("https://www.eliteleague.co.uk/game/4002-fif-she/team-stats")
+    assert content == (replay_pages / "game_4002-fif-she_team-stats.html").read_bytes()
+    assert fetch("https://www.eliteleague.co.uk/game/9999-abc-def").status_code == 404
+    # The 404 page isn't passed on to the extractors as if it were the match
+    with pytest.raises(PageNotAvailable):
+        fetch_page("https://www.eliteleague.co.uk/game/9999-abc-def")
+
+
+def test_fetch_stats_are_bounded():
+    stats = FetchStats(max_samples=10)
+    for i in range(1, 101):
+        stats.record(FetchTiming("https://www.eliteleague.co.uk/", "www.eliteleague.co.uk", 200, i / 1000, 10))
+    summary = stats.summary()
+    assert len(stats.samples) == 10
+    assert summary["requests"] == 100 and summary["bytes"] == 1000
+    assert summary["first_ms"] == pytest.approx(1) and summary["max_ms"] == pytest.approx(100)
+    assert summary["mean_ms"] == pytest.approx(50.5)
+
+
+def test_replay_through_scrape_engine(replay_pages):
+    matches = [{"match_id": 1, "eihl_web_match_id": "4002-fif-she"},
+               {"match_id": 2, "eihl_web_match_id": "2154-lon-bas"}]
+    batches = []
+    scrape_matches(matches, lambda match: f"https://www.eliteleague.co.uk/game/{match['eihl_web_match_id']}/stats",
+                   lambda html, match: [(match["match_id"], len(html))], batches.append)
+    assert sorted(match_id for batch in batches for match_id, _ in batch) == [1, 2]
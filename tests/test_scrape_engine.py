@@ -0,0 +1,70 @@
+import pytest
+
+from settings.settings import page_cache_settings
+from src.scrape_engine import scrape_matches
+from src.web_scraping import page_cache
+from src.web_scraping.page_cache import PageCache
+
+
+@pytest.fixture
+def offline_cache(tmp_path, monkeypatch):
+    cache = PageCache(tmp_path)
+    monkeypatch.setattr(page_cache, "_page_cache", cache)
+    monkeypatch.setitem(page_cache_settings, "enabled", True)
+    monkeypatch.setitem(page_cache_settings, "offline", True)
+    yield cache
+    cache.close()
+
+
+def test_scrape_matches_batches_parsed_records(offline_cache):
+    matches = [{"match_id": i, "eihl_web_match_id": f"{i}-abc-def"} for i in range(10)]
+    for match in matches[:-1]:
+        offline_cache.store(f"https://www.eliteleague.co.uk/game/{match['eihl_web_match_id']}",
+                            str(match["match_id"]).encode())
+    batches = []
+
+    scrape_matches(matches, lambda match: f"https://www.eliteleague.co.uk/game/{match['eihl_web_match_id']}",
+                   lambda html, match: [{"match_id": match["match_id"], "html": html.decode()}] * 2,
+                   batches.append, settings={"db_batch_size": 4})
+
+    # The last match is not cached so it fails without stopping the other matches
+    records = [record for batch in batches for record in batch]
+    assert sorted(record["match_id"] for record in records) == sorted(list(range(9)) * 2)
+    assert all(record["html"] == str(record["match_id"]) for record in records)
+    assert all(len(batch) >= 4 for batch in batches[:-1])
+
+
+def parse_page_length(html, match):
+    return [{"match_id": match["match_id"], "length": len(html)}]
+
+
+def test_scrape_matches_with_process_parsers(offline_cache):
+    matches = [{"match_id": i} for i in range(4)]
+    for match in matches:
+        offline_cache.store(f"https://www.eliteleague.co.uk/game/{match['match_id']}", b"x" * match["match_id"])
+    batches = []
+
+    scrape_matches(matches, lambda match: f"https://www.eliteleague.co.uk/game/{match['match_id']}",
+                   parse_page_length, batches.append,
+                   settings={"parse_executor": "process", "parse_workers": 2})
+
+    records = sorted((record for batch in batches for record in batch), key=lambda record: record["match_id"])
+    assert records == [{"match_id": i, "length": i} for i in range(4)]
+
+
+def test_every_match_of_a_failed_batch_is_reported(offline_cache):
+    matches = [{"match_id": i} for i in range(4)]
+    for match in matches:
+        offline_cache.store(f"https://www.eliteleague.co.uk/game/{match['match_id']}", b"x")
+    failures = []
+
+    def write_batch(batch: list):
+        if any(record["match_id"] < 2 for record in batch):
+            raise ValueError("DB is down")
+
+    scrape_matches(matches, lambda match: f"https://www.eliteleague.co.uk/game/{match['match_id']}",
+                   parse_page_length, write_batch,
+                   on_error=lambda match, error, html, stage: failures.append((match["match_id"], stage)),
+                   settings={"db_batch_size": 2, "max_concurrency": 1, "parse_workers": 1})
+
+    assert failures == [(0, "write"), (1, "write")]
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.Exceptions import DBReadFailed
+from src.scrape_state import is_championship_scrape_complete, get_content_hash, get_match_scrape_states, \
+    save_match_scrape_states
+
+now = datetime(2023, 2, 1, 12, 0)
+complete_state = {"has_score": True, "has_team_stats": True, "has_player_stats": True, "failure_count": 0}
+
+
+def test_get_match_scrape_states_of_some_matches():
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        save_match_scrape_states(db_handler, [{"match_id": match_id, "last_fetched": now, **complete_state}
+                                              for match_id in (1, 2, 3)])
+        assert sorted(get_match_scrape_states(db_handler, [1, 3])) == [1, 3]
+        assert get_match_scrape_states(db_handler, []) == {}
+        assert sorted(get_match_scrape_states(db_handler)) == [1, 2, 3]
+
+
+class FailingLedgerHandler:
+    schema_dialect = "mysql"
+
+    def __init__(self):
+        self.queries = []
+
+    def fetch_all_data(self, query: str):
+        # The way the handlers report a read that failed
+        self.queries.append(query)
+        return None
+
+
+def test_failed_ledger_read_isnt_an_empty_ledger():
+    db_handler = FailingLedgerHandler()
+    with pytest.raises(DBReadFailed):
+        get_match_scrape_states(db_handler, [1, 3])
+    assert db_handler.queries == ["SELECT * FROM `match_scrape_state` WHERE `match_id` IN (1,3)"]
+
+
+@pytest.mark.parametrize("last_fetched,expected", [(datetime(2023, 4, 3), False), (datetime(2023, 4, 20), True)])
+def test_is_championship_scrape_complete(last_fetched, expected):
+    championship = {"eihl_web_id": 36, "end_date": datetime(2023, 4, 2).date()}
+    assert is_championship_scrape_complete(championship, {"last_fetched": last_fetched}) == expected
+
+
+def test_get_content_hash_ignores_key_order():
+    assert get_content_hash({"a": 1, "b": now}) == get_content_hash({"b": now, "a": 1})
+    assert get_content_hash({"a": 1}) != get_content_hash({"a": 2})
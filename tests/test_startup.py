@@ -0,0 +1,14 @@
+from benchmarks.startup import run_startup_benchmark, get_loaded_heavy_modules
+from settings.settings import startup_settings
+
+
+def test_cli_starts_within_budget():
+    results = run_startup_benchmark()
+    assert all(startup_ms <= startup_settings["max_startup_ms"] for startup_ms in results.values()), results
+
+
+def test_heavy_dependencies_are_imported_by_the_commands_that_need_them():
+    assert get_loaded_heavy_modules("import src.main") == []
+    assert get_loaded_heavy_modules("import src.cli; src.cli.build_arg_parser().parse_args(['sync'])") == []
+    assert get_loaded_heavy_modules("import src.data_handlers.eihl_mysql") == []
+    assert "pyarrow" not in get_loaded_heavy_modules("import src.stats_export")
@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+
+from src.Exceptions import DBReadFailed
+from src.stats_export import export_stats, read_stats_table, read_stats_columns, get_partition_paths
+
+
+class FakeStatsHandler:
+    def __init__(self, tables: dict[str, list[dict]], failing_table: str = None):
+        self.tables = tables
+        # Table whose read fails the way the real handlers' reads do
+        self.failing_table = failing_table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def fetch_all_data(self, query: str):
+        table = query.split('FROM "')[1].split('"')[0]
+        if table == self.failing_table:
+            return None
+        return [dict(row) for row in self.tables[table]]
+
+
+def build_tables() -> dict[str, list[dict]]:
+    matches = [{"match_id": i, "championship_id": 1 + i % 2, "match_date": datetime(2023, 1 + i % 3, 10),
+                "home_team": "Fife Flyers", "away_team": "Sheffield Steelers", "home_score": 3, "away_score": i}
+               for i in range(12)]
+    team_stats = [{"match_id": i, "team_name": team, "shots": 30 + i, "save_percentage": 91.5}
+                  for i in range(12) for team in ("Fife Flyers", "Sheffield Steelers")]
+    player_stats = [{"match_id": i, "team_name": "Fife Flyers", "player_name": f"Player {j}", "goals": j % 2,
+                     "mins_played": None} for i in range(12) for j in range(3)]
+    return {"match": matches, "match_team_stats": team_stats, "match_player_stats": player_stats}
+
+
+def test_export_only_rewrites_changed_partitions(tmp_path):
+    tables = build_tables()
+    assert export_stats(lambda: FakeStatsHandler(tables), tmp_path) == \
+           {"match": 6, "match_team_stats": 6, "match_player_stats": 6}
+    assert export_stats(lambda: FakeStatsHandler(tables), tmp_path) == \
+           {"match": 0, "match_team_stats": 0, "match_player_stats": 0}
+
+    tables["match_player_stats"][0]["goals"] = 4
+    assert export_stats(lambda: FakeStatsHandler(tables), tmp_path)["match_player_stats"] == 1
+    assert (tmp_path / "match_player_stats" / "1" / "2023-01.parquet").exists()
+
+
+def test_read_exported_stats(tmp_path):
+    export_stats(lambda: FakeStatsHandler(build_tables()), tmp_path)
+
+    team_stats = read_stats_table("match_team_stats", export_dir=tmp_path)
+    assert team_stats.num_rows == 24
+    matches = read_stats_table("match", championship_ids=[1], months=["2023-01"], export_dir=tmp_path)
+    assert sorted(matches.column("match_id").to_pylist()) == [0, 6]
+
+    player_columns = read_stats_columns("match_player_stats", ["match_id", "goals"], championship_ids=[2],
+                                        export_dir=tmp_path)
+    assert len(player_columns["goals"]) == 18 and player_columns["goals"].sum() == 6
+
+
+def test_failed_read_keeps_the_exported_partitions(tmp_path):
+    tables = build_tables()
+    export_stats(lambda: FakeStatsHandler(tables), tmp_path)
+    manifest = (tmp_path / "manifest.json").read_text()
+    tables["match"][0]["home_score"] = 5
+
+    with pytest.raises(DBReadFailed):
+        export_stats(lambda: FakeStatsHandler(tables, failing_table="match_player_stats"), tmp_path)
+    assert (tmp_path / "manifest.json").read_text() == manifest
+    partition_paths = get_partition_paths("match_player_stats", export_dir=tmp_path)
+    assert len(partition_paths) == 6 and all(path.exists() for path in partition_paths)
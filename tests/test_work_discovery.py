@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from settings.settings import scrape_state_settings
+from src.data_handlers.eihl_sqlite import EIHLSqliteHandler
+from src.work_discovery import find_matches_to_sync, find_matches_missing_stats, iter_match_pages, match_table
+
+now = datetime(2023, 3, 1, 12)
+complete_state = {"last_fetched": now, "has_score": True, "has_team_stats": True, "has_player_stats": True,
+                  "failure_count": 0}
+
+
+def insert_match(db_handler, match_id: int, match_date: datetime, has_score: bool = True,
+                 team_stats_teams: tuple = ("Fife Flyers", "Sheffield Steelers"), has_player_stats: bool = True,
+                 state: dict = None):
+    db_handler.upsert_data("match", [{"match_id": match_id, "match_date": match_date, "home_team": "Fife Flyers",
+                                      "away_team": "Sheffield Steelers", "home_score": 3 if has_score else None,
+                                      "away_score": 2 if has_score else None}], conflict_cols=("match_id",))
+    db_handler.upsert_data("match_team_stats", [{"match_id": match_id, "team_name": team, "shots": 30}
+                                                for team in team_stats_teams])
+    if has_player_stats:
+        db_handler.upsert_data("match_player_stats", [{"match_id": match_id, "team_name": "Fife Flyers",
+                                                       "player_name": "Bob Smith", "goals": 1}])
+    if state is not None:
+        db_handler.upsert_data("match_scrape_state", [{"match_id": match_id, **state}], conflict_cols=("match_id",))
+
+
+def test_find_matches_to_sync_pages_through_matches(monkeypatch):
+    monkeypatch.setitem(scrape_state_settings, "discovery_page_size", 2)
+    old_match_date = datetime(2022, 10, 1, 19)
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        insert_match(db_handler, 1, old_match_date, state=complete_state)
+        # Complete matches missing stats are only synced again while they're in the recheck window
+        insert_match(db_handler, 2, old_match_date + timedelta(days=1), team_stats_teams=("Fife Flyers",),
+                     state=complete_state)
+        insert_match(db_handler, 3, old_match_date + timedelta(days=2), has_score=False, team_stats_teams=(),
+                     has_player_stats=False)
+        insert_match(db_handler, 4, now + timedelta(days=2), has_score=False, team_stats_teams=(),
+                     has_player_stats=False)
+        insert_match(db_handler, 5, now - timedelta(days=1), state=complete_state)
+        insert_match(db_handler, 6, old_match_date + timedelta(days=3), has_score=False,
+                     state={"last_fetched": now, "failure_count": 5})
+        insert_match(db_handler, 7, old_match_date + timedelta(days=4))
+
+        assert [match["match_id"] for match in find_matches_to_sync(db_handler, now)] == [3, 5, 7]
+        assert [match["match_id"] for match in find_matches_missing_stats(
+            db_handler, ("match_team_stats",), end_date=now)] == [2, 3, 6]
+        pages = list(iter_match_pages(db_handler, match_table.match_date <= now))
+        assert [[match["match_id"] for match in page] for page in pages] == [[1, 2], [3, 5], [6, 7]]
+
+
+@pytest.mark.parametrize("match_date,state,expected", [
+    (datetime(2023, 1, 1), None, True),
+    (datetime(2023, 1, 1), complete_state, False),
+    (datetime(2023, 1, 1), {**complete_state, "has_player_stats": False}, True),
+    (datetime(2023, 1, 1), {**complete_state, "has_player_stats": False, "failure_count": 5}, False),
+    (now - timedelta(days=1), complete_state, True),
+    (now + timedelta(days=1), None, False)
+])
+def test_find_matches_to_sync_uses_the_scrape_state(match_date, state, expected):
+    with EIHLSqliteHandler(":memory:") as db_handler:
+        insert_match(db_handler, 1, match_date, state=state)
+        assert ([match["match_id"] for match in find_matches_to_sync(db_handler, now)] == [1]) == expected